@@ -0,0 +1,160 @@
+# Importing these to be able to run this example
+# from the main pyjuque folder
+from os.path import abspath, pardir, join
+import sys
+curr_path = abspath(__file__)
+root_path = abspath(join(curr_path, pardir, pardir))
+sys.path.append(root_path)
+
+import time
+import numpy as np
+import pandas as pd
+from pyjuque.Strategies import StrategyTemplate, strategy_signals
+from pyjuque.Strategies.Indicators import ema, rsi, bollinger_bands
+from pyjuque.Strategies.BBRSIStrategy import BBRSIStrategy
+from pyjuque.Strategies.EMACrossStrategy import EMACrossStrategy
+from pyjuque.Strategies.MomentumStrategy import MomentumStrategy
+
+
+## The example strategies as written in the examples folder: indicators
+## as dataframe columns (pandas_ta in the examples, the same values from
+## pyjuque.Strategies.Indicators here) and signals checked candle by candle
+class LoopMomentum(StrategyTemplate):
+    """ examples/Backtest_strategy_new.py """
+    def __init__(self, momentum_period=3):
+        self.momentum_period = momentum_period
+
+    def setUp(self, df):
+        long_signals = [0] * self.momentum_period
+        short_signals = [0] * self.momentum_period
+        close = df['close']
+        for i in range(self.momentum_period, len(df)):
+            all_increasing = True
+            all_decreasing = True
+            for j in range(i + 1 - self.momentum_period, i + 1):
+                all_increasing = all_increasing and (close[j] > close[j-1])
+                all_decreasing = all_decreasing and (close[j] < close[j-1])
+            long_signals.append(int(all_increasing))
+            short_signals.append(int(all_decreasing))
+        self.long_signals = long_signals
+        self.short_signals = short_signals
+        self.dataframe = df
+
+    def checkLongSignal(self, i = None):
+        return self.long_signals[i], None
+
+    def checkShortSignal(self, i = None):
+        return self.short_signals[i], None
+
+
+class LoopEMACross(StrategyTemplate):
+    """ examples/Backtest_Strategy.py """
+    def __init__(self, fast_ma_len = 10, slow_ma_len = 50):
+        self.fast_ma_len = fast_ma_len
+        self.slow_ma_len = slow_ma_len
+
+    def setUp(self, df):
+        df['slow_ma'] = ema(df['close'], self.slow_ma_len)
+        df['fast_ma'] = ema(df['close'], self.fast_ma_len)
+        self.dataframe = df
+
+    def checkLongSignal(self, i = None):
+        df = self.dataframe
+        if i < 1:
+            return False
+        if df['low'][i-1] < df['slow_ma'][i-1] and df['low'][i] > df['slow_ma'][i] \
+            and df['low'][i] > df['fast_ma'][i] and df['fast_ma'][i] > df['slow_ma'][i]:
+            return True
+        return False
+
+    def checkShortSignal(self, i = None):
+        df = self.dataframe
+        if i < 1:
+            return False
+        if (df['low'][i-1] > df['slow_ma'][i-1] or df['fast_ma'][i-1] > df['slow_ma'][i-1] ) \
+            and df['close'][i] < df['slow_ma'][i] and df['close'][i] < df['fast_ma'][i] \
+            and df['fast_ma'][i] < df['slow_ma'][i]:
+            return True
+        return False
+
+
+class LoopBBRSI(StrategyTemplate):
+    """ examples/Bot_StrategyFromTemplate.py """
+    def __init__(self, rsi_len = 8, bb_len = 100, rsi_ob = 50, rsi_os = 50):
+        self.rsi_ob = rsi_ob
+        self.rsi_os = rsi_os
+        self.bb_len = bb_len
+        self.rsi_len = rsi_len
+
+    def setUp(self, df):
+        df['rsi'] = rsi(df['close'], self.rsi_len)
+        df['lbb'], df['mbb'], df['ubb'] = bollinger_bands(df['close'], self.bb_len)
+        self.dataframe = df
+
+    def checkLongSignal(self, i = None):
+        df = self.dataframe
+        if i < 3:
+            return False
+        if (df["rsi"][i] / df["rsi"][i-1] > 1.2) and \
+            (df["rsi"][i-1] < self.rsi_os \
+                or df["rsi"][i-2] < self.rsi_os \
+                or df["rsi"][i-3] < self.rsi_os):
+            if ((df["open"][i] < df["lbb"][i] < df["close"][i]) and \
+                (df["open"][i-1] < df["lbb"][i-1] and df["close"][i-1] < df["lbb"][i-1])):
+                return True
+        if (df["rsi"][i-1] / df["rsi"][i-2] > 1.2) and \
+            (df["rsi"][i-1] < self.rsi_os \
+                or df["rsi"][i-2] < self.rsi_os \
+                or df["rsi"][i-3] < self.rsi_os):
+            if (df["close"][i-3] < df["lbb"][i-3] and df["close"][i-2] < df["lbb"][i-2] \
+                and df["close"][i-1] > df["lbb"][i-1] and df["close"][i] > df["lbb"][i]):
+                return True
+        return False
+
+    def checkShortSignal(self, i = None):
+        return False
+
+
+def random_walk(n_candles, seed=0):
+    rng = np.random.default_rng(seed)
+    close = 100 * np.exp(np.cumsum(rng.normal(0, 1e-3, n_candles)))
+    open_ = np.concatenate(([close[0]], close[:-1]))
+    spread = np.abs(rng.normal(0, 5e-4, n_candles))
+    return pd.DataFrame(dict(
+        time = np.arange(n_candles) * 60_000,
+        open = open_,
+        high = np.maximum(open_, close) * (1 + spread),
+        low = np.minimum(open_, close) * (1 - spread),
+        close = close,
+    ))
+
+
+def signals_time(strategy, df):
+    start = time.time()
+    strategy.setUp(df.copy())
+    signals = strategy_signals(strategy, len(df))
+    return time.time() - start, signals
+
+
+def main():
+    pairs = [
+        ('momentum', LoopMomentum(3), MomentumStrategy(3)),
+        ('ema cross', LoopEMACross(), EMACrossStrategy()),
+        ('bbrsi', LoopBBRSI(), BBRSIStrategy()),
+    ]
+    print('{:>10} {:>10} {:>12} {:>12} {:>10}'.format(
+        'strategy', 'candles', 'loop (s)', 'vector (s)', 'speedup'))
+    for n_candles in [10_000, 100_000]:
+        df = random_walk(n_candles)
+        for name, loop, vector in pairs:
+            loop_time, loop_signals = signals_time(loop, df)
+            vector_time, vector_signals = signals_time(vector, df)
+            for expected, got in zip(loop_signals, vector_signals):
+                assert np.array_equal(expected.astype(bool), got), \
+                    '{} signals differ'.format(name)
+            print('{:>10} {:>10} {:>12.3f} {:>12.4f} {:>9.0f}x'.format(name,
+                n_candles, loop_time, vector_time, loop_time / vector_time))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,69 @@
+# Importing these to be able to run this example 
+# from the main pyjuque folder
+from os.path import abspath, pardir, join
+import sys
+curr_path = abspath(__file__)
+root_path = abspath(join(curr_path, pardir, pardir))
+sys.path.append(root_path)
+
+import time
+import numpy as np
+import pandas as pd
+from pyjuque.Strategies import StrategyTemplate
+from pyjuque.Engine.BacktesterSundayTheQuant import Backtester
+
+
+## Opens one position on the second candle and holds it until the end
+## (holding from the first candle on is not a trade)
+class BuyAndHold(StrategyTemplate):
+    def setUp(self, df):
+        self.dataframe = df
+
+    def checkLongSignal(self, i):
+        return i == 1
+
+    def checkShortSignal(self, i):
+        return False
+
+
+def uptrend(n_candles, seed=0):
+    # never falls far enough below its highs to hit the trailing stop
+    rng = np.random.default_rng(seed)
+    close = 100 * np.exp(np.cumsum(np.abs(rng.normal(0, 1e-5, n_candles))))
+    return pd.DataFrame(dict(
+        time = np.arange(n_candles) * 60_000,
+        open = close,
+        high = close * 1.0005,
+        low = close * 0.9995,
+        close = close,
+    ))
+
+
+def main():
+    bot_config = {
+        'strategy': {'class': BuyAndHold, 'params': {}},
+        'starting_balance': 1000,
+        'entry_settings': {},
+        'exit_settings': {
+            'take_profit': 1000,
+            'stop_loss_value': 50,
+            'trailing_stop_loss': True,
+            'sell_on_end': True,
+        }
+    }
+    # time per candle should stay flat as the position is held longer
+    print('{:>10} {:>10} {:>14}'.format('candles', 'seconds', 'us / candle'))
+    for n_candles in [10_000, 20_000, 40_000, 80_000, 160_000]:
+        df = uptrend(n_candles)
+        bt = Backtester(bot_config)
+        start = time.time()
+        bt.backtest(df)
+        elapsed = time.time() - start
+        assert bt.entries[0][0] == df['time'][1] \
+            and bt.exits[0][0] == df['time'].iloc[-1], 'position got closed'
+        print('{:>10} {:>10.3f} {:>14.2f}'.format(
+            n_candles, elapsed, 1e6 * elapsed / n_candles))
+
+
+if __name__ == '__main__':
+    main()
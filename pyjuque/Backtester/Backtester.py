@@ -5,9 +5,16 @@ hello(at)tudorbarbulescu.com
 This class deals with backtesting.
 """
 
+import math
 import numpy as np 
 from time import time as timer
 from pyjuque.Backtester.BaseBacktester import BaseBacktester
+from pyjuque.Backtester.Kernels import pnl_curve, apply_exits, \
+    batch_pnl_curve, drawdown_stats, trade_ledger, trade_stats, TRADE_DTYPE
+from pyjuque.Backtester.Stream import StreamState
+from pyjuque.Backtester.MonteCarlo import resample_trades
+from pyjuque.Backtester.Metrics import curve_sums, in_trade, \
+    performance_metrics
 from pyjuque.Utils.Plotter import PlotData
 
 class Backtester(BaseBacktester):
@@ -32,15 +39,8 @@ class Backtester(BaseBacktester):
         # self.cumstrat_curve = []
         self.trades = []
         self.max_drawdown = 0.
-        # TODO: Calculate the following
-        self.gross_profit = 0.
-        self.gross_loss = 0.
-        self.max_flat_period = 0.
         self.max_equity = self.balance
-        self.winrate = 0.
-        self.profit_factor = 0.
         self.total_fees_paid = 0.
-        self.profit_avg_trade = 0.
         self.longest_drawdown_period = 0
         self.average_drawdown_period = 0
 
@@ -49,7 +49,26 @@ class Backtester(BaseBacktester):
         self.strategy.setUp(df=df, **strategy_kwargs)
         # extract position array from the strategy accross the given dataframe
         # 1 = long position, -1 = short, 0 = not holding
-        self.position = self._strategy_to_position()
+        self.position = self._strategy_to_position(len(self.strategy.dataframe))
+        self.data = self.strategy.dataframe
+        self.close = self._get_close(self.strategy.dataframe)
+        self.buy_price, self.sell_price = self._fill_prices(self.data,
+            self.position, self.signals)
+        self.n_candles = len(self.data)
+        has_time = 'time' in self.data.columns
+        self.start_time = self.data.time.iloc[0] if has_time else None
+        self.end_time = self.data.time.iloc[-1] if has_time else None
+        # close positions that hit their take profit / (trailing) stop loss
+        self.exit_price = None                  # Price of early exits (NaN otherwise)
+        self.exit_type = np.zeros(self.position.shape, dtype=np.int8)
+        self.ambiguous_exits = np.array([], dtype=np.int64)
+        if self.take_profit_value != math.inf or self.stop_loss_value > 0:
+            self._apply_exits()
+        # signal matrices (one row per param set) are backtested all at once
+        self.batched = self.position.ndim > 1
+        if self.batched:
+            self._backtest_batch()
+            return
         # get the indices of all trades
         self.idx_trades = np.where(np.diff(self.position) != 0)[0] + 1
         # initialise other arrays and variables
@@ -64,8 +83,6 @@ class Backtester(BaseBacktester):
         self.equity = []                        # Holds the EQUITY value of every candle
         self.total_trades = 0                   # Holds the total number of trades
         self.total_fees_paid = 0                # Holds the net amount of fees paid
-        self.data = self.strategy.dataframe
-        self.close = self._get_close(self.strategy.dataframe)
         l_d = len(self.data)
         l_t = len(self.idx_trades)
         # If we have at least one trade, compute the profits
@@ -78,82 +95,155 @@ class Backtester(BaseBacktester):
             else:
                 raise ValueError('idx_first_trade should be 1 or -1,' \
                     f' but is {self.position[self.idx_trades[0]]}!')
-            # Compute the pnl curve & trade by trade info
-            trade_id = 0
-            trades = []
-            pnl_curve = np.zeros(self.idx_trades[0])
-            prev_pnl = 0.
-            prev_long = False
-            # iterate through trade indices and build pnl curve section by section 
-            for i in range(l_t):
-                # get the start and end indices of this section
-                idx_st = self.idx_trades[i]
-                if i == l_t - 1:
-                    idx_end = l_d
-                else:
-                    idx_end = self.idx_trades[i+1]
-                # compute pnl_curve section for this trade
-                made_trade = False
-                if self.position[idx_st] == 1:
-                    section_pnl = (self.close[idx_st:idx_end+1] / self.close[idx_st]) - 1 - self.fee_cost
-                    section_pnl[-1] = section_pnl[-1] - self.fee_cost
-                    self.n_longs += 1
-                    made_trade = True
-                    prev_long = True
-                    self.idx_longs.append(idx_st)
-                elif self.position[idx_st] == -1:
-                    section_pnl = (self.close[idx_st] / self.close[idx_st:idx_end+1]) - 1 - self.fee_cost
-                    section_pnl[-1] = section_pnl[-1] - self.fee_cost
-                    self.n_shorts += 1
-                    made_trade = True
-                    prev_long = False
-                    self.idx_shorts.append(idx_st)
-                elif self.position[idx_st] == 0:
-                    section_pnl = [0] * (idx_end - idx_st - 1)
-                    if prev_long:
-                        self.idx_shorts.append(idx_st)
-                    else:
-                        self.idx_longs.append(idx_st)
-                else:
-                    raise ValueError(f"Getting position value " \
-                        f"{self.position[idx_st]}: other than -1, 0, 1!")
-                # add trade to trades list
-                if made_trade:
-                    trade_id += 1
-                    trades.append(dict(id = trade_id, pnl = section_pnl, is_long = prev_long))
-                # make trade part of entire pnl curve
-                section_pnl = prev_pnl + section_pnl
-                pnl_curve = np.concatenate((pnl_curve, section_pnl))
-                prev_pnl = pnl_curve[-1]
+            if not np.isin(self.position, (-1, 0, 1)).all():
+                raise ValueError(f"Getting position values " \
+                    f"{np.unique(self.position)}: other than -1, 0, 1!")
+            # Compute the pnl curve & trade by trade info in one pass
+            curve = pnl_curve(self.position, self.close, self.fee_cost, 
+                self.exit_price, self.buy_price, self.sell_price)
+            pnl_values = curve['pnl']
+            sides = curve['trade_sides']
+            starts = curve['trade_starts']
+            self.n_longs = int(np.count_nonzero(sides == 1))
+            self.n_shorts = int(np.count_nonzero(sides == -1))
+            # flat sections are drawn as exits of the previous trade
+            prev_side = sides[np.maximum.accumulate(
+                np.where(sides != 0, np.arange(l_t), 0))]
+            self.idx_longs = starts[(sides == 1) | ((sides == 0) & (prev_side != 1))]
+            self.idx_shorts = starts[(sides == -1) | ((sides == 0) & (prev_side == 1))]
+            self.trades = trade_ledger(curve, self.fee_cost, self.exit_type)
         else:
-            pnl_curve = np.zeros(l_d)
+            pnl_values = np.zeros(l_d)
+            self.trades = np.zeros(0, dtype=TRADE_DTYPE)
         ########
-        self.pnl = pnl_curve
+        self.pnl = pnl_values
         # Here we compute drawdown and equity curves
-        ret = 1 + self.pnl
-        self.drawdown = (ret / np.maximum.accumulate(ret)) - 1
-        self.max_drawdown = round(-np.amin(self.drawdown), 2)
-        dd_periods = np.diff(np.where(self.drawdown == 0)[0])
-        if len(dd_periods) > 0:
-            self.longest_drawdown_period = np.amax(dd_periods)
-            self.average_drawdown_period = np.average(dd_periods)
+        stats = drawdown_stats(self.pnl)
+        self.drawdown = stats['drawdown']
+        self.max_drawdown = stats['max_drawdown']
+        self.longest_drawdown_period = stats['longest_drawdown_period']
+        self.average_drawdown_period = stats['average_drawdown_period']
         self.equity = self.pnl * self.trade_amount
         self.max_equity = round(np.amax(self.equity), 2)
         self.total_trades = self.n_longs + self.n_shorts
         self.total_fees_paid = self.total_trades * 2 * self.fee_cost * self.trade_amount
+        self._compute_metrics()
+
+    def backtest_stream(self, chunks, **strategy_kwargs):
+        """ Backtests data too large to fit in memory, given as an iterable
+        of consecutive DataFrames (eg. Stream.read_ohlcv_chunks(path)).
+
+        Results are the ones backtest() gives on the whole data, as long as
+        the strategy's indicators warm up within `minimum_period` candles.
+        `trades` holds every trade, the curves (pnl, equity, drawdown,
+        position) and `data` only hold the last chunk. """
+        self._stream = StreamState(self)
+        for df in chunks:
+            self._stream.update(df, **strategy_kwargs)
+        self._stream.result()
+
+    def append(self, df_new, **strategy_kwargs):
+        """ Extends the backtest with the candles of `df_new`, which follow
+        the ones backtested by the previous calls (the first call starts
+        from scratch).
+
+        Only the new candles get processed, with the last `minimum_period`
+        ones before them for the strategy's indicators to warm up. Curves
+        and `data` hold all candles appended so far, and results are the
+        ones backtest() gives on all of them. """
+        if getattr(self, '_stream', None) is None:
+            self._stream = StreamState(self, keep_curves=True)
+        self._stream.update(df_new, **strategy_kwargs)
+        self._stream.result()
+
+    def monte_carlo(self, n_sims=10_000, **kwargs):
+        """ Resamples the trades of the last backtest `n_sims` times, see
+        MonteCarlo.resample_trades for the options and results """
+        if getattr(self, 'batched', False):
+            raise ValueError('Monte Carlo is not supported for batched backtests.')
+        return resample_trades(self.trades['pnl'], n_sims, **kwargs)
+
+    def _apply_exits(self):
+        """ Closes positions early on take profit / (trailing) stop loss. 
+        Rows of a batched position matrix are processed one by one. """
+        high, low = self._get_high_low(self.data)
+        rows = self.position if self.position.ndim > 1 else [self.position]
+        signals = self.signals if self.position.ndim > 1 else [self.signals]
+        stop_slippage = self._stop_slippage(self.data)
+        intrabar = self._intrabar(self._intrabar_bounds(self.data))
+        exits = [apply_exits(row, self.close, high, low,
+                self.take_profit_value, self.stop_loss_value, 
+                self.trailing_stop_loss, self.slippage, self.buy_price,
+                self.sell_price, stop_slippage, intrabar, row_signals)
+            for row, row_signals in zip(rows, signals)]
+        if self.position.ndim > 1:
+            self.position = np.stack([e['position'] for e in exits])
+            self.exit_price = np.stack([e['exit_price'] for e in exits])
+            self.exit_type = np.stack([e['exit_type'] for e in exits])
+        else:
+            self.position = exits[0]['position']
+            self.exit_price = exits[0]['exit_price']
+            self.exit_type = exits[0]['exit_type']
+            self.ambiguous_exits = exits[0]['ambiguous']
+
+    def _backtest_batch(self):
+        """ Backtests every row of a (n_param_sets, n_candles) position 
+        matrix at once. Curves become matrices and statistics arrays with 
+        one value per param set. """
+        curve = batch_pnl_curve(self.position, self.close, 
+            self.fee_cost, self.exit_price, self.buy_price, self.sell_price)
+        self.pnl = curve['pnl']
+        self.n_longs = curve['n_longs']
+        self.n_shorts = curve['n_shorts']
+        self.trades = np.zeros(0, dtype=TRADE_DTYPE)
+        # the pnl and side of every trade, by row
+        self.trade_returns = dict(pnl=curve['trade_pnl'],
+            is_long=curve['trade_is_long'])
+        stats = drawdown_stats(self.pnl)
+        self.drawdown = stats['drawdown']
+        self.max_drawdown = stats['max_drawdown']
+        self.longest_drawdown_period = stats['longest_drawdown_period']
+        self.average_drawdown_period = stats['average_drawdown_period']
+        self.equity = self.pnl * self.trade_amount
+        self.max_equity = np.round(np.amax(self.equity, axis=-1), 2)
+        self.total_trades = self.n_longs + self.n_shorts
+        self.total_fees_paid = self.total_trades * 2 * self.fee_cost * self.trade_amount
+        self._compute_metrics()
+
+    def _compute_metrics(self):
+        """ Performance metrics of every pnl curve, see Metrics """
+        self._compute_trade_stats()
+        self.buyhold_curve = self.close / self.close[0] - 1
+        sums = curve_sums(self.pnl, self.drawdown, in_trade(self.position))
+        self.metrics = performance_metrics(sums, self.pnl[..., -1],
+            -np.amin(self.drawdown, axis=-1), float(self.buyhold_curve[-1]),
+            self._periods_per_year(self.data))
+
+    def _compute_trade_stats(self):
+        """ Trade statistics (winrate, profit_factor..), see trade_stats,
+        kept in `stats` and as attributes """
+        trades = self.trade_returns if getattr(self, 'batched', False) \
+            else self.trades
+        self.stats = trade_stats(trades, self.trade_amount)
+        for key, value in self.stats.items():
+            setattr(self, key, value)
 
     def compute_plotting_signals(self):
         """ Called after running backtest, we compute all the plotting info. """
+        if getattr(self, 'batched', False):
+            raise ValueError('Plotting is not supported for batched backtests.')
+        # (x, y) array pairs, passed as they are to the plotly traces
         times = self.data.time.values
         closes = self.data.close.values
-        opens = self.data.open.values
-        l_d = len(self.data) 
-        self.longs = [(times[i], closes[i], 15) for i in self.idx_longs]
-        self.shorts = [(times[i],closes[i], 15) for i in self.idx_shorts]
-        self.pnl_curve = [(times[i], self.pnl[i]) for i in range(l_d)]
-        self.equity_curve = [(times[i], self.equity[i]) for i in range(l_d)]
-        self.drawdown_curve = [(times[i], self.drawdown[i]) for i in range(l_d)]
-        # self.max_pnl_curve = [(times[i], self.max_pnl[i]) for i in range(l_d)]
+        idx_longs = np.asarray(self.idx_longs, dtype=np.int64)
+        idx_shorts = np.asarray(self.idx_shorts, dtype=np.int64)
+        self.longs = (times[idx_longs], closes[idx_longs], 
+            np.full(len(idx_longs), 15))
+        self.shorts = (times[idx_shorts], closes[idx_shorts], 
+            np.full(len(idx_shorts), 15))
+        self.pnl_curve = (times, self.pnl)
+        self.equity_curve = (times, self.equity)
+        self.drawdown_curve = (times, self.drawdown)
 
     def get_fig(self, extra_indicators=None, **kwargs):
         """ """
@@ -183,42 +273,57 @@ class Backtester(BaseBacktester):
         return fig
 
     def return_results(self):
-        """ Returns a dict with the backtesting results """
-        if self.total_trades > 0:
-            self.profit_avg_trade = self.equity[-1] / self.total_trades
-        l_d = len(self.data)
+        """ Returns a dict with the backtesting results, or a list with one 
+        dict per param set for batched backtests """
+        if getattr(self, 'batched', False):
+            return [self._results(row) for row in range(len(self.pnl))]
+        return self._results()
+
+    def _results(self, row=None):
+        """ Results of the backtest, or of one `row` of a batched one """
+        pick = (lambda v: v) if row is None else (lambda v: v[row])
+        pnl = pick(self.pnl)
+        total_trades = pick(self.total_trades)
+        l_d = self.n_candles
         pnl_ratio = 0
         equity = 0
-        if(len(self.pnl) > 0):
-            pnl_ratio = self.pnl[-1]
-            equity = self.equity[-1]
+        if(len(pnl) > 0):
+            pnl_ratio = pnl[-1]
+            equity = pick(self.equity)[-1]
+        strategy_params = self.strategy_params
+        param_sets = getattr(self.strategy, 'param_sets', None)
+        if row is not None and param_sets is not None:
+            strategy_params = param_sets[row]
+        stats = {key: pick(value) for key, value in self.stats.items()}
         results = {
-            'start_time' : self.data.time.iloc[0],
-            'end_time' : self.data.time.iloc[-1],
+            'start_time' : self.start_time,
+            'end_time' : self.end_time,
             'strategy_name' : self.strategy_name,
-            'strategy_params' : self.strategy_params,
+            'strategy_params' : strategy_params,
             'trade_amount' : self.trade_amount,
             'profit_net' : equity,
-            'total_fees_paid': self.total_fees_paid,
-            # 'profit_factor' :  self.profit_factor, 
-            # 'gross_profit': self.gross_profit,
-            # 'gross_loss': self.gross_loss,
+            'total_fees_paid': pick(self.total_fees_paid),
+            'profit_factor' : stats['profit_factor'],
+            'gross_profit': stats['gross_profit'],
+            'gross_loss': stats['gross_loss'],
             'pnl_ratio': pnl_ratio,
-            # 'profit_avg_trade': self.profit_avg_trade,
-            # 'profit_net_longs': self.profit_net_longs,
-            # 'profit_net_shorts': self.profit_net_shorts,
-            'max_drawdown': self.max_drawdown,
-            'max_equity': self.max_equity,
-            'longest_drawdown_period': float(self.longest_drawdown_period / l_d),
-            'average_drawdown_period': int(self.average_drawdown_period),
+            'profit_avg_trade': stats['profit_avg_trade'],
+            'profit_net_longs': stats['profit_net_longs'],
+            'profit_net_shorts': stats['profit_net_shorts'],
+            'max_drawdown': pick(self.max_drawdown),
+            'max_equity': pick(self.max_equity),
+            'longest_drawdown_period': float(pick(self.longest_drawdown_period) / l_d),
+            'average_drawdown_period': int(pick(self.average_drawdown_period)),
             # 'max_flat_period' : self.max_flat_period,
             'timeframe' : self.timeframe,
             'symbol': self.symbol,
-            'n_longs' : self.n_longs,
-            'n_shorts': self.n_shorts,
-            'n_total_trades' : self.total_trades,
-            # 'n_winning_trades': self.n_winning_trades,
-            # 'n_losing_trades' : self.n_losing_trades,
-            # 'winrate' : self.winrate,
+            'n_longs' : pick(self.n_longs),
+            'n_shorts': pick(self.n_shorts),
+            'n_total_trades' : total_trades,
+            'n_winning_trades': stats['n_winning_trades'],
+            'n_losing_trades' : stats['n_losing_trades'],
+            'winrate' : stats['winrate'],
+            **{key: value if value is None or np.ndim(value) == 0 
+                else pick(value) for key, value in self.metrics.items()},
         }
         return results
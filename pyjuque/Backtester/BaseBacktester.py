@@ -1,6 +1,13 @@
 import math 
 import json
 import numpy as np
+from pyjuque.Backtester.Kernels import signals_to_position, delay_position, \
+    signal_sides
+from pyjuque.Backtester.Fills import get_fill_model
+from pyjuque.Backtester.Intrabar import get_lower_timeframe
+from pyjuque.Backtester.Metrics import periods_per_year
+from pyjuque.Strategies import strategy_signals
+from pyjuque.Strategies.IndicatorCache import cache_from_config
 
 class BaseBacktester():
     def __init__(self, params = {}, strategies_dir='pyjuque.Strategies'):
@@ -17,9 +24,13 @@ class BaseBacktester():
         self.fee = 0
         if params['entry_settings'].__contains__('fee'):
             self.fee = params['entry_settings']['fee']
-        self.slippage = 0   # NOT USED YET
+        self.slippage = 0   # percent, applied to stop loss exits
         if params['entry_settings'].__contains__('slippage'):
             self.slippage = params['entry_settings']['slippage']
+        # price market orders fill at, see Fills
+        self.fill_model = get_fill_model(params.get('fill_model'))
+        # sub candles resolving ambiguous exits, see Intrabar
+        self.lower_timeframe = get_lower_timeframe(params.get('lower_timeframe'))
         # GOLONG
         self.go_long = True
         if params['entry_settings'].__contains__('go_long'):
@@ -68,6 +79,10 @@ class BaseBacktester():
             self.exit_on_long = params['exit_settings']['exit_on_signal']
         self.strategies_dir = strategies_dir
         self.strategy = self._init_strategy(params)
+        # opt into memoizing the strategy's indicators
+        cache = cache_from_config(params)
+        if cache is not None:
+            self.strategy.indicator_cache = cache
         # remembers the amount of fees paid so far for the open position
         self.balance = self.initial_balance
         self.n_longs = 0
@@ -139,28 +154,21 @@ class BaseBacktester():
         if params['exit_settings'].__contains__('sell_on_end'):
             self.sell_on_end = params['exit_settings']['sell_on_end']
 
-    def _strategy_to_position(self):
-        """ Given a strategy, it returns a position array. """
-        position = []
-        pos = 0
-        # Convert signals lists to ndarrays if they are not already
-        if type(self.strategy.long_signals) != np.ndarray \
-            or type(self.strategy.short_signals) != np.ndarray:
-            self.strategy.long_signals = np.array(self.strategy.long_signals)
-            self.strategy.short_signals = np.array(self.strategy.short_signals)
-        s = self.strategy.long_signals - self.strategy.short_signals
-        for s_i in s.tolist():
-            if s_i != 0:
-                pos = s_i
-            position.append(pos)
-        position = np.asarray(position)
-        if self.go_long and self.go_short:
-            pass
-        elif self.go_long:
-            position = np.where(position==1, 1, 0)
-        elif self.go_short:
-            position = np.where(position==-1, -1, 0)
-        return position
+    def _strategy_to_position(self, n_candles):
+        """ Given a strategy set up on `n_candles` candles, it returns a 
+        position array. 
+        
+        If the strategy holds one row of signals per parameter set, the 
+        returned array has shape (n_param_sets, n_candles). The side of
+        every candle's signal, positions get re-entered on after an early
+        exit, is kept in `signals`. """
+        long_signals, short_signals = strategy_signals(self.strategy, n_candles)
+        position = signals_to_position(long_signals, short_signals, 
+            self.go_long, self.go_short)
+        # positions change once their orders fill
+        self.signals = delay_position(signal_sides(long_signals, short_signals,
+            self.go_long, self.go_short), self.fill_model.delay)
+        return delay_position(position, self.fill_model.delay)
 
     def _get_close(self, data):
         if 'close' in data.columns:
@@ -171,6 +179,53 @@ class BaseBacktester():
             raise ValueError('Dataframe does not contain "close" nor "price" columns')
         return close
 
+    def _get_high_low(self, data):
+        """ Returns the high and low arrays, falling back to close """
+        close = self._get_close(data)
+        high = np.asarray(data['high']) if 'high' in data.columns else close
+        low = np.asarray(data['low']) if 'low' in data.columns else close
+        return high, low
+
+    def _fill_prices(self, data, position, signals=None):
+        """ Buy and sell prices of the market orders sent for `position` 
+        (one row or a matrix), or re-entering it on `signals`, see Fills """
+        changes = np.flatnonzero(np.diff(np.atleast_2d(position), axis=-1).any(axis=0)) + 1
+        if signals is not None:
+            changes = np.union1d(changes,
+                np.flatnonzero(np.atleast_2d(signals).any(axis=0)))
+        candles = np.append(changes, position.shape[-1] - 1)
+        return self.fill_model.prices(data, self.trade_amount, candles)
+
+    def _intrabar_bounds(self, data, candle_duration=None):
+        """ Index of the first sub candle of every candle of `data` and of
+        the one after its last (none without a lower timeframe), see
+        LowerTimeframe.bounds """
+        if self.lower_timeframe is None:
+            return np.zeros(len(data), dtype=np.int64), np.zeros(len(data), dtype=np.int64)
+        return self.lower_timeframe.bounds(data['time'], candle_duration)
+
+    def _intrabar(self, bounds):
+        """ The `intrabar` argument of apply_exits for sub candle `bounds` """
+        if self.lower_timeframe is None:
+            return None
+        return bounds + (self.lower_timeframe.high, self.lower_timeframe.low)
+
+    def _periods_per_year(self, data):
+        """ Number of candles in a year, metrics get annualized with """
+        time = data['time'] if 'time' in data.columns else None
+        return periods_per_year(self.timeframe, time)
+
+    def _stop_slippage(self, data):
+        """ The `stop_slippage` argument of apply_exits: a function giving
+        the ratios stop loss buys and sells get worse by on candles of
+        `data`, on top of `slippage`, see Fills """
+        def stop_slippage(candles):
+            slippage = self.fill_model.slippage(data, self.trade_amount, candles)
+            if slippage is None:
+                return np.zeros(len(candles)), np.zeros(len(candles))
+            return slippage
+        return stop_slippage
+
     def _get_returns(self, close=None, data=None):
         if close == None and data == None:
             raise ValueError('Either one of "close" or "data" should be not empty.')
@@ -0,0 +1,253 @@
+"""
+Fill models: the prices market orders get filled at in backtests.
+
+A model gives, for every candle, the price a buy and a sell would fill at
+on it, plus the number of candles (`delay`) between the candle a signal
+comes on and the one its order fills on. Take profit orders keep filling
+at their level; stop losses fill at theirs, worsened by the model's
+slippage (if any) on top of the configured `slippage` percent.
+
+All backtesters take a `fill_model`: a FillModel or the name of one of
+FILL_MODELS ('close' by default).
+"""
+
+import numpy as np
+
+
+class FillModel():
+    """ Fills market orders at the close of the signal's candle """
+
+    # candles between a signal and its fill
+    delay = 0
+
+    def prices(self, data, amount=None, candles=None):
+        """ Returns the prices buys and sells fill at on every candle of
+        `data`, as two arrays. `amount` is the quote amount traded; only
+        the `candles` (indices) orders are sent on need real prices, the
+        others may hold the close. """
+        close = _close(data)
+        return close, close
+
+    def slippage(self, data, amount=None, candles=None):
+        """ Returns how much worse than their level stop losses fill on the
+        `candles` (indices) of `data`, every one by default, as (buy, sell)
+        ratio arrays, or None """
+        return None
+
+
+class CloseFill(FillModel):
+    pass
+
+
+class NextOpenFill(FillModel):
+    """ Fills market orders at the open of the candle after the signal """
+
+    delay = 1
+
+    def prices(self, data, amount=None, candles=None):
+        if 'open' not in data.columns:
+            return super().prices(data, amount, candles)
+        open_ = np.asarray(data['open'], dtype=np.float64)
+        return open_, open_
+
+
+class IntrabarFill(FillModel):
+    """ Fills market orders at the worst price of the signal's candle:
+    buys at its high and sells at its low """
+
+    def prices(self, data, amount=None, candles=None):
+        close = _close(data)
+        high = np.asarray(data['high'], dtype=np.float64) \
+            if 'high' in data.columns else close
+        low = np.asarray(data['low'], dtype=np.float64) \
+            if 'low' in data.columns else close
+        return high, low
+
+
+class OrderBookFill(FillModel):
+    """ Fills market orders at the average price of walking recorded order
+    book snapshots, like OrderBook.getOrderBookPrice does live, and worsens
+    stop loss fills by the same impact.
+
+    `books` maps snapshot times to snapshots holding 'bids' and 'asks'
+    lists of [price, quantity] levels, best first (or is a list of (time,
+    snapshot) pairs). Every candle uses the last snapshot recorded at or
+    before its time, if it's at most `max_age` old (same unit as the time
+    column); candles without one, or whose side of it is empty, fill at
+    the close. Orders larger than a snapshot's depth fill what it holds.
+    Backtesters trade quote amounts: with `is_quote_quantity` False, book
+    quantities are base ones and amounts get converted at the best price.
+    """
+
+    def __init__(self, books, is_quote_quantity=True, max_age=None):
+        self.is_quote_quantity = is_quote_quantity
+        self.max_age = max_age
+        if isinstance(books, dict):
+            books = books.items()
+        books = sorted(books, key=lambda item: item[0])
+        self.times = np.array([time for time, _ in books], dtype=np.float64)
+        self.asks = DepthSnapshots([book['asks'] for _, book in books],
+            is_quote_quantity)
+        self.bids = DepthSnapshots([book['bids'] for _, book in books],
+            is_quote_quantity)
+
+    def _snapshots(self, data, candles):
+        """ Index of the snapshot every one of `candles` fills against """
+        times = np.asarray(data['time'], dtype=np.float64)[candles]
+        snapshots = np.searchsorted(self.times, times, side='right') - 1
+        if self.max_age is not None and len(self.times) > 0:
+            age = times - self.times[np.maximum(snapshots, 0)]
+            snapshots[age > self.max_age] = -1
+        return snapshots
+
+    def _walk(self, side, snapshots, amount):
+        """ Average and best prices of trading `amount` against `side`
+        (asks or bids) of `snapshots`, NaN where there is none or it's
+        empty """
+        average = np.full(len(snapshots), np.nan)
+        best = np.full(len(snapshots), np.nan)
+        recorded = snapshots >= 0
+        recorded[recorded] = ~side.empty(snapshots[recorded])
+        rows = snapshots[recorded]
+        best[recorded] = side.best_price(rows)
+        if amount is not None and not self.is_quote_quantity:
+            amount = amount / best[recorded]
+        average[recorded] = side.average_price(rows, amount, clip=True)
+        return average, best
+
+    def prices(self, data, amount=None, candles=None):
+        close = _close(data)
+        buy, sell = close.copy(), close.copy()
+        candles = np.arange(len(close)) if candles is None \
+            else np.asarray(candles, dtype=np.int64)
+        snapshots = self._snapshots(data, candles)
+        for prices, side in ((buy, self.asks), (sell, self.bids)):
+            average, _ = self._walk(side, snapshots, amount)
+            walked = ~np.isnan(average)
+            prices[candles[walked]] = average[walked]
+        return buy, sell
+
+    def slippage(self, data, amount=None, candles=None):
+        candles = np.arange(len(data)) if candles is None \
+            else np.asarray(candles, dtype=np.int64)
+        snapshots = self._snapshots(data, candles)
+        buy_average, buy_best = self._walk(self.asks, snapshots, amount)
+        sell_average, sell_best = self._walk(self.bids, snapshots, amount)
+        buy_slippage = np.nan_to_num(buy_average / buy_best - 1)
+        sell_slippage = np.nan_to_num(1 - sell_average / sell_best)
+        return buy_slippage, sell_slippage
+
+
+class DepthSnapshots():
+    """ One side of recorded order books, as cumulative depth arrays.
+
+    Row `i` holds the levels of snapshot `i`: their `price`, the amount
+    available up to each of them (`depth`, in quote or base) and the price
+    weighted sum of that amount (`weighted`), padded to the deepest one.
+    """
+
+    def __init__(self, snapshots, is_quote_quantity=True):
+        n_levels = max([len(levels) for levels in snapshots], default=0)
+        price = np.full((len(snapshots), max(n_levels, 1)), np.nan)
+        quantity = np.zeros(price.shape)
+        for i, levels in enumerate(snapshots):
+            if len(levels) > 0:
+                levels = np.asarray(levels, dtype=np.float64)
+                price[i, :len(levels)] = levels[:, 0]
+                quantity[i, :len(levels)] = levels[:, 1]
+        size = price * quantity if is_quote_quantity else quantity
+        size[np.isnan(price)] = 0.
+        self.price = price
+        self.depth = np.cumsum(size, axis=1)
+        self.weighted = np.cumsum(np.nan_to_num(price) * size, axis=1)
+
+    def best_price(self, rows):
+        return self.price[rows, 0]
+
+    def empty(self, rows):
+        """ Whether each of the `rows` snapshots holds no level """
+        return self.depth[rows, -1] <= 0
+
+    def average_price(self, rows, amount=None, clip=False):
+        """ Average price of trading `amount` against each of the `rows`
+        snapshots, the best price if `amount` is None. All rows are walked
+        at once, binary searching the level every amount runs out on.
+        Amounts beyond a snapshot's depth raise a ValueError, or with
+        `clip` fill the depth it holds. """
+        rows = np.asarray(rows, dtype=np.int64)
+        if amount is None:
+            return self.best_price(rows)
+        amount = np.broadcast_to(np.asarray(amount, dtype=np.float64), rows.shape)
+        if clip:
+            amount = np.minimum(amount, self.depth[rows, -1])
+        level = _search_rows(self.depth, rows, amount)
+        if (level >= self.depth.shape[1]).any():
+            short = np.flatnonzero(level >= self.depth.shape[1])[0]
+            raise ValueError('Not enough depth in the order book to fill {}, '
+                'only {}.'.format(amount[short], self.depth[rows[short], -1]))
+        previous = level - 1
+        has_previous = previous >= 0
+        previous = np.maximum(previous, 0)
+        filled = np.where(has_previous, self.depth[rows, previous], 0.)
+        weighted = np.where(has_previous, self.weighted[rows, previous], 0.)
+        return (weighted + self.price[rows, level] * (amount - filled)) / amount
+
+
+def _search_rows(cumulative, rows, values):
+    """ For every `rows[k]` of the row sorted `cumulative` matrix, the first
+    column holding at least `values[k]` (its length if none does). A binary
+    search run on all rows at once. """
+    low = np.zeros(len(rows), dtype=np.int64)
+    high = np.full(len(rows), cumulative.shape[1], dtype=np.int64)
+    while (low < high).any():
+        active = low < high
+        mid = (low + high) // 2
+        below = cumulative[rows, np.minimum(mid, cumulative.shape[1] - 1)] < values
+        low = np.where(active & below, mid + 1, low)
+        high = np.where(active & ~below, mid, high)
+    return low
+
+
+def book_average_price(levels, amount=None, is_quote_quantity=True):
+    """ Average price of trading `amount` against the order book `levels`,
+    the best one if `amount` is None """
+    snapshot = DepthSnapshots([levels], is_quote_quantity)
+    return float(snapshot.average_price([0], amount)[0])
+
+
+FILL_MODELS = dict(
+    close = CloseFill,
+    next_open = NextOpenFill,
+    intrabar = IntrabarFill,
+)
+
+
+def get_fill_model(fill_model=None):
+    """ Returns the FillModel for `fill_model`, a FillModel, the name of
+    one of FILL_MODELS or None (fill at the close) """
+    if fill_model is None:
+        return CloseFill()
+    if isinstance(fill_model, str):
+        if fill_model not in FILL_MODELS:
+            raise ValueError('Unknown fill model {}, should be one of {} or '
+                'a FillModel.'.format(fill_model, list(FILL_MODELS.keys())))
+        return FILL_MODELS[fill_model]()
+    return fill_model
+
+
+def order_prices(fill_model, data, amount=None):
+    """ Prices at which orders sent on every candle of `data` get filled,
+    for backtesters filling them right away. Orders the data ends before
+    filling fill at the last close. """
+    buy, sell = fill_model.prices(data, amount)
+    delay = fill_model.delay
+    if delay == 0:
+        return buy, sell
+    close = _close(data)
+    return tuple(np.concatenate((prices[delay:], close[-delay:]))
+        for prices in (buy, sell))
+
+
+def _close(data):
+    column = 'close' if 'close' in data.columns else 'price'
+    return np.asarray(data[column], dtype=np.float64)
@@ -0,0 +1,60 @@
+"""
+Lower timeframe data used to resolve ambiguous candles.
+
+When a candle touches both the take profit and the stop loss of a trade,
+its high and low don't tell which came first, and the backtesters assume
+the stop loss did. Given the candles of a lower timeframe (eg. 1m candles
+for a 1h backtest), apply_exits looks the sub candles of those ambiguous
+candles only up, through an index mapping every candle to its sub candles
+computed once with two binary searches, and exits on the first level
+they touch.
+
+Backtesters take it as `lower_timeframe`: a LowerTimeframe or a DataFrame
+holding time, high and low columns.
+"""
+
+import numpy as np
+
+
+class LowerTimeframe():
+    """ Candles of a lower timeframe, sorted by time. The sub candles of a
+    candle are the ones opened within `candle_duration` (same unit as the
+    time column) of its open, by default the typical (median) gap between
+    the candles they're mapped against. """
+
+    def __init__(self, df, candle_duration=None):
+        self.time = np.asarray(df['time'], dtype=np.float64)
+        self.high = np.asarray(df['high'], dtype=np.float64)
+        self.low = np.asarray(df['low'], dtype=np.float64)
+        self.candle_duration = candle_duration
+
+    def bounds(self, time, candle_duration=None):
+        """ For every candle opened at `time`, the index of its first sub
+        candle and the one after its last. `candle_duration` is used when
+        the LowerTimeframe wasn't given one, eg. inferred from the candles
+        before `time`. """
+        time = np.asarray(time, dtype=np.float64)
+        duration = self.candle_duration
+        if duration is None:
+            duration = candle_duration
+        if duration is None:
+            duration = median_gap(time)
+        start = np.searchsorted(self.time, time, side='left')
+        end = np.searchsorted(self.time, time + duration, side='left')
+        return start, end
+
+
+def median_gap(time):
+    """ Typical (median) gap between candles opened at `time` """
+    if len(time) < 2:
+        raise ValueError('Need two candles or a candle_duration to '
+            'map candles to their sub candles.')
+    return float(np.median(np.diff(np.asarray(time, dtype=np.float64))))
+
+
+def get_lower_timeframe(lower_timeframe=None):
+    """ Returns the LowerTimeframe for `lower_timeframe`, a LowerTimeframe,
+    a DataFrame of candles or None """
+    if lower_timeframe is None or isinstance(lower_timeframe, LowerTimeframe):
+        return lower_timeframe
+    return LowerTimeframe(lower_timeframe)
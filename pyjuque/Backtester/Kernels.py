@@ -0,0 +1,574 @@
+"""
+Array kernels used by the backtesters.
+
+Every function in here works on raw NumPy arrays (no DataFrames, no per
+candle Python loops) so that it stays fast on multi-year 1m data.
+"""
+
+import math
+import numpy as np
+
+# Reasons for which a position was closed before the next signal
+EXIT_TAKE_PROFIT = 1
+EXIT_STOP_LOSS = 2
+EXIT_TRAILING_STOP = 3
+
+# One record per trade, `fees` and `pnl` as ratios of the amount traded
+TRADE_DTYPE = np.dtype([
+    ('id', np.int64),
+    ('entry', np.int64),            # index of the entry candle
+    ('exit', np.int64),             # index of the exit candle
+    ('is_long', np.bool_),
+    ('entry_price', np.float64),
+    ('exit_price', np.float64),
+    ('fees', np.float64),
+    ('pnl', np.float64),
+    ('exit_type', np.int8),         # 0 or one of the EXIT_* constants
+])
+
+
+def pnl_curve(position, close, fee_cost=0., exit_price=None, buy_price=None,
+    sell_price=None):
+    """ Computes the pnl curve of a position array in a single pass.
+
+    `position` holds 1 (long), -1 (short) or 0 (flat) for every candle and
+    `close` the price every position gets marked / filled at. Every section
+    between two position changes is a trade: it pays `fee_cost` when it's
+    entered and again when it's exited, and its pnl is added on top of the
+    pnl accumulated by all previous trades.
+
+    If given, `exit_price` overrides the price a trade is exited at on the
+    candles where it is not NaN (eg. take profit or stop loss fills), and
+    `buy_price` / `sell_price` the price trades are entered and exited at
+    (see Fills); positions are still marked at `close`.
+
+    Returns a dict holding the `pnl` curve (one value per candle) plus the
+    start index (`trade_starts`) and side (`trade_sides`) of every section,
+    the exit index (`trade_exits`), the return (`trade_pnls`) and the entry
+    and exit fills (`trade_entry_prices`, `trade_exit_prices`) of every
+    non-flat section.
+    """
+    position = np.asarray(position)
+    close = np.asarray(close, dtype=np.float64)
+    l_d = len(position)
+    pnl = np.zeros(l_d)
+    idx_trades = np.flatnonzero(np.diff(position)) + 1
+    empty = np.array([], dtype=np.int64)
+    if len(idx_trades) == 0:
+        return dict(pnl=pnl, trade_starts=empty, trade_sides=empty,
+            trade_exits=empty, trade_pnls=np.array([]),
+            trade_entry_prices=np.array([]), trade_exit_prices=np.array([]))
+    sides = position[idx_trades]
+    buy_price, sell_price, entry_fill = _fill_prices(position, close, 
+        buy_price, sell_price)
+    # holding before the first change does not count as a trade
+    starts = np.zeros(l_d, dtype=np.int64)
+    starts[idx_trades] = idx_trades
+    starts = np.maximum.accumulate(starts)
+    side = np.zeros(l_d, dtype=np.int64)
+    side[idx_trades[0]:] = position[idx_trades[0]:]
+    # pnl of every candle relative to the start of its section
+    entry = entry_fill[starts]
+    longs = side == 1
+    shorts = side == -1
+    pnl[longs] = close[longs] / entry[longs] - 1 - fee_cost
+    pnl[shorts] = entry[shorts] / close[shorts] - 1 - fee_cost
+    # result of every section, realised at the start of the next one
+    exits = np.append(idx_trades[1:], l_d - 1)
+    fill = np.where(sides == 1, sell_price[exits], buy_price[exits])
+    if exit_price is not None:
+        fill = np.where(np.isnan(exit_price[exits]), fill, exit_price[exits])
+    entered = entry_fill[idx_trades]
+    exit_pnl = np.zeros(len(idx_trades))
+    exit_pnl[sides == 1] = fill[sides == 1] / entered[sides == 1] - 1
+    exit_pnl[sides == -1] = entered[sides == -1] / fill[sides == -1] - 1
+    exit_pnl[sides != 0] -= 2 * fee_cost
+    # the last section is closed on the last candle, at its fill price
+    if sides[-1] != 0:
+        pnl[-1] -= fee_cost
+        if sides[-1] == 1:
+            pnl[-1] += sell_price[-1] / entered[-1] - close[-1] / entered[-1]
+        else:
+            pnl[-1] += entered[-1] / buy_price[-1] - entered[-1] / close[-1]
+    # add the pnl of all previous sections to every section
+    offsets = np.concatenate(([0.], np.cumsum(exit_pnl[:-1])))
+    is_start = np.zeros(l_d, dtype=bool)
+    is_start[idx_trades] = True
+    section = np.cumsum(is_start) - 1
+    pnl[idx_trades[0]:] += offsets[section[idx_trades[0]:]]
+    made_trade = sides != 0
+    return dict(pnl=pnl, trade_starts=idx_trades, trade_sides=sides,
+        trade_exits=exits[made_trade], trade_pnls=exit_pnl[made_trade],
+        trade_entry_prices=entered[made_trade], trade_exit_prices=fill[made_trade])
+
+
+def trade_ledger(curve, fee_cost=0., exit_type=None, offset=0):
+    """ Packs the trades of a pnl_curve result into a TRADE_DTYPE array,
+    numbered from 1. `exit_type` holds the EXIT_* constant of every candle
+    and `offset` is added to candle indices. """
+    made_trade = curve['trade_sides'] != 0
+    trades = np.zeros(int(np.count_nonzero(made_trade)), dtype=TRADE_DTYPE)
+    trades['id'] = np.arange(1, len(trades) + 1)
+    trades['entry'] = curve['trade_starts'][made_trade] + offset
+    trades['exit'] = curve['trade_exits'] + offset
+    trades['is_long'] = curve['trade_sides'][made_trade] == 1
+    trades['entry_price'] = curve['trade_entry_prices']
+    trades['exit_price'] = curve['trade_exit_prices']
+    trades['fees'] = 2 * fee_cost
+    trades['pnl'] = curve['trade_pnls']
+    if exit_type is not None:
+        trades['exit_type'] = exit_type[curve['trade_exits']]
+    return trades
+
+
+def trade_stats(trades, trade_amount=1.):
+    """ Statistics of a TRADE_DTYPE array, amounts in the currency of
+    `trade_amount`. Trades that don't make a profit count as losing ones.
+
+    Also takes the `trade_pnl` / `trade_is_long` matrices of
+    batch_pnl_curve, as a dict of `pnl` and `is_long`, and then returns
+    arrays with the statistics of every row. """
+    profit = np.asarray(trades['pnl'], dtype=np.float64) * trade_amount
+    is_long = np.asarray(trades['is_long'], dtype=bool)
+    made = ~np.isnan(profit)
+    wins = profit > 0
+    n_trades = np.count_nonzero(made, axis=-1)
+    n_wins = np.count_nonzero(wins, axis=-1)
+    gross_profit = np.sum(profit, axis=-1, where=wins)
+    gross_loss = np.sum(profit, axis=-1, where=made & ~wins)
+    with np.errstate(divide='ignore', invalid='ignore'):
+        profit_factor = np.where(gross_loss < 0, gross_profit / -gross_loss,
+            np.where(gross_profit > 0, math.inf, 0.))
+        profit_avg_trade = np.where(n_trades > 0,
+            np.sum(profit, axis=-1, where=made) / n_trades, 0.)
+        winrate = np.where(n_trades > 0, n_wins / n_trades, 0.)
+    stats = dict(
+        gross_profit = gross_profit,
+        gross_loss = gross_loss,
+        profit_factor = profit_factor,
+        profit_avg_trade = profit_avg_trade,
+        profit_net_longs = np.sum(profit, axis=-1, where=made & is_long),
+        profit_net_shorts = np.sum(profit, axis=-1, where=made & ~is_long),
+        n_winning_trades = n_wins,
+        n_losing_trades = n_trades - n_wins,
+        winrate = winrate,
+    )
+    if profit.ndim == 1:
+        return {key: np.asarray(value).item() for key, value in stats.items()}
+    return stats
+
+
+def _fill_prices(position, close, buy_price=None, sell_price=None):
+    """ Buy and sell prices defaulting to close, and the price a position
+    entered on every candle fills at """
+    buy_price = close if buy_price is None \
+        else np.asarray(buy_price, dtype=np.float64)
+    sell_price = close if sell_price is None \
+        else np.asarray(sell_price, dtype=np.float64)
+    return buy_price, sell_price, np.where(position == 1, buy_price, sell_price)
+
+
+def delay_position(position, delay=0):
+    """ Shifts a position array (or matrix rows) `delay` candles later, for
+    orders filling after the candle of their signal. The first candles
+    keep the first position, which was held before any signal. """
+    if delay == 0 or position.shape[-1] == 0:
+        return position
+    delayed = np.empty_like(position)
+    delayed[..., delay:] = position[..., :-delay]
+    delayed[..., :delay] = position[..., :1]
+    return delayed
+
+
+def signals_to_position(long_signals, short_signals, go_long=True, go_short=False):
+    """ Forward fills long / short signals into a position array.
+
+    Works on a single series of signals or on a 2D `(n_param_sets, n_candles)`
+    matrix, in which case every row is filled independently. A long signal
+    opens (or keeps) a long position, a short signal a short one, and the
+    position is held until the opposite signal comes in. Positions on a side
+    we don't trade are replaced by 0 (flat).
+    """
+    long_signals = np.asarray(long_signals)
+    short_signals = np.asarray(short_signals)
+    if long_signals.dtype == bool:
+        long_signals = long_signals.astype(np.int8)
+    if short_signals.dtype == bool:
+        short_signals = short_signals.astype(np.int8)
+    s = long_signals - short_signals
+    if s.shape[-1] == 0:
+        return s
+    # index of the last non zero signal up to every candle
+    idx = np.where(s != 0, np.arange(s.shape[-1]), 0)
+    np.maximum.accumulate(idx, axis=-1, out=idx)
+    position = np.take_along_axis(s, idx, axis=-1)
+    if go_long and go_short:
+        pass
+    elif go_long:
+        position = np.where(position == 1, 1, 0)
+    elif go_short:
+        position = np.where(position == -1, -1, 0)
+    return position
+
+
+def signal_sides(long_signals, short_signals, go_long=True, go_short=False):
+    """ Side of the signal of every candle: 1 for long, -1 for short and 0
+    when there is none, or it's on a side we don't trade. Like
+    signals_to_position, works on a series or a matrix of signals. """
+    long_signals = np.asarray(long_signals).astype(np.int8)
+    short_signals = np.asarray(short_signals).astype(np.int8)
+    sides = long_signals - short_signals
+    if not go_long:
+        sides[sides == 1] = 0
+    if not go_short:
+        sides[sides == -1] = 0
+    return sides
+
+
+def apply_exits(position, close, high, low, take_profit=math.inf, 
+    stop_loss=0., trailing_stop_loss=False, slippage=0., buy_price=None,
+    sell_price=None, stop_slippage=None, intrabar=None, signals=None,
+    trailing_value=None, trailing_after=1.):
+    """ Closes positions early when they hit their take profit or stop loss.
+
+    `take_profit` and `stop_loss` are ratios of the entry price, as parsed by
+    BaseBacktester (eg. 1.03 for a 3% take profit, 0.9 for a 10% stop loss;
+    math.inf and 0 disable them). With `trailing_stop_loss`, the stop follows
+    the highest high (lowest low for shorts) reached since the entry. Stop
+    fills are worsened by `slippage` percent, plus the ratios `stop_slippage`
+    gives for the candle they fill on (eg. from the depth of the order
+    book): a pair of buy and sell arrays, or a function returning them for
+    the candles (indices) stops fill on, only called once they're known.
+    Take profits fill at their level.
+    When both levels are touched on the same candle we assume the stop loss
+    was hit first, unless `intrabar` resolves it: a tuple holding the index
+    of the first sub candle of every candle, the one after its last and the
+    high and low of all sub candles (see Intrabar). Levels are relative to
+    the price positions were entered at, given by `buy_price` /
+    `sell_price` (close by default).
+    A `trailing_value` adds a separate trailing stop at that ratio of the
+    highest high (lowest low for shorts) on top of the stop loss, which only
+    starts trailing once that extreme reaches `trailing_after` times the
+    entry price (eg. 0.97 and 1.01: 3% below the high once 1% up). Its
+    exits are typed EXIT_TRAILING_STOP, those of the stop loss 
+    EXIT_STOP_LOSS.
+
+    Every position section is processed with array operations: a running
+    max / min gives the trailing stop and argmax over the hit masks finds the
+    first exit. Once a position is closed it stays flat until the next 
+    position change, or until a later candle of `signals` (see
+    signal_sides, delayed like the position) signals its side again, which
+    opens a new trade.
+    
+    Returns a dict holding the new `position`, the `exit_price` (NaN where 
+    no early exit happened), the `exit_type` of every candle (0 or one of the
+    EXIT_* constants) and the `ambiguous` candles on which both levels were
+    touched, and that sub candles could not resolve.
+    """
+    position = np.array(position)
+    close = np.asarray(close, dtype=np.float64)
+    high = np.asarray(high, dtype=np.float64)
+    low = np.asarray(low, dtype=np.float64)
+    l_d = len(position)
+    exit_price = np.full(l_d, np.nan)
+    exit_type = np.zeros(l_d, dtype=np.int8)
+    ambiguous = []
+    has_tp = take_profit != math.inf
+    has_sl = stop_loss > 0 or trailing_value is not None
+    if not (has_tp or has_sl) or l_d == 0:
+        return dict(position=position, exit_price=exit_price,
+            exit_type=exit_type, ambiguous=np.array(ambiguous, dtype=np.int64))
+    _, _, entry_fill = _fill_prices(position, close, buy_price, sell_price)
+    slip = slippage / 100
+    # candles stop losses fill on, with the side and level of their trade
+    stop_fills = []
+    if signals is not None:
+        signals = np.asarray(signals)
+    # like in pnl_curve, holding before the first change is not a trade
+    starts = np.flatnonzero(np.diff(position)) + 1
+    ends = np.append(starts[1:], l_d - 1)
+    stops = np.append(starts[1:], l_d)
+    for st, end, stop in zip(starts.tolist(), ends.tolist(), stops.tolist()):
+        side = position[st]
+        if side == 0:
+            continue
+        while end > st:
+            i, kind, level = _first_exit(st, end, side, entry_fill[st],
+                high, low, take_profit, stop_loss, trailing_stop_loss, 
+                trailing_value, trailing_after, intrabar, ambiguous)
+            if i is None:
+                break
+            exit_type[i] = kind
+            if kind == EXIT_TAKE_PROFIT:
+                exit_price[i] = level
+            else:
+                stop_fills.append((i, side, level))
+            # flat until the next position change, or a new signal
+            reentry = stop
+            if signals is not None:
+                again = np.flatnonzero(signals[i+1:stop] == side)
+                if len(again) > 0:
+                    reentry = i + 1 + int(again[0])
+            position[i:reentry] = 0
+            st = reentry
+    if len(stop_fills) > 0:
+        candles, sides, levels = (np.array(v) for v in zip(*stop_fills))
+        buy_slip, sell_slip = np.zeros(len(candles)), np.zeros(len(candles))
+        if callable(stop_slippage):
+            buy_slip, sell_slip = stop_slippage(candles)
+        elif stop_slippage is not None:
+            buy_slip, sell_slip = (np.asarray(s, dtype=np.float64)[candles]
+                for s in stop_slippage)
+        exit_price[candles] = levels * (1 - sides * (slip
+            + np.where(sides == 1, sell_slip, buy_slip)))
+    return dict(position=position, exit_price=exit_price,
+        exit_type=exit_type, ambiguous=np.array(ambiguous, dtype=np.int64))
+
+
+def _first_exit(st, end, side, entry, high, low, take_profit, stop_loss,
+    trailing_stop_loss, trailing_value, trailing_after, intrabar, ambiguous):
+    """ First candle after `st` (up to `end`) on which a trade entered at
+    `entry` on candle `st` hits a level, the EXIT_* type of that level and
+    the price it exits at. None for all three if the trade holds. """
+    window_high = high[st+1:end+1]
+    window_low = low[st+1:end+1]
+    n = len(window_high)
+    sl_type = np.full(n, EXIT_TRAILING_STOP if trailing_stop_loss 
+        else EXIT_STOP_LOSS, dtype=np.int8)
+    if side == 1:
+        tp_price = entry * take_profit
+        tp_hit = window_high >= tp_price
+        # highest price seen before every candle of the window
+        peak = np.maximum.accumulate(np.concatenate(([entry], window_high[:-1])))
+        if stop_loss <= 0:
+            sl_price = np.zeros(n)
+        elif trailing_stop_loss:
+            sl_price = np.maximum(peak, entry) * stop_loss
+        else:
+            sl_price = np.full(n, entry * stop_loss)
+        if trailing_value is not None:
+            trail = np.where(peak >= entry * trailing_after, 
+                peak * trailing_value, 0.)
+            sl_type[trail > sl_price] = EXIT_TRAILING_STOP
+            sl_price = np.maximum(sl_price, trail)
+        sl_hit = window_low <= sl_price
+    else:
+        tp_price = entry * (2 - take_profit)
+        tp_hit = window_low <= tp_price
+        trough = np.minimum.accumulate(np.concatenate(([entry], window_low[:-1])))
+        if stop_loss <= 0:
+            sl_price = np.full(n, np.inf)
+        elif trailing_stop_loss:
+            sl_price = np.minimum(trough, entry) * (2 - stop_loss)
+        else:
+            sl_price = np.full(n, entry * (2 - stop_loss))
+        if trailing_value is not None:
+            trail = np.where(trough <= entry * (2 - trailing_after),
+                trough * (2 - trailing_value), np.inf)
+            sl_type[trail < sl_price] = EXIT_TRAILING_STOP
+            sl_price = np.minimum(sl_price, trail)
+        sl_hit = window_high >= sl_price
+    hit = tp_hit | sl_hit
+    first = int(np.argmax(hit))
+    if not hit[first]:
+        return None, None, None
+    i = st + 1 + first
+    stop_first = sl_hit[first]
+    if sl_hit[first] and tp_hit[first]:
+        first_hit = 0 if intrabar is None else _first_intrabar_hit(
+            intrabar, i, side, tp_price, sl_price[first])
+        if first_hit == 0:
+            ambiguous.append(i)
+        stop_first = first_hit != EXIT_TAKE_PROFIT
+    if stop_first:
+        return i, sl_type[first], sl_price[first]
+    return i, EXIT_TAKE_PROFIT, tp_price
+
+
+def _first_intrabar_hit(intrabar, i, side, tp_price, sl_price):
+    """ Which of the take profit and stop loss levels the sub candles of
+    candle `i` touch first: EXIT_TAKE_PROFIT, EXIT_STOP_LOSS or 0 if they
+    can't tell (no sub candles, or both touched by the same one) """
+    start, end, sub_high, sub_low = intrabar
+    high = sub_high[start[i]:end[i]]
+    low = sub_low[start[i]:end[i]]
+    if side == 1:
+        tp_hit, sl_hit = high >= tp_price, low <= sl_price
+    else:
+        tp_hit, sl_hit = low <= tp_price, high >= sl_price
+    hit = tp_hit | sl_hit
+    first = int(np.argmax(hit)) if len(hit) > 0 else 0
+    if len(hit) == 0 or not hit[first] or (tp_hit[first] and sl_hit[first]):
+        return 0
+    return EXIT_TAKE_PROFIT if tp_hit[first] else EXIT_STOP_LOSS
+
+
+def scale_in(position, high, low, entry_fill, times, after_profit=None,
+    signals=None):
+    """ Subsequent entries (DCA) of the trades of a position array.
+
+    Every trade adds to its position up to `times` more times, between its
+    entry candle and the one it's exited at. With `after_profit`, adds fill
+    at levels that go down by that ratio from the entry (up for shorts, eg.
+    0.995 buys again 0.5% below the entry, then 0.5% below that), on the
+    first candle after the previous add whose low (high) crosses the next
+    level. Otherwise trades add on the candles of `signals` (see 
+    signal_sides) of their side, at their `entry_fill` price.
+
+    Returns a dict holding the candles adds happen on (`add_candles`), their
+    fill (`add_prices`) and the start of their trade (`add_trades`), plus
+    the start (`trade_starts`), exit candle (`trade_ends`, the length of
+    the data for trades still open), number of entries (`n_entries`) and
+    average entry price (`average_prices`) of every trade, all entries
+    buying for the same amount of quote.
+    """
+    position = np.asarray(position)
+    high = np.asarray(high, dtype=np.float64)
+    low = np.asarray(low, dtype=np.float64)
+    entry_fill = np.asarray(entry_fill, dtype=np.float64)
+    l_d = len(position)
+    changes = np.flatnonzero(np.diff(position)) + 1
+    ends = np.append(changes[1:], l_d)
+    traded = position[changes] != 0
+    starts, ends = changes[traded], ends[traded]
+    if signals is not None:
+        signals = np.asarray(signals)
+    empty = np.array([], dtype=np.int64)
+    add_candles, add_prices, add_trades = [empty], [np.array([])], [empty]
+    n_entries = np.ones(len(starts), dtype=np.int64)
+    inverse_sum = 1 / entry_fill[starts]
+    for t, (st, end) in enumerate(zip(starts.tolist(), ends.tolist())):
+        side = position[st]
+        if after_profit is None:
+            if signals is None:
+                continue
+            candles = st + 1 + np.flatnonzero(signals[st+1:end] == side)[:times]
+            prices = entry_fill[candles]
+        else:
+            ratio = after_profit if side == 1 else 2 - after_profit
+            level, c, found = entry_fill[st], st, []
+            while len(found) < times:
+                level = level * ratio
+                crossed = low[c+1:end] < level if side == 1 \
+                    else high[c+1:end] > level
+                if not crossed.any():
+                    break
+                c = c + 1 + int(np.argmax(crossed))
+                found.append((c, level))
+            candles = np.array([f[0] for f in found], dtype=np.int64)
+            prices = np.array([f[1] for f in found], dtype=np.float64)
+        add_candles.append(candles)
+        add_prices.append(prices)
+        add_trades.append(np.full(len(candles), st, dtype=np.int64))
+        n_entries[t] += len(candles)
+        inverse_sum[t] += np.sum(1 / prices)
+    return dict(add_candles=np.concatenate(add_candles),
+        add_prices=np.concatenate(add_prices),
+        add_trades=np.concatenate(add_trades), trade_starts=starts,
+        trade_ends=ends, n_entries=n_entries, average_prices=n_entries / inverse_sum)
+
+
+def batch_pnl_curve(position, close, fee_cost=0., exit_price=None,
+    buy_price=None, sell_price=None):
+    """ Computes pnl curves for a `(n_param_sets, n_candles)` position matrix.
+
+    Every row gets the same curve pnl_curve would compute for it, all rows
+    sharing `close` (and `exit_price` if given, which can also be a matrix,
+    and `buy_price` / `sell_price`).
+    Instead of going section by section, the result of every trade is booked
+    on the candle it's exited at and a cumulative sum spreads it over the
+    rest of the row.
+
+    Returns a dict holding the `pnl` matrix, the number of long and short
+    trades of every row (`n_longs`, `n_shorts`), and the pnl and side of
+    every trade on the candle it's exited at, NaN / False elsewhere
+    (`trade_pnl`, `trade_is_long`). Those have one more column, for the
+    trades still open on the last candle.
+    """
+    position = np.asarray(position)
+    close = np.asarray(close, dtype=np.float64)
+    l_d = position.shape[-1]
+    if l_d == 0:
+        zeros = np.zeros(position.shape[:-1], dtype=np.int64)
+        trades_shape = position.shape[:-1] + (1,)
+        return dict(pnl=np.zeros(position.shape), n_longs=zeros, n_shorts=zeros,
+            trade_pnl=np.full(trades_shape, np.nan),
+            trade_is_long=np.zeros(trades_shape, dtype=bool))
+    change = np.zeros(position.shape, dtype=bool)
+    change[..., 1:] = position[..., 1:] != position[..., :-1]
+    # holding before the first change does not count as a trade
+    side = np.where(np.logical_or.accumulate(change, axis=-1), position, 0)
+    starts = np.where(change, np.arange(l_d), 0)
+    np.maximum.accumulate(starts, axis=-1, out=starts)
+    buy_price, sell_price, entry_fill = _fill_prices(position, close,
+        buy_price, sell_price)
+    entry = np.take_along_axis(np.broadcast_to(entry_fill, position.shape),
+        starts, axis=-1)
+    in_trade = side != 0
+    pnl = np.where(side == 1, close / entry, entry / close) - 1 - fee_cost
+    pnl[~in_trade] = 0.
+    # book the result of every trade on the candle that closes it
+    fill = np.where(side[..., :-1] == 1, sell_price[1:], buy_price[1:])
+    if exit_price is not None:
+        exit_price = np.broadcast_to(exit_price, position.shape)[..., 1:]
+        fill = np.where(np.isnan(exit_price), fill, exit_price)
+    prev_side = side[..., :-1]
+    prev_entry = entry[..., :-1]
+    closed = change[..., 1:] & (prev_side != 0)
+    booked = np.zeros(position.shape)
+    booked[..., 1:] = np.where(closed, np.where(prev_side == 1, 
+        fill / prev_entry, prev_entry / fill) - 1 - 2 * fee_cost, 0.)
+    pnl += np.cumsum(booked, axis=-1)
+    # the last trade is closed on the last candle, at its fill price
+    pnl[..., -1] -= fee_cost * in_trade[..., -1]
+    last_fill = np.where(side[..., -1] == 1, sell_price[-1], buy_price[-1])
+    pnl[..., -1] += np.where(side[..., -1] == 1, 
+        last_fill / entry[..., -1] - close[-1] / entry[..., -1],
+        np.where(side[..., -1] == -1, 
+            entry[..., -1] / last_fill - entry[..., -1] / close[-1], 0.))
+    trades_shape = position.shape[:-1] + (l_d + 1,)
+    trade_pnl = np.full(trades_shape, np.nan)
+    trade_pnl[..., 1:-1] = np.where(closed, booked[..., 1:], np.nan)
+    # like trade_ledger, exits on the last candle fill at their exit price
+    if exit_price is not None and l_d > 1:
+        last_exit = exit_price[..., -1]
+        last_fill = np.where(np.isnan(last_exit), last_fill, last_exit)
+    trade_pnl[..., -1] = np.where(in_trade[..., -1], np.where(side[..., -1] == 1,
+        last_fill / entry[..., -1], entry[..., -1] / last_fill) - 1 - 2 * fee_cost,
+        np.nan)
+    trade_is_long = np.zeros(trades_shape, dtype=bool)
+    trade_is_long[..., 1:-1] = closed & (prev_side == 1)
+    trade_is_long[..., -1] = side[..., -1] == 1
+    return dict(pnl=pnl, 
+        n_longs=np.count_nonzero(change & (side == 1), axis=-1),
+        n_shorts=np.count_nonzero(change & (side == -1), axis=-1),
+        trade_pnl=trade_pnl, trade_is_long=trade_is_long)
+
+
+def drawdown_stats(pnl):
+    """ Drawdown curve and statistics of one pnl curve or a matrix of them.
+
+    Returns a dict holding the `drawdown` curve(s), the `max_drawdown`, and
+    the longest and average number of candles between two equity highs
+    (`longest_drawdown_period`, `average_drawdown_period`). Statistics are
+    scalars for a single curve and arrays for a matrix. 
+    """
+    pnl = np.asarray(pnl, dtype=np.float64)
+    ret = 1 + pnl
+    drawdown = (ret / np.maximum.accumulate(ret, axis=-1)) - 1
+    l_d = pnl.shape[-1]
+    at_high = drawdown == 0
+    # index of the previous equity high, for every equity high
+    last_high = np.where(at_high, np.arange(l_d), 0)
+    np.maximum.accumulate(last_high, axis=-1, out=last_high)
+    periods = np.where(at_high[..., 1:], 
+        np.arange(1, l_d) - last_high[..., :-1], 0)
+    n_periods = np.count_nonzero(at_high, axis=-1) - 1
+    first_high = np.argmax(at_high, axis=-1)
+    with np.errstate(invalid='ignore', divide='ignore'):
+        average = np.where(n_periods > 0, 
+            (last_high[..., -1] - first_high) / n_periods, 0)
+    return dict(drawdown=drawdown, 
+        max_drawdown=np.round(-np.amin(drawdown, axis=-1), 2),
+        longest_drawdown_period=np.amax(periods, axis=-1, initial=0),
+        average_drawdown_period=average)
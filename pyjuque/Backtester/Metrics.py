@@ -0,0 +1,109 @@
+"""
+Performance metrics of backtests: risk adjusted returns (Sharpe, Sortino,
+Calmar), exposure, time under water and comparison to buying and holding.
+
+Metrics are computed in one pass over the pnl curve from a few sums that
+add up across consecutive pieces of it (see curve_sums), so that they work
+the same on a pnl curve, on a `(n_param_sets, n_candles)` matrix of them
+(every statistic becomes an array) and on a backtest streamed in chunks.
+Returns are the candle returns of the equity, 1 + pnl, and get annualized
+with the number of candles in a year of the backtest's timeframe.
+"""
+
+import re
+import numpy as np
+
+SECONDS_PER_YEAR = 365 * 24 * 60 * 60
+TIMEFRAME_SECONDS = dict(s=1, m=60, h=60 * 60, d=24 * 60 * 60,
+    w=7 * 24 * 60 * 60, M=30 * 24 * 60 * 60)
+
+
+def periods_per_year(timeframe=None, time=None):
+    """ Number of candles in a year, from a `timeframe` like '1m', '4h' or
+    '1d' or, without a valid one, from the median gap between the `time`
+    (ms) of the candles. Returns None if neither tells. """
+    match = None if timeframe is None \
+        else re.fullmatch(r'(\d+)([smhdwM])', str(timeframe))
+    if match is not None:
+        return SECONDS_PER_YEAR / (int(match.group(1))
+            * TIMEFRAME_SECONDS[match.group(2)])
+    if time is not None and len(time) > 1:
+        gap = float(np.median(np.diff(np.asarray(time, dtype=np.float64))))
+        if gap > 0:
+            return SECONDS_PER_YEAR * 1000 / gap
+    return None
+
+
+def in_trade(position):
+    """ `position` (one row or a matrix), flat before its first change:
+    like in pnl_curve, holding before any signal is not a trade """
+    position = np.asarray(position)
+    changed = np.zeros(position.shape, dtype=bool)
+    changed[..., 1:] = position[..., 1:] != position[..., :-1]
+    return np.where(np.logical_or.accumulate(changed, axis=-1), position, 0)
+
+
+def curve_sums(pnl, drawdown, position=None, previous=None):
+    """ Sums the metrics come from, over the candles of pnl curve(s) `pnl`,
+    with the `drawdown` and `position` held (see in_trade) on each of them.
+    `previous` is the pnl of the candle before the first one, if any. """
+    pnl = np.asarray(pnl, dtype=np.float64)
+    equity = 1 + pnl
+    if previous is not None:
+        equity = np.concatenate((np.expand_dims(1 + np.asarray(previous), -1),
+            equity), axis=-1)
+    returns = equity[..., 1:] / equity[..., :-1] - 1
+    losses = np.minimum(returns, 0)
+    return dict(
+        n_candles = pnl.shape[-1],
+        n_returns = returns.shape[-1],
+        returns = np.sum(returns, axis=-1),
+        squared_returns = np.sum(returns * returns, axis=-1),
+        squared_losses = np.sum(losses * losses, axis=-1),
+        exposed = 0 if position is None else np.count_nonzero(position, axis=-1),
+        under_water = np.count_nonzero(np.asarray(drawdown) < 0, axis=-1),
+    )
+
+
+def add_sums(sums, other):
+    """ Sums of two consecutive pieces of a curve """
+    return {key: sums[key] + other[key] for key in sums}
+
+
+def performance_metrics(sums, pnl_ratio, max_drawdown, buyhold_return=None,
+    periods_per_year=None):
+    """ Metrics of a backtest from its curve_sums, final `pnl_ratio` and
+    (unrounded) `max_drawdown` ratio. Without `periods_per_year`, ratios are
+    per candle and the annual return is the total one. """
+    pnl_ratio = np.asarray(pnl_ratio, dtype=np.float64)
+    max_drawdown = np.asarray(max_drawdown, dtype=np.float64)
+    n_returns = max(sums['n_returns'], 1)
+    mean = sums['returns'] / n_returns
+    std = np.sqrt(np.maximum(sums['squared_returns'] / n_returns - mean * mean, 0))
+    downside = np.sqrt(sums['squared_losses'] / n_returns)
+    scale = 1. if periods_per_year is None else np.sqrt(periods_per_year)
+    if periods_per_year is None:
+        annual_return = pnl_ratio
+    else:
+        years = sums['n_candles'] / periods_per_year
+        annual_return = np.maximum(1 + pnl_ratio, 0) ** (1 / years) - 1
+    with np.errstate(divide='ignore', invalid='ignore'):
+        sharpe = np.where(std > 0, mean / std * scale, 0.)
+        sortino = np.where(downside > 0, mean / downside * scale,
+            np.where(mean > 0, np.inf, 0.))
+        calmar = np.where(max_drawdown > 0, annual_return / max_drawdown,
+            np.where(annual_return > 0, np.inf, 0.))
+    metrics = dict(
+        sharpe_ratio = sharpe,
+        sortino_ratio = sortino,
+        calmar_ratio = calmar,
+        annual_return = annual_return,
+        exposure = sums['exposed'] / max(sums['n_candles'], 1),
+        time_under_water = sums['under_water'] / max(sums['n_candles'], 1),
+        buyhold_return = buyhold_return,
+        excess_return = None if buyhold_return is None
+            else pnl_ratio - buyhold_return,
+    )
+    # plain floats for a single curve
+    return {key: value if value is None or np.ndim(value) > 0 else float(value)
+        for key, value in metrics.items()}
@@ -0,0 +1,51 @@
+"""
+Monte Carlo resampling of the trades of a backtest.
+
+Draws many alternative orderings of the trades a backtest made (with
+replacement by default, or shuffles of them) to see how much its final
+pnl and drawdowns owe to the order trades happened in. All simulations are
+one `(n_sims, n_trades)` matrix: a cumulative sum (or product, to compound
+returns) gives every equity curve and drawdown_stats their drawdowns.
+"""
+
+import numpy as np
+from pyjuque.Backtester.Kernels import drawdown_stats
+
+
+def resample_trades(returns, n_sims=10_000, n_trades=None, replace=True,
+    compound=False, seed=None):
+    """ Simulates `n_sims` sequences of `n_trades` (by default as many as
+    given) trades drawn from `returns`, the pnl ratio of every trade.
+
+    Pnl adds trade returns up like Backtester does, unless `compound`.
+    Without `replace`, every simulation is a shuffle of all trades, or of
+    the first `n_trades` of one.
+
+    Returns a dict holding, for every simulation, its `final_pnl`, its
+    `max_drawdown` and its `longest_drawdown_period` (in trades). Summed
+    pnl can go below -1, losing more than the amount traded: drawdowns are
+    ratios of 1 + pnl, so they're capped at 1, the whole equity lost.
+    """
+    returns = np.asarray(returns, dtype=np.float64)
+    if len(returns) == 0:
+        raise ValueError('No trades to resample.')
+    rng = np.random.default_rng(seed)
+    n_trades = len(returns) if n_trades is None else n_trades
+    if replace:
+        sampled = returns[rng.integers(0, len(returns), size=(n_sims, n_trades))]
+    else:
+        if n_trades > len(returns):
+            raise ValueError('Can not draw {} trades out of {} without '
+                'replacement.'.format(n_trades, len(returns)))
+        sampled = rng.permuted(np.tile(returns, (n_sims, 1)), axis=1)[:, :n_trades]
+    # every curve starts flat, before the first trade
+    pnl = np.zeros((n_sims, sampled.shape[1] + 1))
+    if compound:
+        np.cumprod(1 + sampled, axis=1, out=pnl[:, 1:])
+        pnl[:, 1:] -= 1
+    else:
+        np.cumsum(sampled, axis=1, out=pnl[:, 1:])
+    stats = drawdown_stats(pnl)
+    return dict(final_pnl=pnl[:, -1],
+        max_drawdown=np.minimum(-np.amin(stats['drawdown'], axis=1), 1.),
+        longest_drawdown_period=stats['longest_drawdown_period'])
@@ -0,0 +1,231 @@
+"""
+Backtests a bot trading many symbols out of one shared balance.
+
+Mirrors what BotController does on every tick, for every candle:
+    - pairs without an open order enter on their long signal, each entry
+      taking `initial_entry_allocation` % of the starting balance for as
+      long as the balance is positive (market order if `signal_distance`
+      is 0, limit order `signal_distance` % below the close otherwise)
+    - filled entries get a take profit limit sell, with its stop loss
+      checked against the close, or a stop loss order if there is no take
+      profit, or exit at market on an exit signal if `exit_on_signal`
+    - the balance gets back what sells fill for
+State is kept in one array per field with a value per symbol, so every
+candle is processed with array operations across all symbols, and candles
+on which the bot has nothing to do are skipped in chunks.
+"""
+
+import math
+import numpy as np
+import pandas as pd
+from pyjuque.Backtester.BaseBacktester import BaseBacktester
+from pyjuque.Backtester.Kernels import drawdown_stats
+from pyjuque.Strategies import strategy_signals
+
+# state of every symbol
+IDLE = 0
+BUY_OPEN = 1
+HOLDING = 2
+
+# reasons for closing a position
+EXIT_TAKE_PROFIT = 1
+EXIT_STOP_LOSS = 2
+EXIT_SIGNAL = 3
+
+
+def run_portfolio(high, low, close, entry_signals, exit_signals,
+    starting_balance, initial_entry_allocation=100, signal_distance=0,
+    take_profit=None, stop_loss=None, exit_on_signal=False, fee_cost=0.,
+    time=None, open_buy_order_time_out=None):
+    """ Runs the bot on `(n_candles, n_symbols)` price and signal arrays.
+
+    `take_profit`, `stop_loss`, `signal_distance` and the allocation are
+    percentages, like in the bot config; None disables them. Buy orders
+    still open `open_buy_order_time_out` ms (compared against `time`) after
+    being placed get cancelled.
+
+    Returns a dict holding the `equity` and `balance` curves, a `trades`
+    DataFrame and the `state` every symbol was left in.
+    """
+    high = np.asarray(high, dtype=np.float64)
+    low = np.asarray(low, dtype=np.float64)
+    close = np.asarray(close, dtype=np.float64)
+    entry_signals = np.asarray(entry_signals).astype(bool)
+    exit_signals = np.asarray(exit_signals).astype(bool)
+    l_d, n_symbols = close.shape
+    alloc = starting_balance * initial_entry_allocation / 100
+    has_tp = take_profit is not None
+    has_sl = stop_loss is not None
+    balance = starting_balance
+    state = np.full(n_symbols, IDLE, dtype=np.int8)
+    order_price = np.zeros(n_symbols)      # limit price of open buy orders
+    placed_at = np.zeros(n_symbols, dtype=np.int64)
+    entry_at = np.zeros(n_symbols, dtype=np.int64)
+    entry_price = np.zeros(n_symbols)
+    quantity = np.zeros(n_symbols)
+    tp_price = np.full(n_symbols, np.inf)
+    sl_price = np.zeros(n_symbols)
+    sell_from = np.zeros(n_symbols, dtype=np.int64)
+    equity = np.zeros(l_d)
+    balance_curve = np.zeros(l_d)
+    trades = []
+    entry_times = np.flatnonzero(entry_signals.any(axis=1))
+
+    def sell(idx, price, t, reason):
+        nonlocal balance
+        balance += float(np.sum(quantity[idx] * price * (1 - fee_cost)))
+        for i, p in zip(idx.tolist(), np.broadcast_to(price, idx.shape).tolist()):
+            trades.append((i, entry_at[i], t, entry_price[i], p, quantity[i], reason))
+        state[idx] = IDLE
+        quantity[idx] = 0
+
+    t = 0
+    while t < l_d:
+        # nothing open: jump to the next candle with an entry signal
+        if not state.any():
+            k = np.searchsorted(entry_times, t)
+            nxt = entry_times[k] if k < len(entry_times) and balance > 0 else l_d
+            equity[t:nxt] = balance
+            balance_curve[t:nxt] = balance
+            t = nxt
+            if t >= l_d:
+                break
+        c = close[t]
+        # ENTRIES, in symbol order while the balance is positive
+        candidates = np.flatnonzero((state == IDLE) & entry_signals[t])
+        if len(candidates) > 0 and balance > 0:
+            candidates = candidates[:int(math.ceil(balance / alloc))]
+            balance -= alloc * len(candidates)
+            state[candidates] = BUY_OPEN
+            placed_at[candidates] = t
+            order_price[candidates] = c[candidates] * (100 - signal_distance) / 100
+        # BUY ORDERS: market orders fill on this candle, limit ones afterwards
+        buys = state == BUY_OPEN
+        if buys.any():
+            if signal_distance == 0:
+                filled = buys & (placed_at == t)
+            else:
+                filled = buys & (placed_at < t) & (low[t] < order_price)
+            if open_buy_order_time_out is not None and time is not None:
+                expired = buys & ~filled \
+                    & (time[t] - time[placed_at] > open_buy_order_time_out)
+                balance += alloc * np.count_nonzero(expired)
+                state[expired] = IDLE
+            idx = np.flatnonzero(filled)
+            if len(idx) > 0:
+                price = order_price[idx]
+                entry_price[idx] = price
+                entry_at[idx] = t
+                quantity[idx] = alloc / price * (1 - fee_cost)
+                state[idx] = HOLDING
+                sell_from[idx] = t + 1
+                tp_price[idx] = price * (100 + take_profit) / 100 if has_tp else np.inf
+                sl_price[idx] = price * (100 - stop_loss) / 100 if has_sl else 0.
+                if exit_on_signal:
+                    now = idx[exit_signals[t, idx]]
+                    if len(now) > 0:
+                        sell(now, c[now], t, EXIT_SIGNAL)
+        # SELL ORDERS placed on previous candles
+        holding = (state == HOLDING) & (sell_from <= t)
+        if holding.any():
+            if has_tp:
+                idx = np.flatnonzero(holding & (high[t] > tp_price))
+                sell(idx, tp_price[idx], t, EXIT_TAKE_PROFIT)
+                if has_sl:
+                    idx = np.flatnonzero(holding & (state == HOLDING)
+                        & (sl_price > c))
+                    sell(idx, c[idx], t, EXIT_STOP_LOSS)
+            elif has_sl:
+                idx = np.flatnonzero(holding & (low[t] < sl_price))
+                sell(idx, sl_price[idx], t, EXIT_STOP_LOSS)
+            if exit_on_signal:
+                idx = np.flatnonzero(holding & (state == HOLDING) & exit_signals[t])
+                sell(idx, c[idx], t, EXIT_SIGNAL)
+        balance_curve[t] = balance
+        equity[t] = balance + alloc * np.count_nonzero(state == BUY_OPEN) \
+            + float(np.dot(quantity, np.nan_to_num(c)))
+        t += 1
+    trades = pd.DataFrame(trades, columns=['symbol', 'entry_index',
+        'exit_index', 'entry_price', 'exit_price', 'quantity', 'exit_type'])
+    return dict(equity=equity, balance=balance_curve, trades=trades, state=state)
+
+
+class PortfolioBacktester(BaseBacktester):
+    """ Backtests one strategy over many symbols sharing the bot's
+    `starting_balance`, with BotController's entry and exit rules. """
+
+    def __init__(self, params = {}, strategies_dir='pyjuque.Strategies'):
+        super().__init__(params, strategies_dir)
+        self.signal_distance = 0
+        if params['entry_settings'].__contains__('signal_distance'):
+            self.signal_distance = params['entry_settings']['signal_distance']
+        self.open_buy_order_time_out = None
+        if params['entry_settings'].__contains__('open_buy_order_time_out'):
+            self.open_buy_order_time_out = \
+                params['entry_settings']['open_buy_order_time_out']
+        self.take_profit = params['exit_settings'].get('take_profit')
+        self.stop_loss = params['exit_settings'].get('stop_loss_value')
+
+    def _stack(self, dfs, column):
+        return np.column_stack([np.asarray(df[column], dtype=np.float64)
+            for df in dfs.values()])
+
+    def backtest(self, dfs, **strategy_kwargs):
+        """ Backtests the strategy on `dfs`, a dict of {symbol: DataFrame}
+        holding aligned candles (same length and times) """
+        self.symbols = list(dfs.keys())
+        lengths = set(len(df) for df in dfs.values())
+        if len(lengths) != 1:
+            raise ValueError('All symbols should hold the same number of '
+                'candles, got {}.'.format(sorted(lengths)))
+        entry_signals, exit_signals = [], []
+        for symbol, df in dfs.items():
+            self.strategy.setUp(df, **strategy_kwargs)
+            long_signals, short_signals = strategy_signals(self.strategy, len(df))
+            entry_signals.append(long_signals)
+            exit_signals.append(short_signals)
+        self.data = next(iter(dfs.values()))
+        time = np.asarray(self.data['time']) if 'time' in self.data.columns else None
+        result = run_portfolio(self._stack(dfs, 'high'), self._stack(dfs, 'low'),
+            self._stack(dfs, 'close'), np.column_stack(entry_signals),
+            np.column_stack(exit_signals), self.initial_balance,
+            self.initial_entry_allocation, self.signal_distance, self.take_profit,
+            self.stop_loss, self.exit_on_short, self.fee_cost, time,
+            self.open_buy_order_time_out)
+        self.equity = result['equity']
+        self.balance_curve = result['balance']
+        self.trades = result['trades']
+        self.open_symbols = [self.symbols[i] 
+            for i in np.flatnonzero(result['state'] != IDLE)]
+        self.trades['symbol'] = [self.symbols[i] for i in self.trades['symbol']]
+        self.pnl = self.equity / self.initial_balance - 1
+        stats = drawdown_stats(self.pnl)
+        self.drawdown = stats['drawdown']
+        self.max_drawdown = stats['max_drawdown']
+
+    def return_results(self):
+        """ Returns a dict with the backtesting results """
+        trades = self.trades
+        profits = (trades['exit_price'] - trades['entry_price']) * trades['quantity']
+        return {
+            'start_time' : self.data.time.iloc[0],
+            'end_time' : self.data.time.iloc[-1],
+            'strategy_name' : self.strategy_name,
+            'strategy_params' : self.strategy_params,
+            'symbols' : self.symbols,
+            'timeframe' : self.timeframe,
+            'starting_balance' : self.initial_balance,
+            'final_balance' : self.balance_curve[-1],
+            'final_equity' : self.equity[-1],
+            'profit_net' : self.equity[-1] - self.initial_balance,
+            'pnl_ratio' : self.pnl[-1],
+            'max_drawdown' : self.max_drawdown,
+            'n_total_trades' : len(trades),
+            'n_winning_trades' : int((profits > 0).sum()),
+            'n_losing_trades' : int((profits <= 0).sum()),
+            'n_take_profits' : int((trades['exit_type'] == EXIT_TAKE_PROFIT).sum()),
+            'n_stop_losses' : int((trades['exit_type'] == EXIT_STOP_LOSS).sum()),
+            'n_signal_exits' : int((trades['exit_type'] == EXIT_SIGNAL).sum()),
+            'trades_per_symbol' : trades.groupby('symbol').size().to_dict(),
+            'open_symbols' : self.open_symbols,
+        }
@@ -0,0 +1,405 @@
+"""
+Backtests data one chunk of candles at a time, either to stream data too
+large to hold in memory or to extend a backtest when new candles arrive.
+
+Between two chunks, only what the next one needs is carried over:
+    - the last `minimum_period` candles, so that the strategy's indicators
+      are warmed up when it gets set up on the next chunk
+    - the last position, held until the signals change it
+    - the candles of the trade still open, so that its take profit / stop
+      loss and pnl come out exactly as if the data was never split
+    - the pnl booked by the trades closed so far and the drawdown state
+Without curves, memory depends on the chunk size and on the longest trade,
+not on the length of the data.
+"""
+
+import math
+import numpy as np
+import pandas as pd
+from pyjuque.Backtester.Kernels import signals_to_position, apply_exits, \
+    pnl_curve, trade_ledger, signal_sides, TRADE_DTYPE
+from pyjuque.Backtester.Intrabar import median_gap
+from pyjuque.Backtester.Metrics import curve_sums, add_sums, \
+    performance_metrics, periods_per_year
+from pyjuque.Strategies import strategy_signals
+
+
+def read_ohlcv_chunks(path, chunksize=100_000, **kwargs):
+    """ Reads an OHLCV csv file `chunksize` candles at a time. Extra
+    arguments go to pandas.read_csv. """
+    return pd.read_csv(path, chunksize=chunksize, **kwargs)
+
+
+def _drawdown_step(state, pnl, start):
+    """ Carries drawdown_stats over consecutive pieces of a pnl curve.
+
+    `state` is left untouched; returns the state after the candles of `pnl`
+    (the first of which is candle `start`) and their drawdown. """
+    state = dict(state)
+    ret = 1 + pnl
+    running_max = np.maximum.accumulate(np.append(state['max_ret'], ret))[1:]
+    drawdown = ret / running_max - 1
+    if len(pnl) == 0:
+        return state, drawdown
+    state['max_ret'] = running_max[-1]
+    state['max_drawdown'] = max(state['max_drawdown'], float(-np.amin(drawdown)))
+    state['max_pnl'] = max(state['max_pnl'], float(np.amax(pnl)))
+    highs = np.flatnonzero(drawdown == 0) + start
+    if len(highs) > 0:
+        if state['n_highs'] == 0:
+            state['first_high'] = state['last_high'] = int(highs[0])
+        periods = np.diff(np.concatenate(([state['last_high']], highs)))
+        state['longest'] = max(state['longest'], int(np.amax(periods)))
+        state['last_high'] = int(highs[-1])
+        state['n_highs'] += len(highs)
+    return state, drawdown
+
+
+class _Buffer():
+    """ Array appended to in place, its capacity doubling whenever it's
+    full so that appending n values costs O(n) overall. `values` is a view
+    of the ones appended so far. """
+
+    def __init__(self, dtype=None):
+        self.array = None if dtype is None else np.empty(0, dtype=dtype)
+        self.size = 0
+
+    @property
+    def values(self):
+        return self.array[:self.size]
+
+    def extend(self, values):
+        values = np.asarray(values)
+        if self.array is None:
+            self.array = np.empty(0, dtype=values.dtype)
+        end = self.size + len(values)
+        dtype = self.array.dtype if values.dtype == self.array.dtype \
+            else np.result_type(self.array, values)
+        if end > len(self.array) or dtype != self.array.dtype:
+            grown = np.empty(max(end, 2 * len(self.array)), dtype=dtype)
+            grown[:self.size] = self.values
+            self.array = grown
+        self.array[self.size:end] = values
+        self.size = end
+
+    def truncate(self, size):
+        self.size = size
+
+
+def _column_values(column):
+    """ Values of a DataFrame column, as an object array unless they have a
+    NumPy dtype (kept data then holds them as an object column) """
+    if isinstance(column.dtype, np.dtype):
+        return column.to_numpy()
+    return column.to_numpy(dtype=object)
+
+
+class StreamState():
+    """ What a chunked backtest carries from one chunk to the next.
+
+    Chunks are fed to update(); result() then sets the results of all the
+    candles seen so far on the backtester, the open trade being closed on
+    the last candle like backtest() does. With `keep_curves`, the curves
+    and data of all candles are kept, otherwise only those of the last
+    chunk. Kept curves and data grow in buffers whose capacity doubles, the
+    backtester's arrays being views of them that are valid until the next
+    chunk. """
+
+    def __init__(self, backtester, keep_curves=False):
+        self.bt = backtester
+        self.keep_curves = keep_curves
+        self.warmup = None          # last candles, to warm indicators up
+        self.raw_position = 0       # last signal, before dropping sides
+        self.traded = False         # has the position changed yet?
+        self.sums = None            # see Metrics.curve_sums
+        self.previous = None        # pnl of the last candle summed
+        self.exposed = 0            # candles spent in a trade
+        self.first_close = None
+        self.periods_per_year = None
+        self.candle_duration = None # to map candles to their sub candles
+        self.exited = False         # was the last position closed early?
+        # candles of the open trade, preceded by a flat candle so that its
+        # start is a position change, or only the last candle otherwise
+        self.prefix = dict(position=np.zeros(0, dtype=np.int64),
+            signal=np.zeros(0, dtype=np.int8), close=np.zeros(0),
+            high=np.zeros(0), low=np.zeros(0), buy=np.zeros(0),
+            sell=np.zeros(0), sub_start=np.zeros(0, dtype=np.int64),
+            sub_end=np.zeros(0, dtype=np.int64))
+        self.delayed = None         # positions whose orders did not fill yet
+        self.booked = 0.            # pnl of the trades closed before it
+        self.open_trade = None
+        self.pending = None         # pnl of the last candle, trade still open
+        self.n_candles = 0
+        self.n_longs = 0
+        self.n_shorts = 0
+        self.last_side = 0
+        self.idx_longs = _Buffer(np.int64)
+        self.idx_shorts = _Buffer(np.int64)
+        self.trades = _Buffer(TRADE_DTYPE)  # ledger of the closed trades
+        self.ambiguous_exits = _Buffer(np.int64)
+        self.start_time = None
+        self.end_time = None
+        self.drawdown_state = dict(max_ret=-math.inf, max_drawdown=0.,
+            max_pnl=-math.inf, n_highs=0, first_high=0, last_high=0, longest=0)
+        self.curves = None          # {name: _Buffer}
+        self.closed = False         # did result() close the last candle?
+        self.columns = None         # columns of the data, {name: _Buffer}
+        self.data = None
+
+    def update(self, df, **strategy_kwargs):
+        """ Backtests the next chunk of candles """
+        bt = self.bt
+        if len(df) == 0:
+            return
+        df = df.reset_index(drop=True)
+        full = df if self.warmup is None \
+            else pd.concat([self.warmup, df], ignore_index=True)
+        n_warm = len(full) - len(df)
+        bt.strategy.setUp(full, **strategy_kwargs)
+        frame = getattr(bt.strategy, 'dataframe', None)
+        if frame is None:
+            frame = full
+        frame = frame.iloc[n_warm:].reset_index(drop=True)
+        # iloc[-0:] would keep the whole history
+        self.warmup = full[df.columns].iloc[len(full)
+            - min(bt.strategy.minimum_period, len(full)):]
+        long_signals, short_signals = strategy_signals(bt.strategy, len(full))
+        long_signals, short_signals = long_signals[n_warm:], short_signals[n_warm:]
+        # the carried signal is held until the first one of the chunk
+        position = signals_to_position(
+            np.append(self.raw_position == 1, long_signals).astype(np.int8),
+            np.append(self.raw_position == -1, short_signals).astype(np.int8),
+            bt.go_long, bt.go_short)[1:]
+        sides = signal_sides(long_signals, short_signals, bt.go_long, bt.go_short)
+        delay = bt.fill_model.delay
+        if delay > 0:
+            # like delay_position, carrying the orders that did not fill
+            if self.delayed is None:
+                self.delayed = (np.repeat(position[:1], delay),
+                    np.repeat(sides[:1], delay))
+            position = np.concatenate((self.delayed[0], position))
+            sides = np.concatenate((self.delayed[1], sides))
+            self.delayed = (position[-delay:], sides[-delay:])
+            position, sides = position[:-delay], sides[:-delay]
+        signals = np.flatnonzero(long_signals.astype(np.int8)
+            - short_signals.astype(np.int8))
+        if len(signals) > 0:
+            self.raw_position = int(long_signals[signals[-1]]) \
+                - int(short_signals[signals[-1]])
+        close = bt._get_close(frame).astype(np.float64)
+        high, low = bt._get_high_low(frame)
+        n_pre = len(self.prefix['position'])
+        P = np.concatenate((self.prefix['position'], position))
+        G = np.concatenate((self.prefix['signal'], sides))
+        C = np.concatenate((self.prefix['close'], close))
+        H = np.concatenate((self.prefix['high'], np.asarray(high, dtype=np.float64)))
+        L = np.concatenate((self.prefix['low'], np.asarray(low, dtype=np.float64)))
+        changes = np.flatnonzero(np.diff(P)) + 1
+        if self.exited:
+            # still flat until the position changes or its side is
+            # signaled again
+            again = np.flatnonzero(G[n_pre:] == P[0]) + n_pre
+            flat = min(np.append(changes, len(P))[0], np.append(again, len(P))[0])
+            P[:flat] = 0
+            changes = np.flatnonzero(np.diff(P)) + 1
+        candles = np.union1d(changes[changes >= n_pre] - n_pre,
+            np.flatnonzero(sides))
+        candles = np.append(candles, len(close) - 1)
+        buy, sell = bt.fill_model.prices(frame, bt.trade_amount, candles)
+        B = np.concatenate((self.prefix['buy'], buy))
+        S = np.concatenate((self.prefix['sell'], sell))
+        # carried candles were walked through without a stop
+        frame_slippage = bt._stop_slippage(frame)
+        stop_slippage = lambda candles: frame_slippage(candles - n_pre)
+        if self.candle_duration is None and bt.lower_timeframe is not None:
+            # from the first candles seen, whatever chunks they came in
+            time = frame['time'].to_numpy() if self.end_time is None \
+                else np.append(self.end_time, frame['time'].to_numpy())
+            if len(time) > 1:
+                self.candle_duration = median_gap(time)
+        # a lone first candle can't be exited on, it needs no sub candles
+        sub_start, sub_end = bt._intrabar_bounds(frame, 0.
+            if self.candle_duration is None else self.candle_duration)
+        SB = np.concatenate((self.prefix['sub_start'], sub_start))
+        SE = np.concatenate((self.prefix['sub_end'], sub_end))
+        # global index of the first carried candle
+        offset = self.n_candles - n_pre
+        exit_price = None
+        exit_type = np.zeros(len(P), dtype=np.int8)
+        traded_position = P
+        if bt.take_profit_value != math.inf or bt.stop_loss_value > 0:
+            exits = apply_exits(P, C, H, L, bt.take_profit_value,
+                bt.stop_loss_value, bt.trailing_stop_loss, bt.slippage, B, S,
+                stop_slippage, bt._intrabar((SB, SE)), G)
+            traded_position = exits['position']
+            exit_price = exits['exit_price']
+            exit_type = exits['exit_type']
+            ambiguous = exits['ambiguous']
+            self.ambiguous_exits.extend(ambiguous[ambiguous >= n_pre] + offset)
+            self.exited = position[-1] != 0 and traded_position[-1] == 0
+        curve = pnl_curve(traded_position, C, bt.fee_cost, exit_price, B, S)
+        # every candle but the last one, whose trade is exited if it's open
+        pnl = curve['pnl'][n_pre:] + self.booked
+        sides = curve['trade_sides']
+        starts = curve['trade_starts']
+        is_open = len(sides) > 0 and sides[-1] != 0
+        # what closing the open trade on the last candle cost it
+        exit_cost = 0.
+        if is_open:
+            entered = np.where(sides[-1] == 1, B, S)[starts[-1]]
+            if sides[-1] == 1:
+                exit_cost = bt.fee_cost - S[-1] / entered + C[-1] / entered
+            else:
+                exit_cost = bt.fee_cost - entered / B[-1] + entered / C[-1]
+            pnl[-1] += exit_cost
+        new = starts >= n_pre
+        self.n_longs += int(np.count_nonzero(new & (sides == 1)))
+        self.n_shorts += int(np.count_nonzero(new & (sides == -1)))
+        # flat sections are drawn as exits of the previous trade
+        idx_longs, idx_shorts = [], []
+        for start, side in zip(starts[new].tolist(), sides[new].tolist()):
+            if side == 1 or (side == 0 and self.last_side != 1):
+                idx_longs.append(start + offset)
+            else:
+                idx_shorts.append(start + offset)
+            if side != 0:
+                self.last_side = side
+        self.idx_longs.extend(np.array(idx_longs, dtype=np.int64))
+        self.idx_shorts.extend(np.array(idx_shorts, dtype=np.int64))
+        # candles spent in a trade, holding before the first change is not
+        changed = np.zeros(len(P), dtype=bool)
+        changed[1:] = traded_position[1:] != traded_position[:-1]
+        started = self.traded | np.logical_or.accumulate(changed)
+        self.exposed += int(np.count_nonzero(((traded_position != 0) & started)[n_pre:]))
+        # carry the open trade over, book the closed ones
+        self.traded = self.traded or len(changes) > 0
+        section_start = starts[-1] if is_open else len(P)
+        trades = trade_ledger(curve, bt.fee_cost, exit_type, offset)
+        closed = starts[sides != 0] < section_start
+        self.booked += float(np.sum(trades['pnl'][closed]))
+        trades['id'] = np.arange(1, len(trades) + 1) + self.trades.size
+        self.trades.extend(trades[closed])
+        self.open_trade = trades[-1:] if is_open else None
+        if is_open:
+            keep = slice(section_start, None)
+            self.prefix = {key: np.concatenate(([value[section_start]], 
+                    value[keep])) for key, value in dict(close=C, high=H, 
+                    low=L, buy=B, sell=S, sub_start=SB, sub_end=SE).items()}
+            self.prefix['position'] = np.concatenate(([0], P[keep]))
+            self.prefix['signal'] = np.concatenate(([0], G[keep]))
+        else:
+            # the last signal, so that a change on the next candle is seen
+            self.prefix = dict(position=position[-1:], signal=G[-1:],
+                close=C[-1:], high=H[-1:], low=L[-1:], buy=B[-1:],
+                sell=S[-1:], sub_start=SB[-1:], sub_end=SE[-1:])
+        # the last candle's drawdown waits for the next chunk
+        committed = pnl[:-1] if self.pending is None \
+            else np.concatenate(([self.pending], pnl[:-1]))
+        start = self.n_candles - (self.pending is not None)
+        self.drawdown_state, drawdown = _drawdown_step(
+            self.drawdown_state, committed, start)
+        self._add_sums(curve_sums(committed, drawdown, previous=self.previous))
+        if len(committed) > 0:
+            self.previous = committed[-1]
+        if self.first_close is None:
+            self.first_close = close[0]
+        if self.periods_per_year is None:
+            # from the first candles seen, whatever chunks they came in
+            time = None
+            if 'time' in frame.columns:
+                time = frame['time'].to_numpy() if self.end_time is None \
+                    else np.append(self.end_time, frame['time'].to_numpy())
+            self.periods_per_year = periods_per_year(bt.timeframe, time)
+        last_pending = self.pending
+        self.pending = pnl[-1]
+        self.pending_exit = exit_cost
+        if self.start_time is None and 'time' in frame.columns:
+            self.start_time = frame['time'].iloc[0]
+        if 'time' in frame.columns:
+            self.end_time = frame['time'].iloc[-1]
+        self.n_candles += len(df)
+        chunk = dict(pnl=pnl, position=traded_position[n_pre:], close=close,
+            exit_type=exit_type[n_pre:], exit_price=np.full(len(close), np.nan)
+                if exit_price is None else exit_price[n_pre:],
+            equity=pnl * bt.trade_amount, buyhold=close / self.first_close - 1)
+        if self.keep_curves and self.curves is not None:
+            if self.closed:
+                # undo result() closing the trade on the last candle
+                self.curves['pnl'].values[-1] = last_pending
+                self.curves['equity'].values[-1] = last_pending * bt.trade_amount
+                self.curves['drawdown'].truncate(self.curves['drawdown'].size - 1)
+        else:
+            self.curves = {key: _Buffer() for key in chunk}
+            self.curves['drawdown'] = _Buffer()
+            drawdown = drawdown[len(committed) - len(pnl) + 1:]
+        self.closed = False
+        for key, values in chunk.items():
+            self.curves[key].extend(values)
+        self.curves['drawdown'].extend(drawdown)
+        if not self.keep_curves:
+            self.data = frame
+            return
+        if self.columns is None:
+            self.columns = {column: _Buffer() for column in frame.columns}
+        for column, buffer in self.columns.items():
+            buffer.extend(_column_values(frame[column]))
+        self.data = pd.DataFrame({column: pd.Series(buffer.values, copy=False,
+                dtype=buffer.array.dtype)
+            for column, buffer in self.columns.items()}, copy=False)
+
+    def _add_sums(self, sums):
+        self.sums = sums if self.sums is None else add_sums(self.sums, sums)
+
+    def result(self):
+        """ Sets the results of all candles seen so far on the backtester """
+        bt = self.bt
+        if self.n_candles == 0:
+            raise ValueError('No candles to backtest.')
+        last = self.pending - self.pending_exit
+        state, drawdown = _drawdown_step(self.drawdown_state,
+            np.array([last]), self.n_candles - 1)
+        if not self.closed:
+            # the trade still open gets closed on the last candle
+            self.curves['pnl'].values[-1] = last
+            self.curves['equity'].values[-1] = last * bt.trade_amount
+            self.curves['drawdown'].extend(drawdown)
+            self.closed = True
+        trades = self.trades.values if self.open_trade is None \
+            else np.concatenate((self.trades.values, self.open_trade))
+        bt.batched = False
+        bt.data = self.data
+        bt.close = self.curves['close'].values
+        bt.position = self.curves['position'].values
+        bt.exit_type = self.curves['exit_type'].values
+        bt.exit_price = self.curves['exit_price'].values
+        bt.pnl = self.curves['pnl'].values
+        bt.drawdown = self.curves['drawdown'].values
+        bt.equity = self.curves['equity'].values
+        bt.buyhold_curve = self.curves['buyhold'].values
+        bt.trades = trades
+        bt.ambiguous_exits = self.ambiguous_exits.values
+        # markers as indices of the kept data
+        first = self.n_candles - len(self.data)
+        bt.idx_longs = self.idx_longs.values
+        bt.idx_shorts = self.idx_shorts.values
+        if first > 0:
+            bt.idx_longs = bt.idx_longs[bt.idx_longs >= first] - first
+            bt.idx_shorts = bt.idx_shorts[bt.idx_shorts >= first] - first
+        bt.n_longs = self.n_longs
+        bt.n_shorts = self.n_shorts
+        bt.total_trades = self.n_longs + self.n_shorts
+        bt.total_fees_paid = bt.total_trades * 2 * bt.fee_cost * bt.trade_amount
+        bt.max_drawdown = round(state['max_drawdown'], 2)
+        bt.max_equity = round(state['max_pnl'] * bt.trade_amount, 2)
+        bt.longest_drawdown_period = state['longest']
+        bt.average_drawdown_period = (state['last_high'] - state['first_high']) \
+            / (state['n_highs'] - 1) if state['n_highs'] > 1 else 0
+        bt.n_candles = self.n_candles
+        bt.start_time = self.start_time
+        bt.end_time = self.end_time
+        sums = add_sums(self.sums, curve_sums(np.array([last]), drawdown,
+            previous=self.previous))
+        sums['exposed'] = self.exposed
+        bt.metrics = performance_metrics(sums, last, state['max_drawdown'],
+            float(bt.buyhold_curve[-1]), self.periods_per_year)
+        bt._compute_trade_stats()
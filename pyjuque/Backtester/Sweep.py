@@ -0,0 +1,164 @@
+"""
+Runs a backtest for every combination of a parameter grid, in parallel.
+
+The OHLCV data is copied once into shared memory; worker processes map it
+when they start, so tasks only carry the parameters they test.
+"""
+
+import os
+import copy
+import itertools
+import numpy as np
+import pandas as pd
+from multiprocessing import shared_memory
+from concurrent.futures import ProcessPoolExecutor
+from pyjuque.Backtester.Backtester import Backtester
+
+# set in every worker process by _init_worker
+_worker = dict()
+
+
+def param_grid_to_list(param_grid):
+    """ Expands a dict of {param: [values]} into a list of param dicts """
+    keys = list(param_grid.keys())
+    return [dict(zip(keys, values))
+        for values in itertools.product(*[param_grid[k] for k in keys])]
+
+
+def config_with_params(bot_config, params):
+    """ Returns a copy of `bot_config` with `params` applied.
+
+    Keys are strategy params, unless prefixed by the settings they belong
+    to, eg. 'exit_settings.take_profit' or 'entry_settings.fee'. """
+    config = copy.deepcopy(bot_config)
+    config['strategy'] = dict(config['strategy'])
+    config['strategy']['params'] = dict(config['strategy']['params'])
+    for key, value in params.items():
+        if '.' in key:
+            section, name = key.split('.', 1)
+            config[section][name] = value
+        else:
+            config['strategy']['params'][key] = value
+    return config
+
+
+def _df_to_shared(df):
+    """ Copies the numeric and datetime columns of `df` into a shared memory
+    block, datetimes as int64. Returns the block and what _init_worker
+    rebuilds `df` from: where every shared column lies in the block, and
+    the other columns as they are. """
+    shared_columns, arrays, others, size = [], [], {}, 0
+    for column in df.columns:
+        values = df[column].values
+        if not isinstance(values, np.ndarray) or values.dtype.kind not in 'biufcM':
+            others[column] = df[column]
+            continue
+        tz = getattr(df[column].dtype, 'tz', None)
+        if values.dtype.kind == 'M':
+            values = values.view(np.int64)
+        values = np.ascontiguousarray(values)
+        # keep every column aligned on 8 bytes
+        size += -size % 8
+        shared_columns.append(dict(column=column, dtype=df[column].values.dtype.str,
+            tz=tz, offset=size))
+        arrays.append(values)
+        size += values.nbytes
+    shm = shared_memory.SharedMemory(create=True, size=max(size, 1))
+    for values, info in zip(arrays, shared_columns):
+        shared = np.ndarray(values.shape, dtype=values.dtype, buffer=shm.buf,
+            offset=info['offset'])
+        shared[:] = values
+    return shm, dict(name=shm.name, n_rows=len(df), columns=list(df.columns),
+        shared_columns=shared_columns, others=others, index=df.index)
+
+
+def _shared_to_df(shm, shm_info):
+    """ The DataFrame _df_to_shared copied, its shared columns mapping the
+    block """
+    columns = dict(shm_info['others'])
+    for info in shm_info['shared_columns']:
+        dtype = np.dtype(info['dtype'])
+        values = np.ndarray(shm_info['n_rows'], dtype=np.int64 if dtype.kind == 'M'
+            else dtype, buffer=shm.buf, offset=info['offset'])
+        if dtype.kind == 'M':
+            values = values.view(dtype)
+            if info['tz'] is not None:
+                values = pd.DatetimeIndex(values).tz_localize('UTC')\
+                    .tz_convert(info['tz'])
+        columns[info['column']] = values
+    df = pd.DataFrame(columns, copy=False)[shm_info['columns']]
+    df.index = shm_info['index']
+    return df
+
+
+def _init_worker(shm_info, bot_config, backtester_class):
+    shm = shared_memory.SharedMemory(name=shm_info['name'])
+    _worker['shm'] = shm
+    _worker['df'] = _shared_to_df(shm, shm_info)
+    _worker['bot_config'] = bot_config
+    _worker['backtester_class'] = backtester_class
+
+
+def _run_params(params, df=None, bot_config=None, backtester_class=None):
+    if df is None:
+        # strategies add indicator columns, keep the shared frame untouched
+        df = _worker['df'].copy(deep=False)
+        bot_config = _worker['bot_config']
+        backtester_class = _worker['backtester_class']
+    bt = backtester_class(config_with_params(bot_config, params))
+    bt.backtest(df)
+    results = bt.return_results()
+    if not getattr(bt, 'batched', False):
+        results = [results]
+    # batched strategies give one row per param set they were given
+    param_sets = getattr(bt.strategy, 'param_sets', None) \
+        if getattr(bt, 'batched', False) else None
+    rows = []
+    for i, row in enumerate(results):
+        row.pop('strategy_params', None)
+        row_params = params if param_sets is None else {**params, **param_sets[i]}
+        rows.append({**row_params, **row})
+    return rows
+
+
+def sweep(bot_config, df, param_grid, sort_by='pnl_ratio', ascending=False,
+    n_jobs=None, backtester_class=Backtester):
+    """ Backtests `bot_config` on `df` for every combination in `param_grid`.
+
+    `param_grid` is a dict of {param: [values]} (see config_with_params for
+    how keys map onto the config), or a list of param dicts. Runs are spread
+    over `n_jobs` processes (all cpus by default, 1 runs them in this
+    process). Numeric and datetime columns of `df` are shared with the
+    workers, the others are copied to each of them.
+
+    Returns a DataFrame with one row per combination: its params followed
+    by the backtester's return_results(), sorted by `sort_by`. Strategies
+    returning signal matrices give one row per param set of theirs
+    (`param_sets`), its params added to the combination's.
+    """
+    if isinstance(param_grid, dict):
+        param_list = param_grid_to_list(param_grid)
+    else:
+        param_list = list(param_grid)
+    if n_jobs is None:
+        n_jobs = os.cpu_count() or 1
+    if n_jobs == 1 or len(param_list) < 2:
+        rows = [row for params in param_list for row in 
+            _run_params(params, df.copy(), bot_config, backtester_class)]
+    else:
+        shm, shm_info = _df_to_shared(df)
+        try:
+            with ProcessPoolExecutor(max_workers=min(n_jobs, len(param_list)),
+                initializer=_init_worker,
+                initargs=(shm_info, bot_config, backtester_class)) as pool:
+                chunksize = max(1, len(param_list) // (4 * n_jobs))
+                rows = [row for rows in pool.map(_run_params, param_list,
+                    chunksize=chunksize) for row in rows]
+        finally:
+            shm.close()
+            shm.unlink()
+    results = pd.DataFrame(rows)
+    if sort_by is not None and len(results) > 0:
+        results = results.sort_values(sort_by, ascending=ascending)\
+            .reset_index(drop=True)
+    return results
@@ -0,0 +1,184 @@
+"""
+Walk forward optimization: pick the best params on a rolling train window,
+trade them on the test window that follows it and stitch all the out of
+sample results together.
+
+Indicators are causal, so every param set is set up once on the whole frame
+and each window only slices the resulting signals. Windows are then scored
+for all param sets at once with the batched kernels, in parallel threads.
+"""
+
+import os
+import numpy as np
+import pandas as pd
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+from pyjuque.Backtester.Backtester import Backtester
+from pyjuque.Backtester.Kernels import signals_to_position, apply_exits, \
+    batch_pnl_curve, drawdown_stats, delay_position, signal_sides
+from pyjuque.Backtester.Sweep import param_grid_to_list, config_with_params, \
+    _df_to_shared, _init_worker, _worker
+from pyjuque.Strategies import strategy_signals
+
+
+def _score_pnl_ratio(pnl):
+    return pnl[:, -1]
+
+
+def _score_return_over_drawdown(pnl):
+    max_drawdown = drawdown_stats(pnl)['max_drawdown']
+    return pnl[:, -1] / np.maximum(max_drawdown, 1e-6)
+
+
+METRICS = dict(
+    pnl_ratio = _score_pnl_ratio,
+    return_over_drawdown = _score_return_over_drawdown,
+)
+
+
+def _signals_for_params(params, df=None, bot_config=None, backtester_class=None):
+    """ Sets the strategy up once on the whole frame, returns its signals """
+    if df is None:
+        df = _worker['df'].copy(deep=False)
+        bot_config = _worker['bot_config']
+        backtester_class = _worker['backtester_class']
+    bt = backtester_class(config_with_params(bot_config, params))
+    bt.strategy.setUp(df)
+    long_signals, short_signals = strategy_signals(bt.strategy, len(df))
+    long_signals = np.atleast_2d(long_signals)
+    short_signals = np.atleast_2d(short_signals)
+    row_params = getattr(bt.strategy, 'param_sets', None) \
+        if len(long_signals) > 1 else None
+    if row_params is None:
+        row_params = [params] * len(long_signals)
+    return long_signals, short_signals, list(row_params)
+
+
+def compute_signals(bot_config, df, param_list, n_jobs=1,
+    backtester_class=Backtester):
+    """ Returns the long and short signal matrices of every param set in
+    `param_list` (one row per set) and the params of every row. """
+    if n_jobs == 1 or len(param_list) < 2:
+        outputs = [_signals_for_params(params, df.copy(), bot_config,
+            backtester_class) for params in param_list]
+    else:
+        shm, shm_info = _df_to_shared(df)
+        try:
+            with ProcessPoolExecutor(max_workers=min(n_jobs, len(param_list)),
+                initializer=_init_worker,
+                initargs=(shm_info, bot_config, backtester_class)) as pool:
+                outputs = list(pool.map(_signals_for_params, param_list))
+        finally:
+            shm.close()
+            shm.unlink()
+    long_signals = np.concatenate([o[0] for o in outputs])
+    short_signals = np.concatenate([o[1] for o in outputs])
+    row_params = [p for o in outputs for p in o[2]]
+    return long_signals, short_signals, row_params
+
+
+def window_pnl(settings, long_signals, short_signals, close, high, low,
+    buy_price=None, sell_price=None, stop_slippage=None, intrabar=None):
+    """ Pnl matrix of every row of signals on one window. Every window
+    starts flat, whatever the signals before it were. """
+    position = signals_to_position(long_signals, short_signals,
+        settings.go_long, settings.go_short)
+    position = delay_position(position, settings.fill_model.delay)
+    signals = delay_position(signal_sides(long_signals, short_signals,
+        settings.go_long, settings.go_short), settings.fill_model.delay)
+    exit_price = None
+    if settings.take_profit_value != np.inf or settings.stop_loss_value > 0:
+        exits = [apply_exits(row, close, high, low, settings.take_profit_value,
+            settings.stop_loss_value, settings.trailing_stop_loss,
+            settings.slippage, buy_price, sell_price, stop_slippage, intrabar,
+            row_signals) for row, row_signals in zip(position, signals)]
+        position = np.stack([e['position'] for e in exits])
+        exit_price = np.stack([e['exit_price'] for e in exits])
+    return batch_pnl_curve(position, close, settings.fee_cost, exit_price,
+        buy_price, sell_price)['pnl']
+
+
+def walk_forward(bot_config, df, param_grid, train_size, test_size,
+    step=None, metric='pnl_ratio', n_jobs=None, backtester_class=Backtester):
+    """ Walk forward optimization of `bot_config` over `df`.
+
+    Windows of `train_size` candles start every `step` candles (by default
+    `test_size`; test windows can't overlap). On each of them, the
+    params in `param_grid` (see Sweep.sweep) with the best `metric` (a name
+    from METRICS or a function mapping a pnl matrix to one score per row)
+    get traded on the `test_size` candles that follow.
+
+    Returns a dict holding a `windows` DataFrame (bounds, chosen params and
+    scores of every window) and the stitched out of sample `pnl`, `equity`
+    and `drawdown` curves together with the `time` of their candles.
+    """
+    if step is None:
+        step = test_size
+    if step < test_size:
+        raise ValueError('step ({}) should not be smaller than test_size ({}),'
+            ' test windows would overlap.'.format(step, test_size))
+    if isinstance(param_grid, dict):
+        param_list = param_grid_to_list(param_grid)
+    else:
+        param_list = list(param_grid)
+    if n_jobs is None:
+        n_jobs = os.cpu_count() or 1
+    score = METRICS[metric] if isinstance(metric, str) else metric
+    settings = backtester_class(config_with_params(bot_config, param_list[0]))
+    long_signals, short_signals, row_params = compute_signals(
+        bot_config, df, param_list, n_jobs, backtester_class)
+    close = settings._get_close(df).astype(np.float64)
+    high, low = settings._get_high_low(df)
+    high = high.astype(np.float64)
+    low = low.astype(np.float64)
+    buy, sell = settings.fill_model.prices(df, settings.trade_amount)
+    stop_slippage = settings._stop_slippage(df)
+    sub_start, sub_end = settings._intrabar_bounds(df)
+    times = np.asarray(df['time']) if 'time' in df.columns \
+        else np.arange(len(df))
+    starts = list(range(0, len(df) - train_size - test_size + 1, step))
+    if len(starts) == 0:
+        raise ValueError('Dataframe holds {} candles, less than one train '
+            'and test window ({} + {}).'.format(len(df), train_size, test_size))
+
+    def window_slippage(window):
+        # stop slippage on the candles of a window, indexed from its start
+        return lambda candles: stop_slippage(np.asarray(candles) + window.start)
+
+    def run_window(start):
+        train = slice(start, start + train_size)
+        test = slice(start + train_size, start + train_size + test_size)
+        train_pnl = window_pnl(settings, long_signals[:, train],
+            short_signals[:, train], close[train], high[train], low[train],
+            buy[train], sell[train], window_slippage(train),
+            settings._intrabar((sub_start[train], sub_end[train])))
+        scores = score(train_pnl)
+        best = int(np.nanargmax(scores))
+        test_pnl = window_pnl(settings, long_signals[best:best+1, test],
+            short_signals[best:best+1, test], close[test], high[test], low[test],
+            buy[test], sell[test], window_slippage(test),
+            settings._intrabar((sub_start[test], sub_end[test])))[0]
+        return dict(train_start = times[train.start],
+            train_end = times[train.stop - 1],
+            test_start = times[test.start],
+            test_end = times[test.stop - 1],
+            params = row_params[best],
+            train_score = scores[best],
+            train_pnl_ratio = train_pnl[best, -1],
+            test_pnl_ratio = test_pnl[-1]), test_pnl, test
+
+    with ThreadPoolExecutor(max_workers=n_jobs) as pool:
+        outputs = list(pool.map(run_window, starts))
+    # stitch the out of sample curves, every one continuing the previous
+    pnl, time, offset = [], [], 0.
+    for _, test_pnl, test in outputs:
+        pnl.append(test_pnl + offset)
+        time.append(times[test])
+        offset = pnl[-1][-1]
+    pnl = np.concatenate(pnl)
+    return dict(
+        windows = pd.DataFrame([o[0] for o in outputs]),
+        pnl = pnl,
+        equity = pnl * settings.trade_amount,
+        drawdown = drawdown_stats(pnl)['drawdown'],
+        time = np.concatenate(time),
+    )
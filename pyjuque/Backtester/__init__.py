@@ -1 +1,4 @@
-from .Backtester import Backtester
\ No newline at end of file
+from .Backtester import Backtester
+from .Sweep import sweep
+from .WalkForward import walk_forward
+from .Portfolio import PortfolioBacktester
@@ -3,11 +3,22 @@
         - stop loss, trailing stop loss &
         - subsequent entries (DCA) logic
 
+    Exits and subsequent entries are found by the array kernels of
+    pyjuque.Backtester (Kernels.apply_exits and Kernels.scale_in), this
+    module only rounds their prices to the symbol's tick size and reports
+    them.
+
     TODO: Needs proper testing.
 """
 
+import math
+import numpy as np
 import pandas as pd
 from decimal import Decimal
+from pyjuque.Backtester.Fills import get_fill_model, order_prices
+from pyjuque.Backtester.Kernels import EXIT_TAKE_PROFIT, EXIT_STOP_LOSS, \
+    EXIT_TRAILING_STOP, apply_exits, scale_in, signals_to_position
+from pyjuque.Strategies import signal_array
 
 # HELPER CLASS
 class dotdict(dict):
@@ -41,10 +52,21 @@ model_exit_settings:dotdict = dotdict(dict(
     sl = 0.85
 ))
 
+def _tick_rounding(exchange, symbol, price):
+    """ Looks the tick size rounding of `symbol` up once: returns the
+    number of decimals `exchange.toValidPrice` rounds prices to and the
+    tick it adds when rounding up """
+    valid_price = exchange.toValidPrice(symbol, price)
+    tick = exchange.toValidPrice(symbol, price, round_up=True) - valid_price
+    return -valid_price.as_tuple().exponent, tick
+
+
 def backtest(df, symbol, exchange,
     entry_strategy=model_entry_strategy,
     entry_settings=model_entry_settings,
-    exit_settings=model_exit_settings):
+    exit_settings=model_exit_settings,
+    exact=False,
+    fill_model=None):
     '''
         Function used to backtest a strategy on a dataframe `df`
         containing candlestick data of a coin over a period of time.
@@ -56,11 +78,15 @@ def backtest(df, symbol, exchange,
             dict `entry_strategy` - details about the entry strategy (function & args)
             dict `entry_settings` - details about the entry settings (subsequent entries)
             dict `exit_settings` - details about the exit settings (stop loss, tsl & take profit)
+            bool `exact` - compute with Decimals and `exchange.toValidPrice`
+                (slow, to verify final reports) instead of floats rounded
+                to the symbol's tick size
+            `fill_model` - price entries fill at, a FillModel or the name of
+                one of Fills.FILL_MODELS (the close by default)
         Returns
         --
             dict information about the backtesting results
     '''
-
     assert exit_settings.sl is None or \
         (exit_settings.sl <= Decimal(1) and exit_settings.sl > Decimal(0)), \
         ("stop_loss should be between 0 and 1, not "+str(exit_settings.sl))
@@ -92,157 +118,86 @@ def backtest(df, symbol, exchange,
     tsl_active_times = []
     tsl_increase_times = []
     profits_list = []
-
-    buy_price = 0
-    subsequent_buys = 0
-    resulting_percentage = Decimal(100)
-
-    last_buy = None
-    sl_price = None
-    tsl_active = False
-    tsl_sell_price = None
-    next_entry_price = None
-    next_target_price = None
-    tsl_increase_price = None
-    tsl_activate_after = None
-
+    sell_times = {
+        EXIT_TAKE_PROFIT: tp_sell_times,
+        EXIT_STOP_LOSS: sl_sell_times,
+        EXIT_TRAILING_STOP: tsl_sell_times,
+    }
+
+    # the kernels trade at prices rounded like toValidPrice does, without
+    # looking the symbol's filters up on every candle
+    decimals, tick = _tick_rounding(exchange, symbol, df['close'].iloc[0])
+    if exact:
+        num = Decimal
+        def valid_price(price, round_up=False):
+            return exchange.toValidPrice(symbol, num(price), round_up=round_up)
+    else:
+        num = float
+        tick = float(tick)
+        def valid_price(price, round_up=False):
+            number = round(float(price), decimals)
+            if round_up:
+                number = round(number + tick, decimals)
+            return number
     strategy = entry_strategy.strategy_class(*entry_strategy.args)
     strategy.setUp(df)
-    # Go through all the candlesticks
-    for i in range(0, len(df['close'])-1):
-        # Have we already opened a position?
-        if last_buy is None:
-            # If no, check whether the strategy is fulfilled at this point in time
-            strategy_result = strategy.checkLongSignal(i)
-
-            if strategy_result:
-                # If strategy is fulfilled, buy the coin
-                buy_price = exchange.toValidPrice(symbol, df['close'][i])
-                buy_times.append([df['time'][i], buy_price])
-
-                # Initialize TAKE PROFIT PRICE
-                if exit_settings.pt is not None:
-                    next_target_price = exchange.toValidPrice(symbol,\
-                        buy_price * Decimal(exit_settings.pt), round_up=True)
-
-                # Initialize STOP LOSS PRICE
-                if exit_settings.sl is not None:
-                    sl_price =  exchange.toValidPrice(symbol,\
-                        buy_price * Decimal(exit_settings.sl))
-
-                # Initialize TRAILING STOP LOSS PRICE
-                if exit_settings.tsl is not None:
-                    tsl_activate_after =  exchange.toValidPrice(symbol,\
-                        buy_price * Decimal(exit_settings.tsl.after_profit))
-
-                    if tsl_activate_after <= buy_price:
-                        tsl_active = True
-                        tsl_increase_price = buy_price
-                        tsl_sell_price =  exchange.toValidPrice(symbol,\
-                            buy_price * Decimal(exit_settings.tsl.value))
-
-                # Initialize SUBSEQUENT ENTRY PRICE
-                if entry_settings.se is not None:
-                    next_entry_price = exchange.toValidPrice(symbol,\
-                        buy_price * Decimal(entry_settings.se.after_profit))
-
-                last_buy = {
-                    "index": i,
-                    "price": buy_price
-                }
-
-        elif last_buy is not None and i > last_buy["index"] + 1:
-        # If we already opened a position, check whether the price has hit
-        # either the stop loss price, tsl_price, the target price, or if a
-        # subsequent entry is due
-
-            ### TRAILING STOP LOSS LOGIC
-            if exit_settings.tsl is not None:
-                if not tsl_active:
-                    if tsl_activate_after <= Decimal(df['high'][i]):
-                        tsl_active_times.append((df['time'][i], tsl_activate_after))
-                        tsl_active = True
-                        tsl_increase_price = Decimal(df['high'][i])
-                        tsl_sell_price = exchange.toValidPrice(symbol,\
-                            Decimal(df['high'][i]) * Decimal(exit_settings.tsl.value))
-                if tsl_active:
-                    if Decimal(df['low'][i]) <= tsl_sell_price:
-                    # Price went below TSL so we have to sell
-                        profits_list.append(tsl_sell_price - last_buy['price'])
-                        tsl_sell_times.append([df['time'][i], tsl_sell_price, subsequent_buys])
-                        resulting_percentage = resulting_percentage * (tsl_sell_price / buy_price)
-                        buy_price = Decimal(0)
-                        tsl_active = False
-                        tsl_activate_after = None
-                        tsl_increase_price = None
-                        last_buy = None
-                        subsequent_buys = 0
-                    elif Decimal(df['high'][i]) > tsl_increase_price:
-                    # Price went above pervious high so we adjust TSL Target
-                        tsl_increase_times.append((df['time'][i], tsl_increase_price))
-                        tsl_increase_price = Decimal(df['high'][i])
-                        tsl_sell_price = exchange.toValidPrice(symbol,\
-                            Decimal(df['high'][i]) * Decimal(exit_settings.tsl.value))
-
-            ### STOP LOSS LOGIC
-            if exit_settings.sl is not None and \
-                Decimal(df['low'][i]) < sl_price:
-                # If price went below our stop_loss, it means we sold at that point
-                profits_list.append(sl_price - last_buy['price'])
-                sl_sell_times.append([df['time'][i], sl_price, subsequent_buys])
-                resulting_percentage = resulting_percentage * (sl_price / buy_price)
-                buy_price = Decimal(0)
-                subsequent_buys = 0
-                tsl_active = False
-                tsl_activate_after = None
-                tsl_increase_price = None
-                last_buy = None
-
-            ### SUBSEQUENT ENTRIES LOGIC
-            if entry_settings.se is not None and \
-                Decimal(df['low'][i]) < next_entry_price \
-                and subsequent_buys < entry_settings.se.times:
-
-                buy_price = next_entry_price
-
-                if entry_settings.pt is not None:
-                    next_target_price = exchange.toValidPrice(symbol,\
-                        buy_price * Decimal(entry_settings.pt) * \
-                        Decimal(entry_settings.se.pt_decrease), round_up=True)
-
-                if exit_settings.tsl is not None:
-                    tsl_activate_after = exchange.toValidPrice(symbol,\
-                        buy_price * Decimal(exit_settings.tsl.after_profit))
-
-                    if tsl_activate_after <= buy_price:
-                        tsl_active = True
-                        tsl_increase_price = buy_price
-                        tsl_sell_price =  exchange.toValidPrice(symbol,\
-                            buy_price * Decimal(exit_settings.tsl.value))
-                    else:
-                        tsl_active = False
-
-                next_entry_price = exchange.toValidPrice(symbol,\
-                    buy_price * Decimal(entry_settings.se.after_profit))
-                
-                buy_times.append([df['time'][i], buy_price])
-                last_buy = { "index": i, "price": buy_price}
-                subsequent_buys = subsequent_buys + 1
-
-            ### TAKE PROFIT LOGIC
-            if exit_settings.pt is not None and exit_settings.tsl is None and \
-                Decimal(df['high'][i]) > next_target_price:
-
-                tp_sell_times.append([df['time'][i], next_target_price, subsequent_buys])
-                profits_list.append(next_target_price - last_buy['price'])
-                resulting_percentage = resulting_percentage * \
-                    (next_target_price / buy_price)
-                tsl_increase_price = None
-                last_buy = None
-                subsequent_buys = 0
-                tsl_active = False
-                tsl_activate_after = None
-                buy_price = Decimal(0)
+    long_signals = signal_array(strategy, len(df)).astype(np.int8)
+    time = df['time'].tolist()
+    close = df['close'].to_numpy(dtype=np.float64)
+    high = df['high'].to_numpy(dtype=np.float64)
+    low = df['low'].to_numpy(dtype=np.float64)
+    # price of the market buys sent on every candle
+    entry_price = np.round(
+        order_prices(get_fill_model(fill_model), df)[0], decimals)
+
+    # long from every signal, until an exit
+    position = signals_to_position(long_signals, np.zeros_like(long_signals))
+    tsl = exit_settings.tsl
+    exits = apply_exits(position, close, high, low,
+        take_profit = float(exit_settings.pt) \
+            if exit_settings.pt is not None and tsl is None else math.inf,
+        stop_loss = float(exit_settings.sl) if exit_settings.sl is not None else 0.,
+        buy_price = entry_price, signals = long_signals,
+        trailing_value = float(tsl.value) if tsl is not None else None,
+        trailing_after = float(tsl.after_profit) if tsl is not None else 1.)
+    se = entry_settings.se
+    entries = scale_in(exits['position'], high, low, entry_price,
+        se.times if se is not None else 0,
+        float(se.after_profit) if se is not None else None)
+
+    resulting_percentage = num(100)
+    for start, end, n_entries in zip(entries['trade_starts'].tolist(),
+        entries['trade_ends'].tolist(), entries['n_entries'].tolist()):
+        added = entries['add_trades'] == start
+        candles = [start] + entries['add_candles'][added].tolist()
+        fills = [valid_price(price) for price in
+            [entry_price[start]] + entries['add_prices'][added].tolist()]
+        buy_times.extend([time[c], price] for c, price in zip(candles, fills))
+
+        if tsl is not None:
+            # candles the trailing stop activates and moves up on
+            stop = min(end + 1, len(time))
+            activate_after = valid_price(num(entry_price[start]) * num(tsl.after_profit))
+            reached = np.flatnonzero(high[start+1:stop] >= float(activate_after))
+            if len(reached) > 0:
+                active = start + 1 + int(reached[0])
+                tsl_active_times.append((time[active], activate_after))
+                peak = np.maximum.accumulate(high[active:stop])
+                moved = np.flatnonzero(high[active+1:stop] > peak[:-1])
+                tsl_increase_times.extend((time[active + 1 + j], num(peak[j]))
+                    for j in moved.tolist())
+
+        if end == len(time):
+            # still open on the last candle
+            continue
+        kind = int(exits['exit_type'][end])
+        sell_price = valid_price(exits['exit_price'][end], 
+            round_up = kind == EXIT_TAKE_PROFIT)
+        # every entry buys for the same amount of quote
+        average_price = num(n_entries) / sum(1 / price for price in fills)
+        sell_times[kind].append([time[end], sell_price, n_entries - 1])
+        profits_list.append(sell_price - average_price)
+        resulting_percentage = resulting_percentage * (sell_price / average_price)
 
     ms = df['time'][len(df['time'])-1] - df['time'][0]
     return dict(
@@ -4,10 +4,19 @@
 -> Set Take Profit
 -> Set Stop Loss
 
+Trades and their pyramided entries come from the array kernels 
+(Kernels.apply_exits, Kernels.scale_in, Kernels.pnl_curve), which are
+replayed through the methods above to keep the balance bookkeeping.
 '''
 
+import math
 import pandas as pd 
 import numpy as np 
+from pyjuque.Strategies.IndicatorCache import cache_from_config
+from pyjuque.Backtester.Fills import get_fill_model, order_prices
+from pyjuque.Backtester.Kernels import apply_exits, pnl_curve, scale_in, \
+    signal_sides, signals_to_position
+from pyjuque.Strategies import strategy_signals
 
 
 class Backtester():
@@ -48,6 +57,12 @@ class Backtester():
             self.sell_on_end = params['exit_settings']['sell_on_end']
 
         self.strategy = params['strategy']['class'](**params['strategy']['params'])
+        cache = cache_from_config(params)
+        if cache is not None:
+            self.strategy.indicator_cache = cache
+
+        # price market orders fill at, see Fills
+        self.fill_model = get_fill_model(params.get('fill_model'))
 
         self.amount = 0
         self.fee_cost = 0.1 / 100
@@ -76,6 +91,8 @@ class Backtester():
         self.is_long_open = False
         self.is_short_open = False
         self.from_opened = 0
+        # highest high since from_opened, up to the previous candle
+        self.running_high = -np.inf
 
 
     def reset_results(self):
@@ -93,6 +110,7 @@ class Backtester():
         self.is_long_open = False
         self.is_short_open = False
         self.from_opened = 0
+        self.running_high = -np.inf
         self.locked_in_trades = 0
         self.locked_trades = 0
         self.last_price = 0
@@ -108,7 +126,9 @@ class Backtester():
             # if self.is_short_open and self.exit_on_long:
             #     self.close_position(price)
             if self.is_long_open:
-                self.long_open_price = (self.long_open_price + price)/2
+                # every entry buys for inv, the average is harmonic
+                self.long_open_price = (self.open_positions + 1) / \
+                    (self.open_positions / self.long_open_price + 1 / price)
                 self.amount += self.inv #* price
             else:
                 self.is_long_open = True
@@ -133,6 +153,7 @@ class Backtester():
         # self.amount = self.inv/price
         if self.trailing_stop_loss:
             self.from_opened = from_opened
+            self.running_high = -np.inf
 
 
     def close_position(self, price, time):
@@ -243,57 +264,63 @@ class Backtester():
         return results
 
 
-    def backtest(self, df):
-        high = df['high']
-        close = df['close']
-        low = df['low']
-        time = df['time']
+    def update_trailing_stop_loss(self, high, i):
+        """ Raises the stop loss to follow the highest high seen from the 
+        candle the position was opened on up to the previous one. The 
+        running max only takes in one new candle per call. """
+        if i > self.from_opened and high[i - 1] > self.running_high:
+            self.running_high = high[i - 1]
+        # no candle seen yet, like the max of an empty window
+        new_max = self.running_high if self.running_high > -np.inf else np.nan
+        previous_stop_loss = self.stop_loss_price
+        self.set_stop_loss(price = new_max)
+        if previous_stop_loss > self.stop_loss_price:
+            self.stop_loss_price = previous_stop_loss
 
-        self.strategy.setUp(df)
 
-        for i in range(len(df)):
+    def backtest(self, df):
+        # raw arrays for the kernels
+        high = df['high'].to_numpy()
+        close = df['close'].to_numpy()
+        low = df['low'].to_numpy()
+        time = df['time'].to_numpy()
 
-            # Check Signals
-            long_signal = self.strategy.checkLongSignal(i)
-            short_signal = self.strategy.checkShortSignal(i)
-            
-            # Close Existing Trades if Open
-            if self.is_long_open:
-                if self.exit_on_short and short_signal:
-                    self.close_position(price = close[i], time = time[i])
-                elif high[i] >= self.take_profit_price:
-                    self.close_position(price = self.take_profit_price, time = time[i])
-                elif low[i] <= self.stop_loss_price:
-                    self.close_position(price = self.stop_loss_price, time = time[i])
-            # elif self.is_short_open:
-            #     if self.exit_on_long and long_signal:
-            #         self.close_position(price = close[i], time = time[i])
-            #     elif high[i] >= self.stop_loss_price:
-            #         self.close_position(price = self.stop_loss_price, time = time[i])
-            #     elif low[i] <= self.take_profit_price:
-            #         self.close_position(price = self.take_profit_price, time = time[i])
-                
-            if self.balance > 0:
-                # Open New Trades If We Received Signals
-                if long_signal:
-                    self.open_position(price = close[i], time = time[i], side = 'long', from_opened = i)
-                    self.set_take_profit(price = close[i], tp_long = self.take_profit)
-                    self.set_stop_loss(price = close[i], sl_long = self.stop_loss_value)
-                # elif short_signal:
-                #     self.open_position(price = close[i], time = time[i], side = 'short', from_opened = i)
-                #     self.set_take_profit(price = close[i], tp_short = self.take_profit)
-                #     self.set_stop_loss(price = close[i], sl_short = self.stop_loss_value)
-                        
-            # Update Trailing Stop Loss If Available
-            if self.trailing_stop_loss and (self.is_long_open): # or self.is_short_open):
-                new_max = high[self.from_opened : i].max()
-                previous_stop_loss = self.stop_loss_price
-                self.set_stop_loss(price = new_max)
-                if previous_stop_loss > self.stop_loss_price:
-                    self.stop_loss_price = previous_stop_loss
-                
-        if (len(self.entries) > len(self.exits)) and self.is_long_open and self.sell_on_end:
-            self.close_position(price = close[i], time = time[i])
+        self.strategy.setUp(df)
+        long_signals, short_signals = strategy_signals(self.strategy, len(df))
+        # prices market orders sent on every candle fill at
+        buy, sell = order_prices(self.fill_model, df, self.inv)
+
+        # long from every signal, until a take profit, stop loss or short
+        # signal, with one more entry on every long signal while the 
+        # balance lasts
+        no_signals = np.zeros(len(df), dtype=np.int8)
+        position = signals_to_position(long_signals, 
+            short_signals if self.exit_on_short else no_signals)
+        sides = signal_sides(long_signals, no_signals)
+        exits = apply_exits(position, close, high, low, self.take_profit,
+            self.stop_loss_value, buy_price = buy, sell_price = sell,
+            signals = sides,
+            # trails 1% below the highest high, like update_trailing_stop_loss
+            trailing_value = 0.99 if self.trailing_stop_loss else None)
+        entries = scale_in(exits['position'], high, low, buy,
+            math.ceil(self.initial_balance / self.inv) - 1, signals = sides)
+        curve = pnl_curve(exits['position'], close, 0., exits['exit_price'],
+            buy, sell)
+
+        last = len(df) - 1
+        # replays the trades through the positions bookkeeping
+        for start, end, exit_price in zip(entries['trade_starts'].tolist(),
+            curve['trade_exits'].tolist(), curve['trade_exit_prices'].tolist()):
+            self.open_position(price = buy[start], time = time[start], 
+                side = 'long', from_opened = start)
+            added = entries['add_trades'] == start
+            for c in entries['add_candles'][added].tolist():
+                self.open_position(price = buy[c], time = time[c], 
+                    side = 'long', from_opened = c)
+            still_open = end == last and exits['position'][last] != 0
+            # the last one is closed at the last candle's sell price
+            if not still_open or self.sell_on_end:
+                self.close_position(price = exit_price, time = time[end])
 
         if (len(self.entries) == 0) or (len(self.exits) == 0):
             raise ValueError("""
@@ -5,6 +5,7 @@ import math
 from pprint import pprint
 from pyjuque.Engine.Models import TABotModel as Bot, PairModel as Pair, OrderModel as Order
 from pyjuque.Engine.OrderManager import placeNewOrder, simulateOrderInfo, cancelOrder
+from pyjuque.Engine.TickContext import TickContext
 from pyjuque.Exchanges.Base.Exceptions import InvalidCredentialsException, \
     InternalExchangeException, ExchangeConnectionException
 from traceback import print_exc
@@ -24,10 +25,20 @@ class BotController:
         self.kline_interval = timeframe
         self.status_printer = status_printer
         self.logger_on = logger_on
+        # candles and signals shared by the checks of one executeBot pass
+        self.tick = None
 
 
     def executeBot(self):
         """ The main execution loop of the bot """
+        self.tick = TickContext()
+        try:
+            self._executeTick()
+        finally:
+            self.tick = None
+
+
+    def _executeTick(self):
         if self.status_printer != None:
             self.status_printer.start()
         # Step 1: Retreive all pairs for a particular bot
@@ -60,12 +71,27 @@ class BotController:
         self.log("Executed the bot loop. Now waiting...", should_print=False)
 
 
+    def getCandles(self, symbol):
+        """ The strategy's `minimum_period` last candles of `symbol`, 
+        fetched once per executeBot pass """
+        context = self.tick if self.tick is not None else TickContext()
+        return context.getCandles(self.exchange, symbol, self.kline_interval, 
+            getattr(self.strategy, 'minimum_period', None))
+
+
+    def getSignals(self, symbol, df):
+        """ The (entry, exit) signals of the strategy on the last candle 
+        of `df`, the candles of `symbol`, computed once per executeBot pass """
+        context = self.tick if self.tick is not None else TickContext()
+        return context.getSignals(self.strategy, symbol, self.kline_interval, df)
+
+
     def checkEntryStrategy(self, symbol):
         """ Default function that checks up the entry strategy. 
         Can be overridden for custom strategies.
         """
         try:
-            df = self.exchange.getOHLCV(symbol, self.kline_interval, self.strategy.minimum_period)
+            df = self.getCandles(symbol)
         except Exception as e:
             self.log('Error getting data from the exchange for {}:'.format(symbol))
             self.logError(sys.exc_info()[0])
@@ -73,8 +99,7 @@ class BotController:
             self.logError(sys.exc_info()[2])
             return False, None
         try:
-            self.strategy.setUp(df)
-            entry_signal = self.strategy.checkLongSignal(len(df) - 1)
+            entry_signal = self.getSignals(symbol, df)[0]
             last_price = df.iloc[-1]['close']
         except Exception as e:
             self.log('Error computing indicators for {}:'.format(symbol))
@@ -259,7 +284,7 @@ class BotController:
         position goes against us (basically simple oco order variant)
         """
         try:
-            candlestick_data = self.exchange.getOHLCV(order.symbol, self.kline_interval)
+            candlestick_data = self.getCandles(order.symbol)
         except Exception:
             self.log('Error getting data from the exchange '
                 'for updating open sell order on {}:'.format(pair.symbol))
@@ -319,7 +344,7 @@ class BotController:
         Can be overwritten for custom strategies.
         """
         try:
-            df = self.exchange.getOHLCV(symbol, self.kline_interval, self.strategy.minimum_period)
+            df = self.getCandles(symbol)
         except Exception:
             self.log('Error getting data from the exchange for {}:'.format(symbol))
             self.logError(sys.exc_info()[0])
@@ -327,8 +352,7 @@ class BotController:
             self.logError(sys.exc_info()[2])
             return False, None
         try:
-            self.strategy.setUp(df)
-            exit_signal = self.strategy.checkShortSignal(len(df) - 1)
+            exit_signal = self.getSignals(symbol, df)[1]
             last_price = df.iloc[-1]['close']
         except Exception as e:
             self.log('Error computing indicators for {}:'.format(symbol))
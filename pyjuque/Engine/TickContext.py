@@ -0,0 +1,41 @@
+"""
+What one bot tick fetched and computed.
+
+In one pass of BotController.executeBot the same symbol gets checked for
+an entry, then for an exit when its entry order fills, then again while
+its exit order is open. A TickContext lives for one pass and makes those
+checks share the candles fetched for a (symbol, timeframe) and the
+signals the strategy computed on a (symbol, timeframe, last candle time),
+so that the exchange is called and the strategy set up once per symbol.
+"""
+
+from pyjuque.Strategies import latest_signal
+
+
+class TickContext():
+
+    def __init__(self):
+        self.candles = {}
+        self.signals = {}
+
+    def getCandles(self, exchange, symbol, timeframe, limit=None):
+        """ The last `limit` candles of `symbol` (the exchange's default
+        number if None), fetched on the first call only """
+        key = (symbol, timeframe, limit)
+        if key not in self.candles:
+            if limit is None:
+                self.candles[key] = exchange.getOHLCV(symbol, timeframe)
+            else:
+                self.candles[key] = exchange.getOHLCV(symbol, timeframe, limit)
+        return self.candles[key]
+
+    def getSignals(self, strategy, symbol, timeframe, df):
+        """ The (long, short) signals of `strategy` on the last candle of
+        `df`, the candles of `symbol`, set up on the first call only """
+        key = (symbol, timeframe, df.iloc[-1]['time'] if 'time' in df.columns
+            else len(df))
+        if key not in self.signals:
+            strategy.setUp(df)
+            self.signals[key] = (latest_signal(strategy, len(df)),
+                latest_signal(strategy, len(df), short=True))
+        return self.signals[key]
@@ -0,0 +1,39 @@
+import numpy as np
+from pyjuque.Strategies import VectorStrategy
+from pyjuque.Strategies.Indicators import rsi, bollinger_bands, shift
+
+
+class BBRSIStrategy(VectorStrategy):
+    """ Bollinger Bands x RSI: buys when the RSI jumps up after being
+    oversold, as the price gets back above the lower Bollinger band """
+    def __init__(self, rsi_len = 8, bb_len = 100, rsi_ob = 50, rsi_os = 50):
+        self.rsi_ob = rsi_ob
+        self.rsi_os = rsi_os
+        self.bb_len = bb_len
+        self.rsi_len = rsi_len
+        # the minimum number of candles needed to compute our indicators
+        self.minimum_period = max(100, bb_len, rsi_len)
+
+    def setUp(self, df):
+        open_ = df['open'].to_numpy(dtype=np.float64)
+        close = df['close'].to_numpy(dtype=np.float64)
+        rsi_ = rsi(close, self.rsi_len)
+        lbb = bollinger_bands(close, self.bb_len)[0]
+        rsi_1, rsi_2, rsi_3 = shift(rsi_, 1), shift(rsi_, 2), shift(rsi_, 3)
+        lbb_1, close_1 = shift(lbb, 1), shift(close, 1)
+        with np.errstate(divide='ignore', invalid='ignore'):
+            was_oversold = (rsi_1 < self.rsi_os) | (rsi_2 < self.rsi_os) \
+                | (rsi_3 < self.rsi_os)
+            # the rsi jumped this candle and the price crossed the band up
+            crossed_now = (rsi_ / rsi_1 > 1.2) & (open_ < lbb) & (lbb < close) \
+                & (shift(open_, 1) < lbb_1) & (close_1 < lbb_1)
+            # or the previous one, after two candles closed under the band
+            crossed_before = (rsi_1 / rsi_2 > 1.2) \
+                & (shift(close, 3) < shift(lbb, 3)) \
+                & (shift(close, 2) < shift(lbb, 2)) & (close_1 > lbb_1) \
+                & (close > lbb)
+        self.long_signals = was_oversold & (crossed_now | crossed_before)
+        self.long_signals[:3] = False
+        # only exits on take profit or stop loss
+        self.short_signals = np.zeros(len(df), dtype=bool)
+        self.dataframe = df
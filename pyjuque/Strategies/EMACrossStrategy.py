@@ -0,0 +1,28 @@
+import numpy as np
+from pyjuque.Strategies import VectorStrategy
+from pyjuque.Strategies.Indicators import ema, shift
+
+
+class EMACrossStrategy(VectorStrategy):
+    """ Buys when the low gets back above the slow EMA in an uptrend (fast
+    EMA above the slow one), sells when the close falls under both as the
+    fast EMA crosses under the slow one """
+    minimum_period = 100
+    def __init__(self, fast_ma_len = 10, slow_ma_len = 50):
+        self.fast_ma_len = fast_ma_len
+        self.slow_ma_len = slow_ma_len
+        # the minimum number of candles needed to compute our indicators
+        self.minimum_period = max(100, slow_ma_len)
+
+    def setUp(self, df):
+        low = df['low'].to_numpy(dtype=np.float64)
+        close = df['close'].to_numpy(dtype=np.float64)
+        slow_ma = ema(close, self.slow_ma_len)
+        fast_ma = ema(close, self.fast_ma_len)
+        slow_ma_1, fast_ma_1 = shift(slow_ma, 1), shift(fast_ma, 1)
+        low_1 = shift(low, 1)
+        self.long_signals = (low_1 < slow_ma_1) & (low > slow_ma) \
+            & (low > fast_ma) & (fast_ma > slow_ma)
+        self.short_signals = ((low_1 > slow_ma_1) | (fast_ma_1 > slow_ma_1)) \
+            & (close < slow_ma) & (close < fast_ma) & (fast_ma < slow_ma)
+        self.dataframe = df
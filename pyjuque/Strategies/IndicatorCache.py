@@ -0,0 +1,188 @@
+"""
+Memoizes indicator computations, so that setting a strategy up again on
+the same data (eg. while sweeping exit settings) becomes a lookup.
+"""
+
+import sys
+import hashlib
+import functools
+import numpy as np
+import pandas as pd
+from collections import OrderedDict
+from threading import Lock
+
+
+def fingerprint(data):
+    """ Returns a hash of the values (and shape) of an array, Series or
+    DataFrame. Index and column names are not part of it. """
+    if isinstance(data, pd.DataFrame):
+        h = hashlib.blake2b(digest_size=16)
+        for column in data.columns:
+            h.update(fingerprint(data[column]).encode())
+        return h.hexdigest()
+    if isinstance(data, pd.Series):
+        data = data.to_numpy()
+    if isinstance(data, np.ndarray):
+        h = hashlib.blake2b(digest_size=16)
+        h.update(str((data.dtype.str, data.shape)).encode())
+        if data.dtype == object:
+            h.update(repr(data.tolist()).encode())
+        else:
+            h.update(np.ascontiguousarray(data).view(np.uint8).data)
+        return h.hexdigest()
+    return repr(data)
+
+
+def function_key(function):
+    """ What tells `function` apart in cache keys: its module and qualified
+    name, with the arguments functools.partial binds. None for lambdas,
+    local functions and callable objects, whose name doesn't say what they
+    compute. """
+    if isinstance(function, functools.partial):
+        key = function_key(function.func)
+        if key is None:
+            return None
+        return (key, tuple(fingerprint(a) for a in function.args),
+            tuple(sorted((k, fingerprint(v)) for k, v in function.keywords.items())))
+    qualname = getattr(function, '__qualname__', None)
+    if qualname is None or '<' in qualname:
+        return None
+    return '{}.{}'.format(function.__module__, qualname)
+
+
+def cache_from_config(params):
+    """ The IndicatorCache a bot config opts into with its `indicator_cache`
+    key: default_cache for True, the given cache, or None """
+    cache = params.get('indicator_cache')
+    if cache is None or cache is False:
+        return None
+    return default_cache if cache is True else cache
+
+
+def _size_of(value):
+    """ Approximate number of bytes held by a cached value """
+    if isinstance(value, np.ndarray):
+        return value.nbytes
+    if isinstance(value, (pd.Series, pd.DataFrame)):
+        return int(np.sum(value.memory_usage(index=True)))
+    if isinstance(value, (tuple, list)):
+        return sum(_size_of(v) for v in value)
+    if isinstance(value, dict):
+        return sum(_size_of(v) for v in value.values())
+    return sys.getsizeof(value)
+
+
+def _freeze(value):
+    """ What the cache keeps of `value`: arrays made read only, so they
+    can't be changed in place, and copies of Series and DataFrames, which
+    can't be made read only """
+    if isinstance(value, np.ndarray):
+        value.setflags(write=False)
+    elif isinstance(value, (pd.Series, pd.DataFrame)):
+        return value.copy()
+    elif isinstance(value, (tuple, list)):
+        return _rebuild(value, [_freeze(v) for v in value])
+    return value
+
+
+def _unshare(value):
+    """ `value` as handed out by the cache: copies of its Series and
+    DataFrames, its (read only) arrays as they are """
+    if isinstance(value, (pd.Series, pd.DataFrame)):
+        return value.copy()
+    if isinstance(value, (tuple, list)):
+        return _rebuild(value, [_unshare(v) for v in value])
+    return value
+
+
+def _rebuild(value, items):
+    """ The tuple or list `value` holding `items` instead, itself if none
+    changed """
+    if all(item is v for item, v in zip(items, value)):
+        return value
+    if hasattr(value, '_make'):
+        return value._make(items)
+    return type(value)(items)
+
+
+class IndicatorCache():
+    """ Least recently used cache of indicator values.
+
+    Values are keyed by the indicator name, the fingerprint of the data it
+    was computed on and its params. Once the cached values take more than
+    `max_bytes`, the least recently used ones are dropped.
+    """
+
+    def __init__(self, max_bytes=512 * 1024 * 1024):
+        self.max_bytes = max_bytes
+        self.n_bytes = 0
+        self.hits = 0
+        self.misses = 0
+        self._values = OrderedDict()
+        self._lock = Lock()
+
+    def __deepcopy__(self, memo):
+        # configs holding a cache get copied, the cache is shared
+        return self
+
+    def __reduce__(self):
+        # other processes start with an empty cache of the same budget
+        return (IndicatorCache, (self.max_bytes,))
+
+    def __len__(self):
+        return len(self._values)
+
+    def __contains__(self, key):
+        return key in self._values
+
+    @staticmethod
+    def key(name, data, **params):
+        """ The key an indicator computed on `data` (an array, Series,
+        DataFrame or a tuple of them) with `params` is stored under """
+        if not isinstance(data, tuple):
+            data = (data,)
+        return (name, tuple(fingerprint(d) for d in data),
+            tuple(sorted((k, fingerprint(v)) for k, v in params.items())))
+
+    def get(self, key, default=None):
+        with self._lock:
+            if key not in self._values:
+                self.misses += 1
+                return default
+            self.hits += 1
+            self._values.move_to_end(key)
+            return _unshare(self._values[key][0])
+
+    def set(self, key, value):
+        size = _size_of(value)
+        with self._lock:
+            if key in self._values:
+                self.n_bytes -= self._values.pop(key)[1]
+            if size > self.max_bytes:
+                return value
+            self._values[key] = (_freeze(value), size)
+            self.n_bytes += size
+            while self.n_bytes > self.max_bytes:
+                _, (_, dropped) = self._values.popitem(last=False)
+                self.n_bytes -= dropped
+        return value
+
+    def compute(self, name, function, data, **params):
+        """ Returns `function(data, **params)`, computing it only if it's
+        not cached yet. If `data` is a tuple, it's unpacked into the call.
+        Cached arrays are read only, Series and DataFrames get copied. """
+        key = self.key(name, data, **params)
+        value = self.get(key, self)
+        if value is self:
+            args = data if isinstance(data, tuple) else (data,)
+            value = self.set(key, function(*args, **params))
+        return value
+
+    def clear(self):
+        with self._lock:
+            self._values.clear()
+            self.n_bytes = 0
+
+
+# Shared by all strategies and backtesters that opt into caching
+default_cache = IndicatorCache()
@@ -0,0 +1,171 @@
+"""
+Indicators declared as a graph, computed once however many rules and
+strategies use them.
+
+A strategy declares its indicators as Nodes: a function applied to
+dataframe columns or to other nodes, with params. A node is identified by
+what it computes, so the EMA an entry rule and an exit rule (or two
+strategies) both declare is a single node. IndicatorGraph evaluates the
+nodes in topological order, every distinct one once, and keeps the values
+in an IndicatorCache keyed by the fingerprint of the columns they come
+from: strategies sharing the cache (by default all GraphStrategy of the
+process, through default_cache) set up on the same candles reuse each
+other's nodes.
+
+    close = Column('close')
+    slow = Node(ema, close, period=50)
+    fast = Node(ema, close, period=10)
+    lower, middle, upper = Node(bollinger_bands, close, period=20).outputs(3)
+"""
+
+import numpy as np
+from abc import abstractmethod
+from pyjuque.Strategies import VectorStrategy
+from pyjuque.Strategies.IndicatorCache import default_cache, fingerprint, \
+    function_key
+
+
+class Node():
+    """ `function(*inputs, **params)`, where inputs are Nodes or the names
+    of dataframe columns. Functions are told apart by their module and
+    name (see function_key), or by `name` if given. Lambdas, local
+    functions and callable objects only match themselves: their values,
+    and those of the nodes using them, aren't cached. """
+
+    # whether the graph's cache keeps its values
+    cached = True
+    # whether the key tells the node apart beyond its lifetime
+    stable = True
+
+    def __init__(self, function, *inputs, name=None, **params):
+        self.function = function
+        self.inputs = tuple(Column(i) if isinstance(i, str) else i
+            for i in inputs)
+        self.params = params
+        if name is None:
+            name = function_key(function)
+        if name is None:
+            # ids are only unique while the node holds the function
+            name = '{}@{}'.format(getattr(function, '__qualname__',
+                type(function).__qualname__), id(function))
+            self.stable = False
+        self.stable = self.stable and all(node.stable for node in self.inputs)
+        if not self.stable:
+            self.cached = False
+        self.key = (name, tuple(node.key for node in self.inputs),
+            tuple(sorted((k, fingerprint(v)) for k, v in params.items())))
+
+    def __getitem__(self, index):
+        """ Output `index` of an indicator returning several ones """
+        return Output(self, index)
+
+    def outputs(self, n_outputs):
+        return tuple(self[i] for i in range(n_outputs))
+
+    def compute(self, *values):
+        return self.function(*values, **self.params)
+
+
+class Column(Node):
+    """ A column of the dataframe, as a float64 array """
+
+    def __init__(self, column):
+        self.column = column
+        self.inputs = ()
+        self.key = ('column', column)
+
+    def compute(self, df):
+        return df[self.column].to_numpy(dtype=np.float64)
+
+
+class Output(Node):
+    """ One of the outputs of a node, not cached on its own """
+
+    cached = False
+
+    def __init__(self, node, index):
+        super().__init__(_output, node, name='output', index=index)
+
+
+class IndicatorGraph():
+    """ Evaluates nodes on dataframes, caching their values in `cache` """
+
+    def __init__(self, cache=default_cache):
+        self.cache = cache
+
+    def evaluate(self, nodes, df):
+        """ Values of `nodes` (a dict of {name: Node}) on `df`, by name """
+        values = {}
+        # fingerprints of the columns every node comes from
+        sources = {}
+        for node in topological_order(nodes.values()):
+            if isinstance(node, Column):
+                values[node.key] = node.compute(df)
+                sources[node.key] = {node.key: fingerprint(values[node.key])}
+                continue
+            sources[node.key] = {}
+            for i in node.inputs:
+                sources[node.key].update(sources[i.key])
+            inputs = [values[i.key] for i in node.inputs]
+            if not node.cached:
+                values[node.key] = node.compute(*inputs)
+                continue
+            key = ('graph', node.key, tuple(sorted(sources[node.key].items())))
+            value = self.cache.get(key, self)
+            if value is self:
+                value = self.cache.set(key, node.compute(*inputs))
+            values[node.key] = value
+        return {name: values[node.key] for name, node in nodes.items()}
+
+
+def topological_order(nodes):
+    """ The distinct nodes `nodes` depend on (themselves included), each
+    one after its inputs """
+    order, seen = [], set()
+    for root in nodes:
+        stack = [(root, False)]
+        while stack:
+            node, expanded = stack.pop()
+            if expanded:
+                order.append(node)
+            elif node.key not in seen:
+                seen.add(node.key)
+                stack.append((node, True))
+                stack.extend((i, False) for i in reversed(node.inputs))
+    return order
+
+
+class GraphStrategy(VectorStrategy):
+    """ Strategy declaring its indicators as Nodes in declareIndicators
+    and computing its signal arrays from their values in computeSignals.
+    Values are shared with the other strategies of the process, unless
+    the strategy gets an `indicator_cache` or a `graph` of its own. """
+
+    graph = IndicatorGraph()
+    nodes = None
+
+    @abstractmethod
+    def declareIndicators(self):
+        """ Returns a dict of {name: Node} """
+        pass
+
+
+    @abstractmethod
+    def computeSignals(self, values, df):
+        """ Returns the (long, short) signal arrays, given the `values` of
+        the declared indicators on `df`, by name (read only arrays) """
+        pass
+
+
+    def setUp(self, df):
+        if self.nodes is None:
+            self.nodes = self.declareIndicators()
+        graph = self.graph if self.indicator_cache is None \
+            else IndicatorGraph(self.indicator_cache)
+        self.values = graph.evaluate(self.nodes, df)
+        self.long_signals, self.short_signals = self.computeSignals(self.values, df)
+        self.dataframe = df
+
+
+def _output(values, index):
+    return values[index]
@@ -0,0 +1,120 @@
+"""
+Vectorized indicators, computed on whole float64 arrays at once.
+
+Every function takes arrays (or Series) of prices and returns float64
+arrays of the same length, NaN where an indicator isn't defined yet. They
+follow the definitions of StreamingIndicators, so a strategy backtested
+on these gives the values a live bot updating those candle by candle
+gets: EMA is pandas' `ewm(span=period, adjust=False)`, RSI and ATR smooth
+Wilder's way and standard deviations are population ones. Recursive
+averages and rolling windows run through pandas' compiled routines, the
+rest is plain NumPy; nothing loops over candles in Python.
+"""
+
+import numpy as np
+import pandas as pd
+
+
+def sma(x, period):
+    """ Simple moving average over `period` candles """
+    return _series(x).rolling(period).mean().to_numpy()
+
+
+def ema(x, period):
+    """ Exponential moving average over `period` candles """
+    return _series(x).ewm(span=period, adjust=False).mean().to_numpy()
+
+
+def rma(x, period):
+    """ Wilder's moving average over `period` candles """
+    return _series(x).ewm(alpha=1 / period, adjust=False).mean().to_numpy()
+
+
+def rsi(close, period=14):
+    """ Relative strength index over `period` candles """
+    change = np.diff(_array(close))
+    gain = rma(np.maximum(change, 0.), period)
+    loss = rma(np.maximum(-change, 0.), period)
+    with np.errstate(divide='ignore', invalid='ignore'):
+        value = np.where(loss > 0, 100 - 100 / (1 + gain / loss),
+            np.where(gain > 0, 100., 50.))
+    return np.concatenate(([np.nan], value))
+
+
+def bollinger_bands(close, period=20, std=2.):
+    """ Lower, middle and upper Bollinger bands: the `period` candles
+    moving average and `std` standard deviations around it """
+    rolling = _series(close).rolling(period)
+    middle = rolling.mean().to_numpy()
+    deviation = rolling.std(ddof=0).to_numpy()
+    return middle - std * deviation, middle, middle + std * deviation
+
+
+def true_range(high, low, close):
+    """ True range of every candle, its high - low on the first one """
+    high, low, close = _array(high), _array(low), _array(close)
+    previous = np.concatenate(([np.nan], close[:-1]))
+    with np.errstate(invalid='ignore'):
+        return np.fmax(high - low, np.fmax(np.abs(high - previous),
+            np.abs(low - previous)))
+
+
+def atr(high, low, close, period=14):
+    """ Average true range over `period` candles """
+    return rma(true_range(high, low, close), period)
+
+
+def macd(close, fast=12, slow=26, signal=9):
+    """ MACD line, its signal line and their difference (histogram) """
+    line = ema(close, fast) - ema(close, slow)
+    signal_line = ema(line, signal)
+    return line, signal_line, line - signal_line
+
+
+def momentum(close, period=3):
+    """ Whether the close rose (first array) or fell (second array) on each
+    of the last `period` candles, False on the first `period` ones """
+    change = np.diff(_array(close))
+    rising = _count_last(change > 0, period) == period
+    falling = _count_last(change < 0, period) == period
+    pad = np.zeros(1, dtype=bool)
+    return np.concatenate((pad, rising)), np.concatenate((pad, falling))
+
+
+def crossover(a, b):
+    """ Whether `a` crossed above `b` on each candle """
+    a, b = _array(a), _array(b)
+    above = a > b
+    crossed = np.zeros(len(above), dtype=bool)
+    crossed[1:] = above[1:] & (a[:-1] <= b[:-1])
+    return crossed
+
+
+def crossunder(a, b):
+    """ Whether `a` crossed below `b` on each candle """
+    return crossover(b, a)
+
+
+def shift(x, n=1, fill=np.nan):
+    """ `x` delayed by `n` candles, the first `n` holding `fill` """
+    x = np.asarray(x)
+    shifted = np.full(x.shape, fill, dtype=np.result_type(x, np.asarray(fill)))
+    if n < len(x):
+        shifted[n:] = x[:len(x) - n]
+    return shifted
+
+
+def _count_last(flags, period):
+    """ Number of True values among the last `period` ones """
+    counts = np.cumsum(flags, dtype=np.int64)
+    counts[period:] = counts[period:] - counts[:-period]
+    counts[:period - 1] = -1
+    return counts
+
+
+def _array(x):
+    return np.asarray(x, dtype=np.float64)
+
+
+def _series(x):
+    return pd.Series(_array(x))
@@ -0,0 +1,18 @@
+from pyjuque.Strategies import VectorStrategy
+from pyjuque.Strategies.Indicators import momentum
+
+
+class MomentumStrategy(VectorStrategy):
+    """ Buys after `momentum_period` rising candles in a row, sells after
+    as many falling ones """
+    minimum_period = 100
+    def __init__(self, momentum_period=3):
+        if momentum_period < 1:
+            raise ValueError("momentum_period should be greater than 1.")
+        self.momentum_period = momentum_period
+        self.minimum_period = max(100, momentum_period)
+
+    def setUp(self, df):
+        self.long_signals, self.short_signals = momentum(df['close'], 
+            self.momentum_period)
+        self.dataframe = df
@@ -0,0 +1,239 @@
+"""
+Indicators updated one candle at a time, for live trading.
+
+A bot sees one new closed candle per tick, so instead of recomputing its
+indicators over the whole lookback every time, these keep running state
+(sums, smoothed averages) that `update` advances in O(1) per candle.
+`peek` gives the value the indicator would take on a candle without
+committing it, for the candle still forming.
+
+Candles are mappings holding (at least) the columns an indicator reads,
+like {'high': .., 'low': .., 'close': ..}; indicators of a single series
+also take plain numbers. Values are None until an indicator has seen a
+candle; `ready` tells when it has seen enough of them to be meaningful.
+
+Averages follow pandas' recursive (adjust=False) definitions: EMA is
+`ewm(span=period)`, while RSI and ATR smooth Wilder's way, with
+`ewm(alpha=1 / period)`. Standard deviations are population ones.
+"""
+
+import math
+import numbers
+from abc import ABC, abstractmethod
+from collections import deque
+
+
+class StreamingIndicator(ABC):
+    """ Base class of the streaming indicators """
+
+    # candles needed before the value is meaningful
+    period = 1
+    n_updates = 0
+    value = None
+
+    @property
+    def ready(self):
+        return self.n_updates >= self.period
+
+    @abstractmethod
+    def update(self, candle):
+        """ Advances the indicator by the closed `candle`, returns its value """
+        pass
+
+    @abstractmethod
+    def peek(self, candle):
+        """ Value the indicator would take on `candle`, leaving it as is """
+        pass
+
+
+class EMA(StreamingIndicator):
+    """ Exponential moving average of `source` over `period` candles """
+
+    def __init__(self, period, source='close'):
+        self.period = period
+        self.source = source
+        self.alpha = 2 / (period + 1)
+
+    def _next(self, x):
+        return x if self.value is None else self.value + self.alpha * (x - self.value)
+
+    def update(self, candle):
+        self.value = self._next(_price(candle, self.source))
+        self.n_updates += 1
+        return self.value
+
+    def peek(self, candle):
+        return self._next(_price(candle, self.source))
+
+
+class SMA(StreamingIndicator):
+    """ Simple moving average of `source` over the last `period` candles """
+
+    def __init__(self, period, source='close'):
+        self.period = period
+        self.source = source
+        self.window = _Window(period)
+
+    def update(self, candle):
+        self.window.push(_price(candle, self.source))
+        self.n_updates += 1
+        self.value = self.window.mean()
+        return self.value
+
+    def peek(self, candle):
+        total, _, n = self.window.next_sums(_price(candle, self.source))
+        return total / n
+
+
+class RSI(StreamingIndicator):
+    """ Relative strength index of `source` over `period` candles """
+
+    def __init__(self, period=14, source='close'):
+        self.period = period + 1
+        self.source = source
+        self.alpha = 1 / period
+        self.last = None
+        self.gain = None
+        self.loss = None
+
+    def _next(self, x):
+        if self.last is None:
+            return None, None, None
+        change = x - self.last
+        gain, loss = max(change, 0.), max(-change, 0.)
+        if self.gain is not None:
+            gain = self.gain + self.alpha * (gain - self.gain)
+            loss = self.loss + self.alpha * (loss - self.loss)
+        if loss == 0:
+            return gain, loss, 100. if gain > 0 else 50.
+        return gain, loss, 100 - 100 / (1 + gain / loss)
+
+    def update(self, candle):
+        x = _price(candle, self.source)
+        self.gain, self.loss, self.value = self._next(x)
+        self.last = x
+        self.n_updates += 1
+        return self.value
+
+    def peek(self, candle):
+        return self._next(_price(candle, self.source))[2]
+
+
+class BollingerBands(StreamingIndicator):
+    """ Bollinger bands of `source`: its `period` candles moving average
+    and `std` standard deviations around it. Values are (lower, middle,
+    upper) tuples. """
+
+    def __init__(self, period=20, std=2., source='close'):
+        self.period = period
+        self.std = std
+        self.source = source
+        self.window = _Window(period)
+
+    def _bands(self, total, squares, n):
+        mean = total / n
+        deviation = math.sqrt(max(squares / n - mean * mean, 0.))
+        return mean - self.std * deviation, mean, mean + self.std * deviation
+
+    def update(self, candle):
+        self.window.push(_price(candle, self.source))
+        self.n_updates += 1
+        self.value = self._bands(self.window.total, self.window.squares,
+            len(self.window.values))
+        return self.value
+
+    def peek(self, candle):
+        return self._bands(*self.window.next_sums(_price(candle, self.source)))
+
+
+class ATR(StreamingIndicator):
+    """ Average true range over `period` candles """
+
+    def __init__(self, period=14):
+        self.period = period
+        self.alpha = 1 / period
+        self.last_close = None
+
+    def _next(self, candle):
+        high, low = float(candle['high']), float(candle['low'])
+        true_range = high - low
+        if self.last_close is not None:
+            true_range = max(true_range, abs(high - self.last_close),
+                abs(low - self.last_close))
+        if self.value is None:
+            return true_range
+        return self.value + self.alpha * (true_range - self.value)
+
+    def update(self, candle):
+        self.value = self._next(candle)
+        self.last_close = float(candle['close'])
+        self.n_updates += 1
+        return self.value
+
+    def peek(self, candle):
+        return self._next(candle)
+
+
+class MACD(StreamingIndicator):
+    """ Moving average convergence divergence of `source`. Values are
+    (macd, signal, histogram) tuples. """
+
+    def __init__(self, fast=12, slow=26, signal=9, source='close'):
+        self.period = slow + signal - 1
+        self.source = source
+        self.fast = EMA(fast)
+        self.slow = EMA(slow)
+        self.signal = EMA(signal)
+
+    def update(self, candle):
+        x = _price(candle, self.source)
+        macd = self.fast.update(x) - self.slow.update(x)
+        signal = self.signal.update(macd)
+        self.n_updates += 1
+        self.value = macd, signal, macd - signal
+        return self.value
+
+    def peek(self, candle):
+        x = _price(candle, self.source)
+        macd = self.fast.peek(x) - self.slow.peek(x)
+        signal = self.signal.peek(macd)
+        return macd, signal, macd - signal
+
+
+class _Window():
+    """ The last `size` values of a series, with their running sum and sum
+    of squares. Sums get recomputed once per `size` values pushed, which
+    keeps them from drifting at an O(1) amortized cost. """
+
+    def __init__(self, size):
+        self.size = size
+        self.values = deque(maxlen=size)
+        self.total = 0.
+        self.squares = 0.
+        self.n_pushed = 0
+
+    def next_sums(self, x):
+        """ Sums (and count) of the window once `x` gets pushed """
+        total, squares = self.total + x, self.squares + x * x
+        if len(self.values) == self.size:
+            oldest = self.values[0]
+            total -= oldest
+            squares -= oldest * oldest
+        return total, squares, min(len(self.values) + 1, self.size)
+
+    def push(self, x):
+        self.total, self.squares, _ = self.next_sums(x)
+        self.values.append(x)
+        self.n_pushed += 1
+        if self.n_pushed % self.size == 0:
+            self.total = math.fsum(self.values)
+            self.squares = math.fsum(v * v for v in self.values)
+
+    def mean(self):
+        return self.total / len(self.values)
+
+
+def _price(candle, source):
+    if isinstance(candle, numbers.Number):
+        return float(candle)
+    return float(candle[source])
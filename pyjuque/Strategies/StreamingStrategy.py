@@ -0,0 +1,138 @@
+"""
+Strategy computing its signals from streaming indicators.
+
+The bot sets its strategy up on the last `minimum_period` candles every
+tick. A StreamingStrategy remembers the last candle it has seen and only
+feeds its indicators (see StreamingIndicators) the ones after it, so a
+tick costs the same whatever the lookback. The last candle of every frame
+is the one still forming: it's evaluated with the indicators' `peek`, and
+only committed once a later frame holds a candle after it. The candles of
+every symbol get their own indicators.
+"""
+
+import numpy as np
+from abc import abstractmethod
+from collections import deque
+from pyjuque.Strategies import StrategyTemplate
+
+CANDLE_COLUMNS = ('time', 'open', 'high', 'low', 'close', 'volume')
+
+
+class StreamingStrategy(StrategyTemplate):
+    """ Subclasses return their streaming indicators from createIndicators
+    and compute the signals of a candle in computeSignals. """
+
+    streams = None
+    stream = None
+
+    @abstractmethod
+    def createIndicators(self):
+        """ Returns a dict of {name: StreamingIndicator} """
+        pass
+
+
+    @abstractmethod
+    def computeSignals(self, current, previous):
+        """ Returns the (long, short) signals of a candle. `current` holds
+        its columns (open, close..) and the values of the indicators on it,
+        by name; `previous` the same for the candle before (None on the
+        first candle). """
+        pass
+
+
+    def resetIndicators(self, history=None):
+        """ Starts the indicators over on every series, keeping the signals
+        of the last `history` candles (minimum_period by default) """
+        self.streams = []
+        self.stream = _Stream(self.createIndicators(),
+            max(self.minimum_period, history or 0))
+        self.current = None
+
+
+    def setUp(self, df):
+        """ Feeds the indicators the candles of `df` they haven't seen.
+        A bot sets the same strategy up on the candles of every symbol it
+        trades, so each series keeps its own indicators, found back by the
+        last candle they committed. A frame holding none of those starts
+        new ones, as does one beginning after it (there could be a gap). """
+        if self.streams is None:
+            self.resetIndicators(len(df))
+        self.dataframe = df
+        if len(df) == 0:
+            self.stream = _Stream(self.createIndicators(), self.minimum_period)
+            return
+        time = df['time'].to_numpy()
+        columns = {column: df[column].to_numpy(dtype=np.float64)
+            for column in CANDLE_COLUMNS if column in df.columns}
+        # streams behind the frame can't go on, on any series of its timeframe
+        self.streams = [stream for stream in self.streams
+            if stream.last_time is not None and stream.last_time >= time[0]]
+        self.stream = next((stream for stream in self.streams
+            if stream.continues(time, columns)), None)
+        if self.stream is None:
+            self.stream = _Stream(self.createIndicators(),
+                max(self.minimum_period, len(df)))
+            self.streams.append(self.stream)
+        stream = self.stream
+        start = 0 if stream.last_time is None \
+            else int(np.searchsorted(time, stream.last_time, side='right'))
+        for i in range(start, len(df) - 1):
+            current = {column: values[i] for column, values in columns.items()}
+            candle = tuple(current.values())
+            current.update({name: indicator.update(current)
+                for name, indicator in stream.indicators.items()})
+            stream.history.append(self._signals(current, stream.previous))
+            stream.previous = current
+            stream.last_time = time[i]
+            stream.last_candle = candle
+        current = {column: values[-1] for column, values in columns.items()}
+        current.update({name: indicator.peek(current)
+            for name, indicator in stream.indicators.items()})
+        self.current = current
+        self.signals = self._signals(current, stream.previous)
+        self.n_candles = len(df)
+
+
+    def checkLongSignal(self, i=None):
+        return self._signal_at(i)[0]
+
+
+    def checkShortSignal(self, i=None):
+        return self._signal_at(i)[1]
+
+
+    def _signals(self, current, previous):
+        long_signal, short_signal = self.computeSignals(current, previous)
+        return bool(long_signal), bool(short_signal)
+
+
+    def _signal_at(self, i=None):
+        """ Signals of the `i`th candle of the frame set up on (the last one
+        by default), False for the ones older than the history kept """
+        back = 0 if i is None else self.n_candles - 1 - i
+        if back == 0:
+            return self.signals
+        if back <= len(self.stream.history):
+            return self.stream.history[-back]
+        return False, False
+
+
+class _Stream():
+    """ Indicators fed one series of candles, up to the last one committed,
+    with the signals of the last candles """
+
+    def __init__(self, indicators, history):
+        self.indicators = indicators
+        self.last_time = None
+        self.last_candle = None
+        self.previous = None
+        self.history = deque(maxlen=history)
+
+    def continues(self, time, columns):
+        """ Whether the candles (`time` and other `columns`) hold the last
+        candle committed, as it was """
+        if self.last_time is None:
+            return False
+        i = int(np.searchsorted(time, self.last_time))
+        return i < len(time) and time[i] == self.last_time \
+            and tuple(values[i] for values in columns.values()) == self.last_candle
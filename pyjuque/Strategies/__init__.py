@@ -1,10 +1,15 @@
 from abc import ABC, abstractmethod
+import numpy as np
+from pyjuque.Strategies.IndicatorCache import IndicatorCache, default_cache, \
+    function_key
 
 class StrategyTemplate(ABC):
 
     minimum_period = 100
     indicators = []
     df = None
+    # set to an IndicatorCache (eg. default_cache) to memoize computeIndicator
+    indicator_cache = None
 
     @abstractmethod
     def setUp(self, df):
@@ -24,3 +29,76 @@ class StrategyTemplate(ABC):
     def checkShortSignal(self, i):
         """ Checks whether we have a short signal """
         pass
+
+
+    def computeIndicator(self, name, function, data, **params):
+        """ Returns `function(data, **params)`, looking it up in the 
+        indicator cache first if the strategy uses one, under `name` and
+        the qualified name of `function`. Pass a tuple as `data` for
+        indicators computed on several series. Lambdas and local functions
+        aren't cached: their name doesn't say what they compute. """
+        key = function_key(function)
+        if self.indicator_cache is None or key is None:
+            args = data if isinstance(data, tuple) else (data,)
+            return function(*args, **params)
+        return self.indicator_cache.compute((name, key), function, data, **params)
+
+
+class VectorStrategy(StrategyTemplate):
+    """ Strategy computing all its signals at once.
+
+    setUp sets `long_signals` and `short_signals`: arrays holding the
+    signal of every candle of the dataframe (or one row of them per
+    parameter set), which backtesters and bots read directly instead of
+    calling checkLongSignal and checkShortSignal on every candle. """
+
+    long_signals = None
+    short_signals = None
+
+    def checkLongSignal(self, i=None):
+        return _signal_at(self.long_signals, i)
+
+
+    def checkShortSignal(self, i=None):
+        return _signal_at(self.short_signals, i)
+
+
+def strategy_signals(strategy, n_candles):
+    """ The long and short signals of `strategy`, set up on `n_candles`
+    candles, as two arrays (see signal_array) """
+    return (signal_array(strategy, n_candles), 
+        signal_array(strategy, n_candles, short=True))
+
+
+def signal_array(strategy, n_candles, short=False):
+    """ The long signals of `strategy`, set up on `n_candles` candles, or
+    its short ones if `short`, as an array. Strategies that don't hold
+    `long_signals` / `short_signals` get checkLongSignal / checkShortSignal
+    called once per candle. """
+    signals = getattr(strategy, 'short_signals' if short else 'long_signals', None)
+    if signals is not None:
+        return np.asarray(signals)
+    check = strategy.checkShortSignal if short else strategy.checkLongSignal
+    return np.array([_as_signal(check(i)) for i in range(n_candles)], dtype=bool)
+
+
+def latest_signal(strategy, n_candles, short=False):
+    """ Signal of `strategy`, set up on `n_candles` candles, on the last 
+    one of them: its long signal, or its short one if `short` """
+    signals = getattr(strategy, 'short_signals' if short else 'long_signals', None)
+    if signals is not None:
+        return _signal_at(signals, n_candles - 1)
+    check = strategy.checkShortSignal if short else strategy.checkLongSignal
+    return _as_signal(check(n_candles - 1))
+
+
+def _signal_at(signals, i=None):
+    signals = np.asarray(signals)
+    return bool(signals[..., -1 if i is None else i])
+
+
+def _as_signal(value):
+    # some strategies return (signal, extra) tuples
+    if isinstance(value, tuple):
+        value = value[0] if len(value) > 0 else False
+    return bool(value)
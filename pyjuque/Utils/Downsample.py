@@ -0,0 +1,80 @@
+"""
+Downsampling of large charts, keeping what they look like.
+
+A chart can't show more points than it has pixels, so long backtests get
+reduced to about as many points as the plot is wide before being sent to
+plotly:
+    - candles are aggregated into bigger ones (first open, highest high,
+      lowest low, last close, summed volume), which draws the same range
+    - lines keep the points Largest-Triangle-Three-Buckets picks, the ones
+      that shape the line the most (peaks, drops) out of every bucket
+Markers are never downsampled.
+"""
+
+import numpy as np
+import pandas as pd
+
+
+def bucket_starts(n_points, n_buckets):
+    """ Index of the first point of every one of `n_buckets` equal buckets """
+    return np.unique(np.linspace(0, n_points, n_buckets, endpoint=False)
+        .astype(np.int64))
+
+
+def downsample_ohlc(df, n_candles):
+    """ Aggregates the candles of `df` into at most `n_candles` candles.
+    `df` is returned as is if it's not longer than that. """
+    if n_candles is None or len(df) <= n_candles:
+        return df
+    starts = bucket_starts(len(df), n_candles)
+    ends = np.append(starts[1:], len(df)) - 1
+    columns = {}
+    for column in df.columns:
+        values = df[column].to_numpy()
+        if column == 'high':
+            columns[column] = np.maximum.reduceat(values, starts)
+        elif column == 'low':
+            columns[column] = np.minimum.reduceat(values, starts)
+        elif column == 'volume':
+            columns[column] = np.add.reduceat(values, starts)
+        elif column == 'close':
+            columns[column] = values[ends]
+        else:
+            # time, open and anything else: the first candle's
+            columns[column] = values[starts]
+    return pd.DataFrame(columns)
+
+
+def lttb(x, y, n_points):
+    """ Indices of the `n_points` points of the (x, y) line that
+    Largest-Triangle-Three-Buckets keeps: the first, the last and in every
+    bucket between them the one making the largest triangle with the point
+    kept before it and the average of the next bucket. All indices if the
+    line is not longer than `n_points`. NaN points are only kept from
+    buckets holding nothing else. """
+    x = np.asarray(x, dtype=np.float64)
+    y = np.asarray(y, dtype=np.float64)
+    n = len(y)
+    if n_points is None or n <= n_points or n_points < 3:
+        return np.arange(n)
+    edges = np.linspace(1, n - 1, n_points - 1).astype(np.int64)
+    # average of every bucket, over its non NaN points
+    finite = np.isfinite(y)
+    counts = np.add.reduceat(finite, edges[:-1])
+    with np.errstate(invalid='ignore', divide='ignore'):
+        avg_x = np.add.reduceat(np.where(finite, x, 0), edges[:-1]) / counts
+        avg_y = np.add.reduceat(np.where(finite, y, 0), edges[:-1]) / counts
+    kept = np.empty(n_points, dtype=np.int64)
+    kept[0], kept[-1] = 0, n - 1
+    a = 0
+    for b in range(n_points - 2):
+        lo, hi = edges[b], edges[b + 1]
+        if b + 1 < n_points - 2:
+            next_x, next_y = avg_x[b + 1], avg_y[b + 1]
+        else:
+            next_x, next_y = x[-1], y[-1]
+        area = np.abs((x[a] - next_x) * (y[lo:hi] - y[a])
+            - (x[a] - x[lo:hi]) * (next_y - y[a]))
+        a = lo + int(np.argmax(np.nan_to_num(area, nan=-1.)))
+        kept[b + 1] = a
+    return kept
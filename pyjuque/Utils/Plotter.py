@@ -1,12 +1,12 @@
 import os
+import numpy as np
 import plotly.graph_objs as go
+from pyjuque.Utils.Downsample import downsample_ohlc, lttb
 from plotly.offline import plot
 import random
 from pandas.core.series import Series
 from pandas.core.frame import DataFrame
 from pandas import to_datetime, Timestamp
-from datetime import datetime
-import pytz
 """
     This file contains all the tools used for plotting data.
 
@@ -31,36 +31,59 @@ def GetPlotData(df,
     trend_points=False,
     use_scattergl=False,
     convert_to_date=False,
-    trends=False):
-    """ Generates the plotly traces to be plotted. """
+    trends=False,
+    plot_width=2000):
+    """ Generates the plotly traces to be plotted. 
+    
+    Charts longer than `plot_width` (pixels) get downsampled to about as 
+    many candles and twice as many points per line (see Downsample); 
+    markers are kept as they are. None disables downsampling. 
+    
+    With `convert_to_date` dates are categories: markers and line points
+    are drawn on the date of the (aggregated) candle they fall in, as any
+    other date would be off the axis. """
     scatter_type = go.Scatter
     if use_scattergl:
         scatter_type = go.Scattergl
     data = []
-    time_format = "%Y-%m-%d %H:%M"
-    utc_date = df['time']
-    def ts_to_s(x):
-        return datetime.fromtimestamp(x, tz=pytz.UTC).strftime(time_format)
-    if convert_to_date:
-        if 'date' in df.columns:
-            utc_date = df['date']
-        else:
-            utc_date = list(map(ts_to_s, df.time))
+    def dates(frame):
+        if not convert_to_date:
+            return frame['time']
+        if 'date' in frame.columns:
+            return frame['date']
+        return timestamps_to_dates(frame['time'])
+    ohlc = downsample_ohlc(df, plot_width)
+    candle_date = dates(ohlc)
+    def to_dates(times):
+        """ the dates categories of points at `times` """
+        if 'time' not in ohlc.columns:
+            return timestamps_to_dates(times)
+        candle = np.searchsorted(ohlc['time'].to_numpy(), times, side='right') - 1
+        return np.asarray(candle_date)[np.maximum(candle, 0)]
+    utc_date = to_dates(df['time'].to_numpy()) \
+        if convert_to_date and 'time' in df.columns else dates(df)
+    line_points = None if plot_width is None else 2 * plot_width
+    def line(x, y):
+        """ the points of a line left after downsampling """
+        x, y = np.asarray(x), np.asarray(y)
+        kept = lttb(np.arange(len(y)), y, line_points)
+        return x[kept], y[kept]
     if add_candles and not ignore_price:
         candle = go.Candlestick(
-            x = utc_date,
-            open = df['open'],
-            close = df['close'],
-            high = df['high'],
-            low = df['low'],
+            x = candle_date,
+            open = ohlc['open'],
+            close = ohlc['close'],
+            high = ohlc['high'],
+            low = ohlc['low'],
             increasing_line_color = 'lightseagreen', 
             decreasing_line_color = 'lightcoral',
             name = "Candlesticks")
         data.append(candle)
     elif not ignore_price:
+        price_x, price_y = line(utc_date, df['close'].values)
         price = scatter_type( 
-            x = utc_date,
-            y = list(df['close'].values), 
+            x = price_x,
+            y = price_y, 
             name = 'Price',
             line = dict(color = 'black'))
         data.append(price)
@@ -68,8 +91,8 @@ def GetPlotData(df,
         pass
     if add_volume:
         volume = go.Bar(
-            x = utc_date,	
-            y = df['volume'], 
+            x = candle_date,	
+            y = ohlc['volume'], 
             xaxis="x", 
             yaxis="y2", 
             # width = 400000,
@@ -102,28 +125,14 @@ def GetPlotData(df,
             if ind.get('custom_x', None) is None:
                 ind['custom_x'] = False
 
-            x_source = []
-            y_source = []
-            # print('custom_source')
-            # print(ind['title'])
-            # print(custom_source)
             if custom_source:
-                for entry in custom_source:
-                    if not ind['custom_x'] and convert_to_date:
-                        dt = datetime.fromtimestamp(entry[0], tz=pytz.UTC)
-                        x_source.append(dt.strftime(time_format))
-                    else:
-                        x_source.append(entry[0])
-                    y_source.append(entry[1])
+                x_source, y_source = source_columns(custom_source)[:2]
             else:
-                if not ind['custom_x'] and convert_to_date:
-                    # to_datetime(df[ind['xvalue']] * 1_000_000, utc=True, format=(time_format))
-                    # dt = datetime.fromtimestamp(df[ind['xvalue']], tz=pytz.UTC)
-                    # x_source.append(dt.strftime(time_format))
-                    x_source = list(map(ts_to_s, df[ind['xvalue']]))
-                else:
-                    x_source = df[ind['xvalue']]
+                x_source = df[ind['xvalue']]
                 y_source = df[ind['name']]
+            x_source, y_source = line(x_source, y_source)
+            if not ind['custom_x'] and convert_to_date:
+                x_source = to_dates(x_source)
             if ind['type'] == 'bar':
                 trace = go.Bar(
                     x = x_source, 
@@ -165,26 +174,21 @@ def GetPlotData(df,
         data.append(maxs)
     if signals:
         for signal in signals:
-            size_multiplier = [15 for z in signal["points"]]
-            if len(signal["points"]) > 1:
-                if len(signal["points"][0]) > 2:
-                    size_multiplier = [z[2] for z in signal["points"]]
+            points = source_columns(signal['points'])
+            size_multiplier = points[2] if len(points) > 2 \
+                else np.full(len(points[0]), 15)
             marker_symbol = 'circle'
             if signal.get('marker_symbol', None) is not None:
                 marker_symbol = signal['marker_symbol']
             marker_color = 'blue'
             if signal.get('marker_color', None) is not None:
                 marker_color = signal['marker_color']
-            xs = []
+            xs = points[0]
             if convert_to_date:
-                for entry in signal['points']:
-                    dt = datetime.fromtimestamp(entry[0], tz=pytz.UTC)
-                    xs.append(dt.strftime(time_format))
-            else:
-                xs = [item[0] for item in signal['points']]
+                xs = to_dates(xs)
             scat = scatter_type(
                 x = xs,
-                y = [item[1] for item in signal['points']],
+                y = points[1],
                 name = signal['name'],
                 mode = "markers",
                 marker_size = size_multiplier,
@@ -214,6 +218,7 @@ def PlotData(df,
     use_scattergl=False,
     convert_to_date=False,
     use_figure_widget=False,
+    plot_width=2000,
     plot_title:str="Unnamed"):
     '''
     Creates a plotly plot based on the options provided - which can be displayed
@@ -227,6 +232,9 @@ def PlotData(df,
         sell signals: bool or list
             if list, it adds to the plot some points representing sell signals
 
+        plot_width: int or None
+            width of the plot in pixels, longer charts get downsampled to it
+
     '''
     data = GetPlotData(
         df,
@@ -241,7 +249,8 @@ def PlotData(df,
         plot_indicators=plot_indicators,
         use_scattergl=use_scattergl,
         convert_to_date=convert_to_date,
-        trends=trends)
+        trends=trends,
+        plot_width=plot_width)
     xaxis_type = 'date'
     if convert_to_date:
         xaxis_type = 'category'
@@ -409,6 +418,25 @@ def PlotData(df,
 ###                 HELPER FUNCTIONS
 ########################################################
 
+def timestamps_to_dates(timestamps):
+    """ Formats unix timestamps (in seconds) as "%Y-%m-%d %H:%M" UTC dates,
+    all at once """
+    seconds = np.floor(np.asarray(timestamps, dtype=np.float64)).astype(np.int64)
+    dates = np.datetime_as_string(seconds.astype('datetime64[s]'), unit='m')
+    return np.char.replace(dates, 'T', ' ')
+
+
+def source_columns(source):
+    """ Columns (x, y and maybe marker sizes) of a trace `source`: either a
+    tuple of arrays or a list of (x, y[, size]) points """
+    if isinstance(source, tuple):
+        return tuple(np.asarray(column) for column in source)
+    if len(source) == 0:
+        return np.array([]), np.array([])
+    return tuple(np.asarray([point[i] for point in source]) 
+        for i in range(len(source[0])))
+
+
 def add_tt_split(df, fig, train_test_split=0.5):
     """ Makes one section of the bg of the figure blue 
     (train) and another part red (test) """
@@ -0,0 +1,1253 @@
+import os
+import sys
+curr_path = os.path.abspath(__file__)
+root_path = os.path.abspath(
+    os.path.join(curr_path, os.path.pardir, os.path.pardir))
+sys.path.insert(1, root_path)
+
+from pyjuque.Backtester import Backtester, sweep, walk_forward, \
+    PortfolioBacktester
+from pyjuque.Backtester.Portfolio import run_portfolio, EXIT_SIGNAL
+from pyjuque.Backtester.Stream import read_ohlcv_chunks
+from pyjuque.Backtester.Fills import OrderBookFill, book_average_price
+from pyjuque.Backtester.Intrabar import LowerTimeframe
+from pyjuque.Backtester.MonteCarlo import resample_trades
+from pyjuque.Backtester.Kernels import pnl_curve, signals_to_position, \
+    apply_exits, batch_pnl_curve, drawdown_stats, trade_ledger, scale_in, \
+    EXIT_TAKE_PROFIT, EXIT_STOP_LOSS, EXIT_TRAILING_STOP
+from pyjuque.Engine.Backtester import backtest as engine_backtest, dotdict
+from pyjuque.Engine.BacktesterSundayTheQuant import Backtester as SundayBacktester
+from pyjuque.Strategies import StrategyTemplate
+from pyjuque.Utils.Plotter import timestamps_to_dates
+from datetime import datetime, timezone
+from decimal import Decimal
+import unittest
+import numpy as np
+import pandas
+
+
+def legacy_pnl_curve(position, close, fee_cost):
+    """ The section by section pnl computation that Backtester.backtest
+    used before the single pass kernel. """
+    idx_trades = np.where(np.diff(position) != 0)[0] + 1
+    l_d, l_t = len(position), len(idx_trades)
+    if l_t == 0:
+        return np.zeros(l_d)
+    pnl_curve = np.zeros(idx_trades[0])
+    prev_pnl = 0.
+    for i in range(l_t):
+        idx_st = idx_trades[i]
+        idx_end = l_d if i == l_t - 1 else idx_trades[i+1]
+        if position[idx_st] == 1:
+            section_pnl = (close[idx_st:idx_end+1] / close[idx_st]) - 1 - fee_cost
+            section_pnl[-1] = section_pnl[-1] - fee_cost
+        elif position[idx_st] == -1:
+            section_pnl = (close[idx_st] / close[idx_st:idx_end+1]) - 1 - fee_cost
+            section_pnl[-1] = section_pnl[-1] - fee_cost
+        else:
+            section_pnl = [0] * (idx_end - idx_st - 1)
+        section_pnl = prev_pnl + section_pnl
+        pnl_curve = np.concatenate((pnl_curve, section_pnl))
+        prev_pnl = pnl_curve[-1]
+    return pnl_curve
+
+
+def random_position(rng, size, sides):
+    """ Random forward filled position array holding only `sides`. """
+    signals = rng.choice([0, 0, 0, 0, 0, 0] + list(sides), size=size)
+    idx = np.where(signals != 0, np.arange(size), 0)
+    np.maximum.accumulate(idx, out=idx)
+    position = signals[idx]
+    position[0] = 0
+    return position
+
+
+class CrossStrategy(StrategyTemplate):
+    """ Goes long when close crosses above its moving average """
+    def __init__(self, period=20):
+        self.period = period
+
+    def setUp(self, df):
+        close = df['close']
+        ma = close.rolling(self.period).mean()
+        above = (close > ma).astype(int)
+        self.long_signals = np.asarray((above.diff() == 1).astype(int))
+        self.short_signals = np.asarray((above.diff() == -1).astype(int))
+        self.dataframe = df
+
+    def checkLongSignal(self, i):
+        return self.long_signals[i]
+
+    def checkShortSignal(self, i):
+        return self.short_signals[i]
+
+
+class CandleStrategy(StrategyTemplate):
+    """ Goes long after green candles, short after red ones """
+    minimum_period = 0
+
+    def setUp(self, df):
+        change = np.asarray(df['close'] - df['open'])
+        self.long_signals = (change > 0).astype(int)
+        self.short_signals = (change < 0).astype(int)
+        self.dataframe = df
+
+    def checkLongSignal(self, i):
+        return self.long_signals[i]
+
+    def checkShortSignal(self, i):
+        return self.short_signals[i]
+
+
+class BandStrategy(StrategyTemplate):
+    """ Mean reversion around a moving average, one row of signals 
+    per band width if given several """
+    def __init__(self, period=20, bands=0.001):
+        self.period = period
+        self.bands = bands
+        if np.ndim(bands) > 0:
+            self.param_sets = [dict(period=period, band=b) for b in bands]
+
+    def setUp(self, df):
+        close = df['close'].values
+        ma = df['close'].rolling(self.period).mean().values
+        dist = (close - ma) / ma
+        bands = np.asarray(self.bands)
+        if bands.ndim > 0:
+            bands = bands[:, None]
+        self.long_signals = (dist < -bands).astype(int)
+        self.short_signals = (dist > bands).astype(int)
+        self.dataframe = df
+
+    def checkLongSignal(self, i):
+        return self.long_signals[:, i]
+
+    def checkShortSignal(self, i):
+        return self.short_signals[:, i]
+
+
+class TickExchange():
+    """ Rounds prices to a 0.01 tick like Binance.toValidPrice """
+    def __init__(self):
+        self.calls = 0
+
+    def toValidPrice(self, symbol, desired_price, round_up=False):
+        self.calls += 1
+        number = round(Decimal(desired_price), 2)
+        if round_up:
+            number = number + Decimal('0.01')
+        return number
+
+
+class DipStrategy():
+    """ Buys when close is below its moving average """
+    def __init__(self, period):
+        self.period = period
+
+    def setUp(self, df):
+        ma = df['close'].rolling(self.period).mean()
+        self.long_signals = (df['close'] < ma * 0.999).values
+
+    def checkLongSignal(self, i):
+        return self.long_signals[i]
+
+
+class TestPnLCurve(unittest.TestCase):
+
+    def setUp(self):
+        self.rng = np.random.default_rng(42)
+
+    def test_matches_legacy_one_sided(self):
+        """ new pnl curve is identical to the old one on long or short only positions """
+        for sides in ([1], [-1], [1, -1]):
+            for _ in range(50):
+                size = int(self.rng.integers(2, 500))
+                position = random_position(self.rng, size, sides)
+                if len(sides) > 1:
+                    # exit to flat before every flip, like go_long / go_short only
+                    flips = np.flatnonzero(position[1:] * position[:-1] < 0) + 1
+                    position[flips] = 0
+                close = self.rng.uniform(50, 150, size)
+                old = legacy_pnl_curve(position, close, 0.001)
+                new = pnl_curve(position, close, 0.001)['pnl']
+                self.assertEqual(len(new), size)
+                np.testing.assert_allclose(new, old, rtol=0, atol=1e-12)
+
+    def test_matches_legacy_with_flips(self):
+        """ on direct long <-> short flips the old curve held an extra sample
+        per flip, otherwise both curves are identical """
+        for _ in range(50):
+            size = int(self.rng.integers(2, 500))
+            position = random_position(self.rng, size, [1, -1])
+            close = self.rng.uniform(50, 150, size)
+            old = legacy_pnl_curve(position, close, 0.001)
+            new = pnl_curve(position, close, 0.001)['pnl']
+            idx_trades = np.where(np.diff(position) != 0)[0] + 1
+            flips = idx_trades[(position[idx_trades] != 0)
+                & (position[idx_trades - 1] != 0)]
+            # drop the exit sample the old curve inserted before each flip
+            old = np.delete(old, flips + np.arange(len(flips)))
+            self.assertEqual(len(new), size)
+            np.testing.assert_allclose(new, old, rtol=0, atol=1e-12)
+
+    def test_trades(self):
+        """ returns one entry per non-flat section """
+        position = np.array([0, 1, 1, 0, 0, -1, -1, 1, 1])
+        close = np.array([1., 1., 2., 4., 4., 4., 2., 2., 3.])
+        curve = pnl_curve(position, close)
+        np.testing.assert_array_equal(curve['trade_exits'], [3, 7, 8])
+        np.testing.assert_allclose(curve['trade_pnls'], [3., 1., 0.5])
+        np.testing.assert_allclose(curve['pnl'][-1], 4.5)
+
+
+class TestBatchPnLCurve(unittest.TestCase):
+
+    def setUp(self):
+        self.rng = np.random.default_rng(11)
+        self.size = 400
+        self.position = np.stack([random_position(self.rng, self.size, [1, -1]) 
+            for _ in range(8)])
+        self.close = self.rng.uniform(50, 150, self.size)
+
+    def test_matches_pnl_curve(self):
+        """ every row matches the single curve kernel """
+        exit_price = np.where(self.rng.random(self.position.shape) < 0.1,
+            self.rng.uniform(50, 150, self.position.shape), np.nan)
+        curve = batch_pnl_curve(self.position, self.close, 0.001, exit_price)
+        for i, position in enumerate(self.position):
+            single = pnl_curve(position, self.close, 0.001, exit_price[i])
+            np.testing.assert_allclose(curve['pnl'][i], single['pnl'], atol=1e-12)
+            sides = single['trade_sides']
+            self.assertEqual(curve['n_longs'][i], np.count_nonzero(sides == 1))
+            self.assertEqual(curve['n_shorts'][i], np.count_nonzero(sides == -1))
+            # trades in the order they're exited
+            made = ~np.isnan(curve['trade_pnl'][i])
+            trades = trade_ledger(single, 0.001)
+            np.testing.assert_allclose(curve['trade_pnl'][i][made], trades['pnl'],
+                atol=1e-12)
+            np.testing.assert_array_equal(curve['trade_is_long'][i][made],
+                trades['is_long'])
+
+    def test_drawdown_stats(self):
+        """ matrix statistics match the ones of every single curve """
+        pnl = batch_pnl_curve(self.position, self.close, 0.001)['pnl']
+        stats = drawdown_stats(pnl)
+        for i in range(len(pnl)):
+            ret = 1 + pnl[i]
+            drawdown = (ret / np.maximum.accumulate(ret)) - 1
+            dd_periods = np.diff(np.where(drawdown == 0)[0])
+            single = drawdown_stats(pnl[i])
+            np.testing.assert_allclose(stats['drawdown'][i], drawdown)
+            self.assertEqual(single['max_drawdown'], round(-np.amin(drawdown), 2))
+            self.assertEqual(stats['max_drawdown'][i], single['max_drawdown'])
+            if len(dd_periods) > 0:
+                self.assertEqual(stats['longest_drawdown_period'][i], np.amax(dd_periods))
+                self.assertAlmostEqual(stats['average_drawdown_period'][i], 
+                    np.average(dd_periods))
+
+
+class TestSignalsToPosition(unittest.TestCase):
+
+    def setUp(self):
+        rng = np.random.default_rng(7)
+        self.long_signals = rng.choice([0, 0, 0, 1], size=(5, 300))
+        self.short_signals = rng.choice([0, 0, 0, 1], size=(5, 300))
+
+    def legacy_position(self, long_signals, short_signals):
+        position = []
+        pos = 0
+        for s_i in (long_signals - short_signals).tolist():
+            if s_i != 0:
+                pos = s_i
+            position.append(pos)
+        return np.asarray(position)
+
+    def test_forward_fill(self):
+        """ forward fills signals like the per candle loop did """
+        for long_signals, short_signals in zip(self.long_signals, self.short_signals):
+            position = signals_to_position(long_signals, short_signals, True, True)
+            np.testing.assert_array_equal(position, 
+                self.legacy_position(long_signals, short_signals))
+
+    def test_matrix(self):
+        """ every row of a signal matrix is filled independently """
+        position = signals_to_position(self.long_signals, self.short_signals)
+        self.assertEqual(position.shape, self.long_signals.shape)
+        for i in range(len(position)):
+            legacy = self.legacy_position(self.long_signals[i], self.short_signals[i])
+            np.testing.assert_array_equal(position[i], np.where(legacy == 1, 1, 0))
+
+    def test_boolean_signals(self):
+        """ accepts boolean signal arrays """
+        position = signals_to_position(np.array([False, True, False, False]),
+            np.array([False, False, False, True]))
+        np.testing.assert_array_equal(position, [0, 1, 1, 0])
+
+
+class TestApplyExits(unittest.TestCase):
+
+    def setUp(self):
+        rng = np.random.default_rng(3)
+        self.size = 2000
+        self.close = 100 * np.exp(np.cumsum(rng.normal(0, 0.01, self.size)))
+        self.high = self.close * (1 + rng.uniform(0, 0.01, self.size))
+        self.low = self.close * (1 - rng.uniform(0, 0.01, self.size))
+        self.rng = rng
+
+    def loop_exits(self, position, tp, sl, trailing):
+        """ Candle by candle reference implementation """
+        position = position.copy()
+        exit_price = np.full(len(position), np.nan)
+        idx_trades = set((np.flatnonzero(np.diff(position)) + 1).tolist())
+        open_side, entry, extreme = 0, 0., 0.
+        for i in range(len(position)):
+            if open_side == 1:
+                stop = (extreme if trailing else entry) * sl
+                if sl > 0 and self.low[i] <= stop:
+                    exit_price[i], open_side = stop, 0
+                elif self.high[i] >= entry * tp:
+                    exit_price[i], open_side = entry * tp, 0
+                extreme = max(extreme, self.high[i])
+            elif open_side == -1:
+                stop = (extreme if trailing else entry) * (2 - sl)
+                if sl > 0 and self.high[i] >= stop:
+                    exit_price[i], open_side = stop, 0
+                elif self.low[i] <= entry * (2 - tp):
+                    exit_price[i], open_side = entry * (2 - tp), 0
+                extreme = min(extreme, self.low[i])
+            if i in idx_trades:
+                open_side, entry, extreme = position[i], self.close[i], self.close[i]
+            elif open_side == 0:
+                position[i] = 0
+        return position, exit_price
+
+    def test_matches_loop(self):
+        """ array exits match a candle by candle loop """
+        for sides in ([1], [-1], [1, -1]):
+            position = random_position(self.rng, self.size, sides)
+            for tp, sl, trailing in ((1.02, 0.98, False), (1.02, 0.99, True),
+                (np.inf, 0.99, True), (1.01, 0, False)):
+                exits = apply_exits(position, self.close, self.high, self.low, 
+                    tp, sl, trailing)
+                loop_position, loop_price = self.loop_exits(position, tp, sl, trailing)
+                np.testing.assert_array_equal(exits['position'], loop_position)
+                np.testing.assert_allclose(exits['exit_price'], loop_price)
+
+    def test_exit_types(self):
+        """ records why and at what price positions were closed """
+        position = np.array([0, 1, 1, 1, 1, 1])
+        close = np.array([10., 10., 10., 10., 10., 10.])
+        high = np.array([10., 10.5, 10.8, 12., 10., 10.])
+        low = np.array([10., 9.5, 10., 10., 9., 9.])
+        exits = apply_exits(position, close, high, low, 1.1, 0.9)
+        np.testing.assert_array_equal(exits['position'], [0, 1, 1, 0, 0, 0])
+        self.assertEqual(exits['exit_type'][3], EXIT_TAKE_PROFIT)
+        self.assertAlmostEqual(exits['exit_price'][3], 11.)
+        exits = apply_exits(position, close, high, low, np.inf, 0.9, True, 1)
+        np.testing.assert_array_equal(exits['position'], [0, 1, 1, 1, 0, 0])
+        self.assertEqual(exits['exit_type'][4], EXIT_TRAILING_STOP)
+        self.assertAlmostEqual(exits['exit_price'][4], 12 * 0.9 * 0.99)
+        exits = apply_exits(position, close, high, low * 0.5, 1.1, 0.9)
+        self.assertEqual(exits['exit_type'][2], EXIT_STOP_LOSS)
+        np.testing.assert_array_equal(exits['ambiguous'], [])
+        exits = apply_exits(position, close, high * 2, low * 0.5, 1.1, 0.9)
+        np.testing.assert_array_equal(exits['ambiguous'], [2])
+
+    def test_reenters_on_signals(self):
+        """ a signal of the side after an early exit opens a new trade """
+        position = np.array([0, 1, 1, 1, 1, 1, 1, 1])
+        signals = np.array([0, 1, 0, 1, 0, 1, 0, 0])
+        close = np.full(8, 10.)
+        high = np.array([10., 10., 10., 12., 10., 10., 10., 12.])
+        low = np.full(8, 10.)
+        exits = apply_exits(position, close, high, low, 1.1, 0.9)
+        np.testing.assert_array_equal(exits['position'], [0, 1, 1, 0, 0, 0, 0, 0])
+        exits = apply_exits(position, close, high, low, 1.1, 0.9,
+            signals=signals)
+        # the signal of the exit candle doesn't re-enter, the next one does
+        np.testing.assert_array_equal(exits['position'], [0, 1, 1, 0, 0, 1, 1, 0])
+        np.testing.assert_array_equal(np.flatnonzero(exits['exit_type']), [3, 7])
+        curve = pnl_curve(exits['position'], close, 0., exits['exit_price'])
+        traded = curve['trade_sides'] != 0
+        np.testing.assert_array_equal(curve['trade_starts'][traded], [1, 5])
+        self.assertAlmostEqual(curve['pnl'][-1], 0.2)
+        # opposite signals don't re-enter
+        exits = apply_exits(position, close, high, low, 1.1, 0.9,
+            signals=-signals)
+        np.testing.assert_array_equal(exits['position'], [0, 1, 1, 0, 0, 0, 0, 0])
+
+    def test_trailing_value(self):
+        """ a separate trailing stop starts trailing after some profit """
+        position = np.array([0, 1, 1, 1, 1, 1])
+        close = np.full(6, 10.)
+        high = np.array([10., 10.2, 10.5, 11., 10.6, 10.])
+        low = np.array([10., 10., 10.3, 10.6, 10.4, 9.5])
+        exits = apply_exits(position, close, high, low, np.inf, 0.9,
+            trailing_value=0.97, trailing_after=1.04)
+        np.testing.assert_array_equal(exits['position'], [0, 1, 1, 1, 0, 0])
+        self.assertEqual(exits['exit_type'][4], EXIT_TRAILING_STOP)
+        self.assertAlmostEqual(exits['exit_price'][4], 11 * 0.97)
+        # not trailing yet, the stop loss holds
+        exits = apply_exits(position, close, high, low, np.inf, 0.9,
+            trailing_value=0.97, trailing_after=1.2)
+        np.testing.assert_array_equal(exits['position'], position)
+        exits = apply_exits(position, close, high, low * 0.85, np.inf, 0.9,
+            trailing_value=0.97, trailing_after=1.2)
+        self.assertEqual(exits['exit_type'][2], EXIT_STOP_LOSS)
+        # trailing alone, without a stop loss
+        exits = apply_exits(position, close, high, low, np.inf, 0.,
+            trailing_value=0.97, trailing_after=1.04)
+        self.assertEqual(exits['exit_type'][4], EXIT_TRAILING_STOP)
+
+
+class TestScaleIn(unittest.TestCase):
+
+    def setUp(self):
+        self.position = np.array([0, 1, 1, 1, 1, 0, 0])
+        self.high = np.full(7, 11.)
+        self.low = np.array([10., 10., 9.9, 9.98, 9.8, 9., 9.])
+
+    def test_levels(self):
+        """ trades add when the price crosses levels below their entry """
+        entries = scale_in(self.position, self.high, self.low, np.full(7, 10.),
+            2, 0.99)
+        np.testing.assert_array_equal(entries['add_candles'], [4])
+        np.testing.assert_allclose(entries['add_prices'], [9.9])
+        np.testing.assert_array_equal(entries['add_trades'], [1])
+        np.testing.assert_array_equal(entries['trade_ends'], [5])
+        np.testing.assert_array_equal(entries['n_entries'], [2])
+        np.testing.assert_allclose(entries['average_prices'], 
+            [2 / (1 / 10 + 1 / 9.9)])
+        # shorts add above their entry
+        entries = scale_in(-self.position, 20 - self.low, self.high,
+            np.full(7, 10.), 2, 0.99)
+        np.testing.assert_array_equal(entries['add_candles'], [4])
+        np.testing.assert_allclose(entries['add_prices'], [10.1])
+
+    def test_signals(self):
+        """ trades add on the signals of their side, up to `times` """
+        entry_fill = np.arange(7) + 10.
+        signals = np.array([0, 1, 1, 0, 1, 1, 1])
+        entries = scale_in(self.position, self.high, self.low, entry_fill, 1,
+            signals=signals)
+        np.testing.assert_array_equal(entries['add_candles'], [2])
+        np.testing.assert_allclose(entries['add_prices'], [12.])
+        entries = scale_in(self.position, self.high, self.low, entry_fill, 5,
+            signals=signals)
+        # not on the candle the trade is exited on
+        np.testing.assert_array_equal(entries['add_candles'], [2, 4])
+        entries = scale_in(self.position, self.high, self.low, entry_fill, 5,
+            signals=-signals)
+        self.assertEqual(len(entries['add_candles']), 0)
+        np.testing.assert_array_equal(entries['n_entries'], [1])
+
+
+class TestBacktester(unittest.TestCase):
+
+    def setUp(self):
+        self.df = pandas.read_csv('tests/data/BTCUSD_1m_1k.csv')
+        self.bot_config = {
+            'strategy': {
+                'class': CrossStrategy,
+                'params': {'period': 20}
+            },
+            'entry_settings' : {
+                'trade_amount': 1_000,
+                'go_long' : True,
+                'go_short' : False,
+                'fee': 0.1
+            },
+            'exit_settings' : {
+                'exit_on_signal': True
+            }
+        }
+
+    def test_backtest(self):
+        """ backtest pnl curve matches the legacy computation """
+        bt = Backtester(self.bot_config)
+        bt.backtest(self.df)
+        legacy = legacy_pnl_curve(bt.position, bt.close, bt.fee_cost)
+        np.testing.assert_allclose(bt.pnl, legacy, rtol=0, atol=1e-12)
+        self.assertEqual(bt.n_longs, len(bt.trades))
+        self.assertEqual(bt.n_shorts, 0)
+        self.assertEqual(len(bt.idx_longs) + len(bt.idx_shorts), len(bt.idx_trades))
+        results = bt.return_results()
+        self.assertEqual(results['n_total_trades'], bt.n_longs)
+
+    def test_plotting(self):
+        """ plots get the curves as arrays and dates formatted at once """
+        bt = Backtester(self.bot_config)
+        bt.backtest(self.df)
+        fig = bt.get_fig(convert_to_date=True)
+        traces = {trace.name: trace for trace in fig.data}
+        seconds = self.df['time'].to_numpy() // 1000
+        dates = [datetime.fromtimestamp(x, tz=timezone.utc).strftime('%Y-%m-%d %H:%M')
+            for x in seconds]
+        self.assertEqual(list(timestamps_to_dates(seconds)), dates)
+        np.testing.assert_array_equal(traces['equity'].y, bt.equity)
+        np.testing.assert_array_equal(traces['entry orders'].y,
+            self.df['close'].to_numpy()[bt.idx_longs])
+        self.assertEqual(len(traces['exit orders'].x), len(bt.idx_shorts))
+
+    def test_trade_ledger(self):
+        """ the trade ledger gives every trade's fills and the statistics """
+        self.bot_config['entry_settings']['go_short'] = True
+        bt = Backtester(self.bot_config)
+        bt.backtest(self.df)
+        trades = bt.trades
+        close = self.df['close'].to_numpy()
+        np.testing.assert_array_equal(trades['entry_price'], close[trades['entry']])
+        np.testing.assert_array_equal(trades['exit_price'], close[trades['exit']])
+        np.testing.assert_allclose(trades['pnl'], np.where(trades['is_long'],
+            trades['exit_price'] / trades['entry_price'],
+            trades['entry_price'] / trades['exit_price']) - 1 - trades['fees'])
+        results = bt.return_results()
+        profits = [t['pnl'] * 1_000 for t in trades]
+        wins = [p for p in profits if p > 0]
+        losses = [p for p in profits if p <= 0]
+        self.assertEqual(results['n_winning_trades'], len(wins))
+        self.assertEqual(results['n_losing_trades'], len(losses))
+        self.assertAlmostEqual(results['winrate'], len(wins) / len(profits))
+        self.assertAlmostEqual(results['gross_profit'], sum(wins))
+        self.assertAlmostEqual(results['gross_loss'], sum(losses))
+        self.assertAlmostEqual(results['profit_factor'], sum(wins) / -sum(losses))
+        self.assertAlmostEqual(results['profit_avg_trade'], np.mean(profits))
+        self.assertAlmostEqual(results['profit_net_longs'] 
+            + results['profit_net_shorts'], results['profit_net'])
+        for key in ('gross_profit', 'gross_loss', 'winrate', 'profit_factor',
+            'profit_avg_trade'):
+            self.assertEqual(getattr(bt, key), results[key])
+
+    def test_backtest_exits(self):
+        """ take profit and stop loss close positions before the exit signal """
+        self.bot_config['exit_settings'].update(take_profit=0.1, stop_loss_value=0.1)
+        bt = Backtester(self.bot_config)
+        bt.backtest(self.df)
+        self.assertTrue((bt.exit_type != 0).any())
+        for trade in bt.trades:
+            if trade['exit_type'] == EXIT_TAKE_PROFIT:
+                self.assertAlmostEqual(trade['pnl'], 0.001 - 2 * bt.fee_cost)
+            elif trade['exit_type'] == EXIT_STOP_LOSS:
+                self.assertAlmostEqual(trade['pnl'], -0.001 - 2 * bt.fee_cost)
+
+    def test_batched_backtest(self):
+        """ a signal matrix gives the results of one backtest per row """
+        bands = (0.0005, 0.001, 0.002)
+        self.bot_config['strategy'] = {'class': BandStrategy, 
+            'params': {'period': 30, 'bands': bands}}
+        self.bot_config['entry_settings'].update(go_short=True)
+        self.bot_config['exit_settings'].update(stop_loss_value=0.3)
+        bt = Backtester(self.bot_config)
+        bt.backtest(self.df)
+        results = bt.return_results()
+        self.assertEqual(len(results), len(bands))
+        for band, batched in zip(bands, results):
+            self.bot_config['strategy']['params']['bands'] = band
+            single = Backtester(self.bot_config)
+            single.backtest(self.df)
+            np.testing.assert_allclose(bt.pnl[bands.index(band)], single.pnl)
+            expected = single.return_results()
+            self.assertEqual(batched['strategy_params']['band'], band)
+            for key in ('pnl_ratio', 'max_drawdown', 'n_total_trades', 
+                'longest_drawdown_period', 'average_drawdown_period',
+                'sharpe_ratio', 'sortino_ratio', 'calmar_ratio', 'exposure',
+                'time_under_water', 'buyhold_return', 'winrate',
+                'profit_factor', 'gross_profit', 'gross_loss',
+                'n_winning_trades', 'n_losing_trades', 'profit_avg_trade',
+                'profit_net_longs', 'profit_net_shorts'):
+                self.assertAlmostEqual(batched[key], expected[key])
+
+    def test_metrics(self):
+        """ performance metrics follow from the curves, annualized from
+        the timeframe """
+        bt = Backtester(dict(self.bot_config, timeframe='1m'))
+        bt.backtest(self.df)
+        results = bt.return_results()
+        equity = 1 + bt.pnl
+        returns = equity[1:] / equity[:-1] - 1
+        per_year = 365 * 24 * 60
+        self.assertAlmostEqual(results['sharpe_ratio'],
+            returns.mean() / returns.std() * np.sqrt(per_year))
+        downside = np.sqrt(np.mean(np.minimum(returns, 0) ** 2))
+        self.assertAlmostEqual(results['sortino_ratio'],
+            returns.mean() / downside * np.sqrt(per_year))
+        annual = equity[-1] ** (per_year / len(equity)) - 1
+        self.assertAlmostEqual(results['annual_return'], annual)
+        self.assertAlmostEqual(results['calmar_ratio'], 
+            annual / -bt.drawdown.min())
+        self.assertAlmostEqual(results['exposure'], 
+            np.mean(bt.position[bt.idx_trades[0]:] != 0) 
+            * (len(bt.position) - bt.idx_trades[0]) / len(bt.position))
+        self.assertAlmostEqual(results['time_under_water'], np.mean(bt.drawdown < 0))
+        close = self.df['close'].to_numpy()
+        self.assertAlmostEqual(results['buyhold_return'], close[-1] / close[0] - 1)
+        self.assertAlmostEqual(results['excess_return'],
+            results['pnl_ratio'] - results['buyhold_return'])
+        # without a timeframe, candles are a minute apart in the data
+        inferred = Backtester(self.bot_config)
+        inferred.backtest(self.df)
+        self.assertAlmostEqual(inferred.return_results()['sharpe_ratio'],
+            results['sharpe_ratio'])
+        # which streamed candles infer too, however they're chunked
+        df = self.df.iloc[:200]
+        inferred.backtest(df.copy())
+        for chunks in ([df.iloc[i:i + 1] for i in range(len(df))],
+            [df.iloc[:1], df.iloc[1:150], df.iloc[150:]]):
+            streamed = Backtester(self.bot_config)
+            streamed.backtest_stream(chunks)
+            self.assertEqual(streamed.metrics.keys(), inferred.metrics.keys())
+            for key, value in inferred.metrics.items():
+                self.assertAlmostEqual(streamed.metrics[key], value, places=9)
+
+
+class TestSweep(unittest.TestCase):
+
+    def setUp(self):
+        self.df = pandas.read_csv('tests/data/BTCUSD_1m_1k.csv')
+        self.bot_config = {
+            'strategy': {
+                'class': CrossStrategy,
+                'params': {'period': 20}
+            },
+            'entry_settings' : {
+                'trade_amount': 1_000,
+                'fee': 0.1
+            },
+            'exit_settings' : {}
+        }
+        self.param_grid = {
+            'period': [10, 20, 50],
+            'exit_settings.stop_loss_value': [0.2, 1],
+        }
+
+    def test_sweep(self):
+        """ parallel sweep matches running every combination in process """
+        parallel = sweep(self.bot_config, self.df, self.param_grid, n_jobs=2)
+        serial = sweep(self.bot_config, self.df, self.param_grid, n_jobs=1)
+        self.assertEqual(len(parallel), 6)
+        self.assertTrue(parallel['pnl_ratio'].is_monotonic_decreasing)
+        pandas.testing.assert_frame_equal(parallel, serial)
+        self.bot_config['exit_settings']['stop_loss_value'] = 0.2
+        bt = Backtester(self.bot_config)
+        bt.backtest(self.df.copy())
+        row = serial[(serial['period'] == 20) 
+            & (serial['exit_settings.stop_loss_value'] == 0.2)]
+        self.assertEqual(row['pnl_ratio'].iloc[0], bt.return_results()['pnl_ratio'])
+
+    def test_shared_columns(self):
+        """ workers see the datetime and text columns of the data too """
+        df = self.df.copy()
+        df['time'] = pandas.to_datetime(df['time'], unit='ms', utc=True)
+        df['symbol'] = 'BTCUSD'
+        parallel = sweep(self.bot_config, df, self.param_grid, n_jobs=2)
+        serial = sweep(self.bot_config, df, self.param_grid, n_jobs=1)
+        pandas.testing.assert_frame_equal(parallel, serial)
+        self.assertEqual(parallel['start_time'].iloc[0], df['time'].iloc[0])
+        self.assertEqual(parallel['end_time'].iloc[0], df['time'].iloc[-1])
+
+    def test_batched_strategy(self):
+        """ signal matrices give one row per param set of the strategy """
+        bands = [0.0005, 0.001, 0.002]
+        self.bot_config['strategy'] = {'class': BandStrategy,
+            'params': {'bands': bands}}
+        param_grid = {'period': [20, 30], 'exit_settings.stop_loss_value': [0.3]}
+        parallel = sweep(self.bot_config, self.df, param_grid, n_jobs=2)
+        serial = sweep(self.bot_config, self.df, param_grid, n_jobs=1)
+        self.assertEqual(len(serial), 6)
+        pandas.testing.assert_frame_equal(parallel, serial)
+        self.bot_config['strategy']['params'] = {'period': 30, 'bands': 0.001}
+        self.bot_config['exit_settings']['stop_loss_value'] = 0.3
+        bt = Backtester(self.bot_config)
+        bt.backtest(self.df.copy())
+        row = serial[(serial['period'] == 30) & (serial['band'] == 0.001)]
+        self.assertEqual(len(row), 1)
+        self.assertAlmostEqual(row['pnl_ratio'].iloc[0],
+            bt.return_results()['pnl_ratio'])
+
+
+class TestWalkForward(unittest.TestCase):
+
+    def setUp(self):
+        self.df = pandas.read_csv('tests/data/BTCUSD_1m_10k.csv')
+        self.bot_config = {
+            'strategy': {
+                'class': CrossStrategy,
+                'params': {'period': 20}
+            },
+            'entry_settings' : {
+                'trade_amount': 1_000,
+                'fee': 0.1
+            },
+            'exit_settings' : {}
+        }
+
+    def test_walk_forward(self):
+        """ trades the best train window params on every test window """
+        wf = walk_forward(self.bot_config, self.df, {'period': [10, 30, 60]},
+            train_size=2000, test_size=1000, n_jobs=2)
+        windows = wf['windows']
+        self.assertEqual(len(windows), 9)
+        self.assertEqual(len(wf['pnl']), 9000)
+        np.testing.assert_array_equal(wf['time'], self.df['time'].values[2000:])
+        # every window continues the pnl of the previous one
+        np.testing.assert_allclose(wf['pnl'][999::1000], 
+            np.cumsum(windows['test_pnl_ratio']))
+        # scores match the ones of indicators computed on the whole frame
+        for period in (10, 30, 60):
+            strategy = CrossStrategy(period)
+            strategy.setUp(self.df.copy())
+            for k, window in windows.iterrows():
+                if window['params']['period'] != period:
+                    continue
+                test = slice(2000 + 1000 * k, 3000 + 1000 * k)
+                position = signals_to_position(strategy.long_signals[test], 
+                    strategy.short_signals[test])
+                pnl = pnl_curve(position, self.df['close'].values[test], 0.001)['pnl']
+                self.assertAlmostEqual(pnl[-1], window['test_pnl_ratio'])
+
+
+class TestPortfolio(unittest.TestCase):
+
+    def setUp(self):
+        btc = pandas.read_csv('tests/data/BTCUSD_1m_1k.csv')
+        ada = pandas.read_csv('tests/data/ADABTC_1m_1k.csv')
+        ada = ada.iloc[:len(btc)].reset_index(drop=True)
+        ada['time'] = btc['time']
+        self.dfs = {'BTC/USD': btc, 'ADA/BTC': ada, 'BTC/USD 2': btc.copy()}
+        self.bot_config = {
+            'strategy': {'class': CrossStrategy, 'params': {'period': 20}},
+            'starting_balance': 1000,
+            'entry_settings' : {
+                'initial_entry_allocation': 40,
+                'signal_distance': 0.05,
+            },
+            'exit_settings' : {
+                'take_profit': 0.2,
+                'stop_loss_value': 0.2,
+                'exit_on_signal': True,
+            }
+        }
+
+    def test_shared_balance(self):
+        """ entries stop once the shared balance is used up """
+        close = np.ones((4, 3))
+        entry = np.zeros((4, 3))
+        entry[1] = 1
+        result = run_portfolio(close, close, close, entry, np.zeros((4, 3)), 
+            100, initial_entry_allocation=50)
+        self.assertEqual(result['balance'][1], 0)
+        self.assertEqual(result['equity'][-1], 100)
+        exits = np.zeros((4, 3))
+        exits[3] = 1
+        result = run_portfolio(close, close, close * [1, 2, 3], entry, exits,
+            100, initial_entry_allocation=50, exit_on_signal=True)
+        trades = result['trades']
+        self.assertEqual(trades['symbol'].tolist(), [0, 1])
+        self.assertTrue((trades['exit_type'] == EXIT_SIGNAL).all())
+        self.assertEqual(result['balance'][-1], 100)
+
+    def test_backtest(self):
+        """ equity is the balance plus the value of the open positions """
+        bt = PortfolioBacktester(self.bot_config)
+        bt.backtest(self.dfs)
+        results = bt.return_results()
+        self.assertGreater(results['n_total_trades'], 0)
+        self.assertEqual(set(results['trades_per_symbol']), set(self.dfs))
+        trades = bt.trades
+        profit = ((trades['exit_price'] - trades['entry_price']) * trades['quantity']).sum()
+        self.assertAlmostEqual(results['final_balance'] 
+            + 400 * len(results['open_symbols']), 1000 + profit)
+        self.assertLessEqual(results['n_take_profits'] + results['n_stop_losses'] 
+            + results['n_signal_exits'], results['n_total_trades'])
+
+
+class TestMonteCarlo(unittest.TestCase):
+
+    def setUp(self):
+        self.bt = Backtester({
+            'strategy': {'class': CrossStrategy, 'params': {'period': 20}},
+            'entry_settings' : {'trade_amount': 1_000, 'fee': 0.1, 'go_short': True},
+            'exit_settings' : {},
+        })
+        self.bt.backtest(pandas.read_csv('tests/data/BTCUSD_1m_1k.csv'))
+
+    def test_shuffles(self):
+        """ shuffled trades end on the same pnl, through other drawdowns """
+        sims = self.bt.monte_carlo(500, replace=False, seed=1)
+        np.testing.assert_allclose(sims['final_pnl'], self.bt.pnl[-1])
+        self.assertGreater(np.ptp(sims['max_drawdown']), 0)
+        self.assertTrue((sims['longest_drawdown_period'] <= len(self.bt.trades)).all())
+        # the first trades of every shuffle
+        sims = self.bt.monte_carlo(500, n_trades=5, replace=False, seed=1)
+        shuffles = np.random.default_rng(1).permuted(
+            np.tile(self.bt.trades['pnl'], (500, 1)), axis=1)
+        np.testing.assert_allclose(sims['final_pnl'], shuffles[:, :5].sum(axis=1))
+        with self.assertRaises(ValueError):
+            self.bt.monte_carlo(10, n_trades=len(self.bt.trades) + 1, replace=False)
+
+    def test_ruin(self):
+        """ summed pnl losing more than the amount traded draws down 100% """
+        sims = resample_trades([0.5, -0.9, -0.9], 100, seed=3)
+        self.assertTrue((sims['final_pnl'] < -1).any())
+        self.assertTrue((sims['max_drawdown'] <= 1).all())
+        self.assertEqual(sims['max_drawdown'][np.argmin(sims['final_pnl'])], 1)
+
+    def test_drawdowns(self):
+        """ every simulation gets the drawdowns of its own equity curve """
+        returns = np.array([t['pnl'] for t in self.bt.trades])
+        sims = self.bt.monte_carlo(3, n_trades=50, seed=2, compound=True)
+        draws = np.random.default_rng(2).integers(0, len(returns), size=(3, 50))
+        for i, draw in enumerate(draws):
+            equity = np.cumprod(np.append(1, 1 + returns[draw]))
+            self.assertAlmostEqual(sims['final_pnl'][i], equity[-1] - 1)
+            self.assertAlmostEqual(sims['max_drawdown'][i],
+                np.max(1 - equity / np.maximum.accumulate(equity)))
+
+
+class TestStream(unittest.TestCase):
+
+    def setUp(self):
+        self.path = 'tests/data/BTCUSD_1m_10k.csv'
+        self.bot_config = {
+            'strategy': {'class': CrossStrategy, 'params': {'period': 20}},
+            'entry_settings' : {
+                'trade_amount': 1_000,
+                'fee': 0.1,
+                'go_short': True,
+            },
+            'exit_settings' : {
+                'take_profit': 0.5,
+                'stop_loss_value': 0.3,
+                'trailing_stop_loss': True,
+            }
+        }
+
+    def test_matches_in_memory(self):
+        """ streaming chunks gives the results of the whole data """
+        bt = Backtester(self.bot_config)
+        bt.backtest(pandas.read_csv(self.path))
+        expected = bt.return_results()
+        for chunksize in (333, 4_000):
+            streamed = Backtester(self.bot_config)
+            streamed.backtest_stream(read_ohlcv_chunks(self.path, chunksize))
+            results = streamed.return_results()
+            self.assertEqual(results.keys(), expected.keys())
+            for key, value in expected.items():
+                if isinstance(value, float):
+                    self.assertAlmostEqual(results[key], value, places=9)
+                else:
+                    self.assertEqual(results[key], value)
+            self.assertEqual(len(streamed.trades), len(bt.trades))
+            self.assertEqual([(t['entry'], t['exit'], t['exit_type']) 
+                    for t in streamed.trades],
+                [(t['entry'], t['exit'], t['exit_type']) for t in bt.trades])
+            self.assertEqual(len(streamed.pnl), 11_000 % chunksize or chunksize)
+
+    def test_reentries(self):
+        """ trades re-entered after early exits stream like in memory """
+        df = pandas.read_csv(self.path).iloc[:4_000]
+        config = dict(self.bot_config, exit_settings={'take_profit': 0.1,
+            'stop_loss_value': 0.1})
+        config['strategy'] = {'class': BandStrategy, 'params': {'bands': 0.002}}
+        for fill_model in ('close', 'next_open'):
+            config['fill_model'] = fill_model
+            bt = Backtester(config)
+            bt.backtest(df.copy())
+            held = Backtester(dict(config, exit_settings={}))
+            held.backtest(df.copy())
+            # more trades than the signals alone open
+            self.assertGreater(len(bt.trades), len(held.trades))
+            for chunksize in (97, 1_000):
+                streamed = Backtester(config)
+                streamed.backtest_stream(read_ohlcv_chunks(self.path,
+                    chunksize, nrows=4_000))
+                self.assertEqual(
+                    [(t['entry'], t['exit'], t['exit_type']) for t in streamed.trades],
+                    [(t['entry'], t['exit'], t['exit_type']) for t in bt.trades])
+                self.assertAlmostEqual(streamed.return_results()['profit_net'],
+                    bt.return_results()['profit_net'], places=9)
+
+    def test_one_candle_chunks(self):
+        """ candles streamed one by one give the results of the whole data """
+        df = pandas.read_csv(self.path).iloc[:300]
+        bt = Backtester(self.bot_config)
+        bt.backtest(df.copy())
+        streamed = Backtester(self.bot_config)
+        streamed.backtest_stream(df.iloc[i:i + 1] for i in range(len(df)))
+        results = streamed.return_results()
+        for key, value in bt.return_results().items():
+            if isinstance(value, float):
+                self.assertAlmostEqual(results[key], value, places=9)
+            else:
+                self.assertEqual(results[key], value)
+
+    def test_no_warmup(self):
+        """ strategies needing no past candles carry none across chunks """
+        config = dict(self.bot_config, exit_settings={})
+        config['strategy'] = {'class': CandleStrategy, 'params': {}}
+        df = pandas.read_csv(self.path).iloc[:2_000]
+        bt = Backtester(config)
+        bt.backtest(df.copy())
+        streamed = Backtester(config)
+        for start in range(0, len(df), 250):
+            streamed.append(df.iloc[start:start + 250])
+            self.assertEqual(len(streamed._stream.warmup), 0)
+        np.testing.assert_array_equal(streamed.position, bt.position)
+        self.assertAlmostEqual(streamed.return_results()['profit_net'],
+            bt.return_results()['profit_net'], places=9)
+
+    def test_exit_on_chunk_boundary(self):
+        """ a position closed early stays flat in the chunks after it """
+        df = pandas.read_csv(self.path).iloc[:4_000]
+        bt = Backtester(self.bot_config)
+        bt.backtest(df.copy())
+        raw = Backtester(dict(self.bot_config, exit_settings={}))
+        raw.backtest(df.copy())
+        # early exits the signals hold the position through
+        exits = [i for i in np.flatnonzero(bt.exit_type).tolist()
+            if i + 2 < len(df) and raw.position[i + 2] == raw.position[i] != 0]
+        self.assertGreater(len(exits), 0)
+        for i in exits[:3]:
+            for cut in (i + 1, i + 2):
+                streamed = Backtester(self.bot_config)
+                streamed.backtest_stream([df.iloc[:cut], df.iloc[cut:]])
+                self.assertEqual(
+                    [(t['entry'], t['exit']) for t in streamed.trades],
+                    [(t['entry'], t['exit']) for t in bt.trades])
+                np.testing.assert_array_equal(streamed.position,
+                    bt.position[cut:])
+                self.assertAlmostEqual(streamed.return_results()['profit_net'],
+                    bt.return_results()['profit_net'], places=9)
+
+    def test_append(self):
+        """ appending candles extends the curves of a full backtest """
+        df = pandas.read_csv(self.path).iloc[:3_000]
+        bt = Backtester(self.bot_config)
+        bt.backtest(df.copy())
+        appended = Backtester(self.bot_config)
+        # a one candle chunk first: the timeframe is inferred later
+        appended.append(df.iloc[:1])
+        appended.append(df.iloc[1:2_000])
+        for start in range(2_000, 3_000, 150):
+            appended.append(df.iloc[start:start + 150])
+        self.assertEqual(len(appended.data), len(df))
+        np.testing.assert_array_equal(appended.data['close'], df['close'])
+        self.assertAlmostEqual(appended.return_results()['sharpe_ratio'],
+            bt.return_results()['sharpe_ratio'], places=6)
+        np.testing.assert_allclose(appended.pnl, bt.pnl, atol=1e-12)
+        np.testing.assert_allclose(appended.drawdown, bt.drawdown, atol=1e-12)
+        np.testing.assert_array_equal(appended.position, bt.position)
+        np.testing.assert_array_equal(appended.idx_longs, bt.idx_longs)
+        np.testing.assert_array_equal(appended.trades, bt.trades)
+        self.assertEqual(appended.return_results()['n_total_trades'], 
+            bt.return_results()['n_total_trades'])
+
+
+class TestFills(unittest.TestCase):
+
+    def setUp(self):
+        self.df = pandas.read_csv('tests/data/BTCUSD_1m_1k.csv')
+        self.bot_config = {
+            'strategy': {'class': CrossStrategy, 'params': {'period': 20}},
+            'entry_settings' : {'trade_amount': 1_000, 'fee': 0.1},
+            'exit_settings' : {},
+        }
+
+    def backtest(self, fill_model):
+        bt = Backtester(dict(self.bot_config, fill_model=fill_model))
+        bt.backtest(self.df.copy())
+        return bt
+
+    def test_next_open(self):
+        """ orders fill at the open of the candle after the signal """
+        close = self.backtest('close')
+        next_open = self.backtest('next_open')
+        np.testing.assert_array_equal(next_open.position[1:], close.position[:-1])
+        trade = next_open.trades[0]
+        self.assertEqual(trade['entry'], close.trades[0]['entry'] + 1)
+        opens = self.df['open'].to_numpy()
+        self.assertAlmostEqual(trade['pnl'], 
+            opens[trade['exit']] / opens[trade['entry']] - 1 - 0.002)
+
+    def test_intrabar(self):
+        """ buying highs and selling lows only loses more """
+        close = self.backtest('close')
+        intrabar = self.backtest('intrabar')
+        self.assertEqual(len(intrabar.trades), len(close.trades))
+        for worse, trade in zip(intrabar.trades, close.trades):
+            self.assertLessEqual(worse['pnl'], trade['pnl'])
+
+    def test_order_book(self):
+        """ fills walk the recorded order book """
+        levels = [[100, 2], [101, 3], [105, 10]]
+        self.assertEqual(book_average_price(levels), 100)
+        self.assertAlmostEqual(book_average_price(levels, 400), 
+            (100 * 200 + 101 * 200) / 400)
+        with self.assertRaises(ValueError):
+            book_average_price(levels, 10_000)
+        close = self.backtest('close')
+        entry = close.trades[0]['entry']
+        time = self.df['time'][entry]
+        price = self.df['close'][entry]
+        book = {time: {'asks': [[price * 1.01, 1e6]], 'bids': [[price, 1e6]]}}
+        bt = self.backtest(OrderBookFill(book, max_age=0))
+        self.assertAlmostEqual(bt.trades[0]['pnl'], 
+            (close.trades[0]['pnl'] + 1.002) / 1.01 - 1.002)
+        np.testing.assert_array_equal(bt.trades[1:], close.trades[1:])
+
+    def test_order_book_depth(self):
+        """ walking many snapshots at once matches walking them one by one,
+        like getOrderBookPrice does """
+        def walk(levels, quantity, is_quote_quantity):
+            price, accounted = Decimal(0), Decimal(0)
+            for level_price, level_quantity in levels:
+                size = Decimal(level_quantity)
+                if is_quote_quantity:
+                    size *= Decimal(level_price)
+                qty = min(size, quantity - accounted)
+                price += Decimal(level_price) * qty
+                accounted += qty
+                if accounted >= quantity:
+                    break
+            return float(price / quantity)
+        rng = np.random.default_rng(3)
+        books = {}
+        for time in range(200):
+            n_levels = int(rng.integers(2, 30))
+            asks = 100 + np.cumsum(rng.uniform(0.01, 1, n_levels))
+            bids = 100 - np.cumsum(rng.uniform(0.01, 1, n_levels))
+            books[time * 60] = dict(
+                asks=np.column_stack((asks, rng.uniform(1, 5, n_levels))).tolist(),
+                bids=np.column_stack((bids, rng.uniform(1, 5, n_levels))).tolist())
+        df = pandas.DataFrame(dict(time=np.arange(400) * 30, close=100.))
+        for is_quote_quantity in (True, False):
+            fill = OrderBookFill(books, is_quote_quantity)
+            # the quote amount traded, converted at the best price for books
+            # of base quantities
+            buy, sell = fill.prices(df, 150.)
+            for i, time in enumerate(df['time']):
+                book = books[time // 60 * 60]
+                for price, levels in ((buy[i], book['asks']), (sell[i], book['bids'])):
+                    amount = Decimal(150.) if is_quote_quantity \
+                        else Decimal(150. / levels[0][0])
+                    self.assertAlmostEqual(price,
+                        walk(levels, amount, is_quote_quantity))
+        # orders larger than the book fill all of it
+        buy, sell = OrderBookFill(books).prices(df, 1e6)
+        asks = books[0]['asks']
+        self.assertAlmostEqual(buy[0], walk(asks,
+            sum(Decimal(p) * Decimal(q) for p, q in asks), True))
+
+    def test_thin_books(self):
+        """ thin or empty snapshots on candles where nothing fills are not
+        walked, and don't leave exits without a price """
+        config = dict(self.bot_config, exit_settings={'stop_loss_value': 0.05},
+            entry_settings=dict(self.bot_config['entry_settings'], go_short=True))
+        price = self.df['close'].to_numpy()
+        books = {time: dict(asks=[[c, 500 / c], [c * 1.01, 1e6]],
+                bids=[[c, 500 / c], [c * 0.99, 1e6]])
+            for time, c in zip(self.df['time'], price)}
+        deep = Backtester(dict(config, fill_model=OrderBookFill(books)))
+        deep.backtest(self.df.copy())
+        stops = np.flatnonzero(deep.exit_type == EXIT_STOP_LOSS)
+        self.assertGreater(len(stops), 0)
+        filled = set(stops.tolist()) | set(np.flatnonzero(
+            np.diff(deep.position) != 0) + 1)
+        quiet = [i for i in range(1, len(price)) if i not in filled]
+        times = self.df['time'].to_numpy()
+        for i in quiet[::2]:
+            books[times[i]] = dict(asks=[], bids=[])
+        for i in quiet[1::2]:
+            books[times[i]] = dict(asks=[[price[i], 1e-6]], bids=[[price[i], 1e-6]])
+        requested = []
+        class RecordedFill(OrderBookFill):
+            def slippage(self, data, amount=None, candles=None):
+                requested.extend(candles.tolist())
+                return super().slippage(data, amount, candles)
+        thin = Backtester(dict(config, fill_model=RecordedFill(books)))
+        thin.backtest(self.df.copy())
+        self.assertEqual(sorted(requested), stops.tolist())
+        np.testing.assert_array_equal(thin.exit_price, deep.exit_price)
+        np.testing.assert_array_equal(thin.trades, deep.trades)
+        # an empty book fills at the close, a thin one as deep as it goes
+        fill = OrderBookFill(books)
+        candles = np.array(quiet[:2])
+        buy, sell = fill.prices(self.df, 1_000, candles)
+        np.testing.assert_allclose(buy[candles], price[candles])
+        np.testing.assert_allclose(sell[candles], price[candles])
+        buy_slip, sell_slip = fill.slippage(self.df, 1_000, candles)
+        np.testing.assert_array_equal(buy_slip, [0, 0])
+        np.testing.assert_array_equal(sell_slip, [0, 0])
+
+    def test_stop_slippage(self):
+        """ stop losses fill worse by the impact of the order book """
+        config = dict(self.bot_config, exit_settings={'stop_loss_value': 0.05},
+            entry_settings=dict(self.bot_config['entry_settings'], go_short=True))
+        price = self.df['close'].to_numpy()
+        books = {time: dict(asks=[[c, 500 / c], [c * 1.01, 1e6]],
+                bids=[[c, 500 / c], [c * 0.99, 1e6]])
+            for time, c in zip(self.df['time'], price)}
+        slipped = Backtester(dict(config, fill_model=OrderBookFill(books)))
+        slipped.backtest(self.df.copy())
+        self.assertGreater(np.count_nonzero(slipped.exit_type == EXIT_STOP_LOSS), 0)
+        # half of the 1000 quote amount fills at the best price
+        impact = 0.5 * 0.01
+        for trade in slipped.trades:
+            if trade['exit_type'] != EXIT_STOP_LOSS:
+                continue
+            side = 1 if trade['is_long'] else -1
+            entry = (slipped.buy_price if side == 1
+                else slipped.sell_price)[trade['entry']]
+            self.assertAlmostEqual(slipped.exit_price[trade['exit']],
+                entry * (1 - side * 0.0005) * (1 - side * impact), places=6)
+        # streaming carries the slippage of the open trade over
+        path = 'tests/data/BTCUSD_1m_10k.csv'
+        df = pandas.read_csv(path)
+        books = {time: dict(asks=[[c, 500 / c], [c * 1.01, 1e6]],
+                bids=[[c, 500 / c], [c * 0.99, 1e6]])
+            for time, c in zip(df['time'].tolist(), df['close'].tolist())}
+        config = dict(config, fill_model=OrderBookFill(books))
+        whole = Backtester(config)
+        whole.backtest(df)
+        streamed = Backtester(config)
+        streamed.backtest_stream(read_ohlcv_chunks(path, 1_000))
+        self.assertAlmostEqual(streamed.return_results()['profit_net'],
+            whole.return_results()['profit_net'], places=6)
+        self.assertEqual([(t['entry'], t['exit']) for t in streamed.trades],
+            [(t['entry'], t['exit']) for t in whole.trades])
+
+    def test_loop_backtesters(self):
+        """ the engine backtesters fill entries through the model """
+        bt = SundayBacktester({
+            'strategy': {'class': CrossStrategy, 'params': {}},
+            'starting_balance': 1000,
+            'entry_settings': {},
+            'exit_settings': {'sell_on_end': True},
+            'fill_model': 'next_open',
+        })
+        bt.backtest(self.df)
+        times = self.df['time'].tolist()
+        for time, price, _, _ in bt.entries:
+            self.assertEqual(price, self.df['open'][times.index(time) + 1])
+        results = engine_backtest(self.df, 'BTCUSD', TickExchange(), 
+            dotdict(strategy_class=DipStrategy, args=(20,)), dotdict(se=None),
+            dotdict(pt=1.01, tsl=None, sl=0.98), fill_model='next_open')
+        for time, price in results['buy_times']:
+            self.assertEqual(price, round(self.df['open'][times.index(time) + 1], 2))
+
+
+class TestIntrabar(unittest.TestCase):
+
+    def setUp(self):
+        self.minutes = pandas.read_csv('tests/data/BTCUSD_1m_10k.csv')
+        hours = self.minutes.groupby(self.minutes['time'] // 3_600_000)
+        self.df = hours.agg(open=('open', 'first'), high=('high', 'max'),
+            low=('low', 'min'), close=('close', 'last'), 
+            volume=('volume', 'sum')).reset_index()
+        self.df['time'] = self.df['time'] * 3_600_000
+        self.bot_config = {
+            'strategy': {'class': CrossStrategy, 'params': {'period': 5}},
+            'entry_settings' : {'trade_amount': 1_000, 'fee': 0.1, 'go_short': True},
+            'exit_settings' : {'take_profit': 0.1, 'stop_loss_value': 0.1},
+        }
+
+    def test_resolves_ambiguous_exits(self):
+        """ 1m candles tell which level an ambiguous 1h candle hit first """
+        bt = Backtester(self.bot_config)
+        bt.backtest(self.df.copy())
+        resolved = Backtester(dict(self.bot_config, lower_timeframe=self.minutes))
+        resolved.backtest(self.df.copy())
+        self.assertGreater(len(bt.ambiguous_exits), 0)
+        self.assertEqual(len(resolved.ambiguous_exits), 0)
+        np.testing.assert_array_equal(resolved.position, bt.position)
+        changed = np.flatnonzero(resolved.exit_type != bt.exit_type)
+        self.assertTrue(np.isin(changed, bt.ambiguous_exits).all())
+        entries = {t['exit']: t for t in bt.trades}
+        for i in bt.ambiguous_exits:
+            trade = entries[i]
+            entry = self.df['close'][trade['entry']]
+            tp, sl = (entry * 1.001, entry * 0.999) if trade['is_long'] \
+                else (entry * 0.999, entry * 1.001)
+            time = self.df['time'][i]
+            for _, minute in self.minutes[(self.minutes['time'] >= time) 
+                    & (self.minutes['time'] < time + 3_600_000)].iterrows():
+                hits = (minute['high'] >= tp, minute['low'] <= sl) \
+                    if trade['is_long'] else (minute['low'] <= tp, minute['high'] >= sl)
+                if any(hits):
+                    break
+            expected = EXIT_STOP_LOSS if hits[1] else EXIT_TAKE_PROFIT
+            self.assertEqual(resolved.exit_type[i], expected)
+        # streaming maps the sub candles of every chunk too
+        streamed = Backtester(dict(self.bot_config, lower_timeframe=self.minutes))
+        streamed.backtest_stream(self.df.iloc[i:i+40] for i in range(0, len(self.df), 40))
+        np.testing.assert_array_equal(streamed.trades, resolved.trades)
+
+    def test_one_candle_chunks(self):
+        """ candles appended one by one map to their sub candles too """
+        lower = LowerTimeframe(self.minutes)
+        config = dict(self.bot_config, lower_timeframe=lower)
+        resolved = Backtester(config)
+        resolved.backtest(self.df.copy())
+        # the duration inferred from the candles is not kept
+        self.assertIsNone(lower.candle_duration)
+        appended = Backtester(config)
+        for i in range(len(self.df)):
+            appended.append(self.df.iloc[i:i + 1])
+        np.testing.assert_array_equal(appended.trades, resolved.trades)
+        np.testing.assert_array_equal(appended.exit_type, resolved.exit_type)
+
+
+class TestEngineBacktest(unittest.TestCase):
+
+    def setUp(self):
+        self.df = pandas.read_csv('tests/data/BTCUSD_1m_10k.csv')
+        self.entry_strategy = dotdict(strategy_class=DipStrategy, args=(20,))
+        self.entry_settings = dotdict(se=dotdict(
+            times=2, after_profit=0.995, pt_decrease=0.998))
+
+    def test_float_matches_exact(self):
+        """ the float path trades like the Decimal one """
+        for exit_settings in (dotdict(pt=1.01, tsl=None, sl=0.98), 
+            dotdict(pt=None, tsl=dotdict(value=0.995, after_profit=1.003), sl=0.97)):
+            exchange = TickExchange()
+            fast = engine_backtest(self.df, 'BTCUSD', exchange, 
+                self.entry_strategy, self.entry_settings, exit_settings)
+            # tick rounding is looked up once, not on every price
+            self.assertEqual(exchange.calls, 2)
+            exact = engine_backtest(self.df, 'BTCUSD', TickExchange(), 
+                self.entry_strategy, self.entry_settings, exit_settings, 
+                exact=True)
+            self.assertIsInstance(exact['buy_times'][0][1], Decimal)
+            self.assertEqual(fast['total_profit_loss'], exact['total_profit_loss'])
+            for key in ('buy_times', 'tp_sell_times', 'sl_sell_times', 'tsl_sell_times'):
+                self.assertEqual([t[0] for t in fast[key]], [t[0] for t in exact[key]])
+                # prices can only differ by a tick, on rounding ties
+                np.testing.assert_allclose([t[1] for t in fast[key]],
+                    [float(t[1]) for t in exact[key]], atol=0.0100001, rtol=0)
+
+
+class TestSundayTheQuant(unittest.TestCase):
+
+    def test_trailing_stop_loss(self):
+        """ the running max trails like the max over the open window """
+        high = pandas.read_csv('tests/data/BTCUSD_1m_1k.csv')['high'].to_numpy()
+        bt = SundayBacktester({
+            'strategy': {'class': CrossStrategy, 'params': {}},
+            'starting_balance': 1000,
+            'entry_settings': {},
+            'exit_settings': {'trailing_stop_loss': True},
+        })
+        bt.open_position(price=high[10], time=0, side='long', from_opened=10)
+        bt.set_stop_loss(price=high[10], sl_long=0.9)
+        stop_loss = bt.stop_loss_price
+        for i in range(10, len(high)):
+            bt.update_trailing_stop_loss(high, i)
+            # the window is empty on the opening candle, its max is NaN
+            new_stop_loss = pandas.Series(high)[10:i].max() * 0.99
+            if not stop_loss > new_stop_loss:
+                stop_loss = new_stop_loss
+            np.testing.assert_equal(bt.stop_loss_price, stop_loss)
+
+
+if __name__ == '__main__':
+    unittest.main()
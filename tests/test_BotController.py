@@ -8,10 +8,15 @@ sys.path.insert(1, root_path)
 from pyjuque.Engine import Models 
 
 from pyjuque.Plotting import PlotData
+from pyjuque.Engine.BotController import BotController
+from pyjuque.Engine.TickContext import TickContext
+from pyjuque.Strategies import VectorStrategy
 from tests.utils import get_session
 import unittest
 from unittest.mock import patch
 import pandas
+import numpy as np
+from types import SimpleNamespace
 
 class TestSqliteDecimal(unittest.TestCase):
     
@@ -74,5 +79,61 @@ class TestSqliteDecimal(unittest.TestCase):
             bot_controller.executeBot()
 
 
+class CountingStrategy(VectorStrategy):
+    """ Long on rising closes, short on falling ones, counting its setUps """
+    minimum_period = 50
+
+    def __init__(self):
+        self.n_setups = 0
+
+    def setUp(self, df):
+        self.n_setups += 1
+        change = np.diff(df['close'].to_numpy(), prepend=np.nan)
+        self.long_signals = change > 0
+        self.short_signals = change < 0
+
+
+class FakeExchange():
+    """ Serves the last candles of fixed dataframes, counting requests """
+    def __init__(self, dfs):
+        self.dfs = dfs
+        self.n_requests = 0
+
+    def getOHLCV(self, symbol, interval, limit=1000):
+        self.n_requests += 1
+        return self.dfs[symbol].iloc[-limit:].reset_index(drop=True)
+
+
+class TestTickContext(unittest.TestCase):
+
+    def setUp(self):
+        df = pandas.read_csv('tests/data/BTCUSD_1m_1k.csv')
+        # one symbol ending on a rising candle, the other on a falling one
+        rising = np.flatnonzero(np.diff(df['close'].to_numpy()) > 0)[-1] + 2
+        falling = np.flatnonzero(np.diff(df['close'].to_numpy()) < 0)[-1] + 2
+        self.exchange = FakeExchange({
+            'UP': df.iloc[:rising], 'DOWN': df.iloc[:falling]})
+        self.strategy = CountingStrategy()
+        self.bot = BotController(None, SimpleNamespace(test_run=True),
+            self.exchange, self.strategy, timeframe='1m')
+
+    def test_shared_evaluation(self):
+        """ entry and exit checks of a tick fetch and set up once per symbol """
+        self.bot.tick = TickContext()
+        for _ in range(3):
+            self.assertTrue(self.bot.checkEntryStrategy('UP')[0])
+            self.assertFalse(self.bot.checkExitStrategy('UP')[0])
+            self.assertFalse(self.bot.checkEntryStrategy('DOWN')[0])
+            self.assertTrue(self.bot.checkExitStrategy('DOWN')[0])
+        self.assertEqual((self.exchange.n_requests, self.strategy.n_setups), (2, 2))
+        self.assertEqual(len(self.bot.getCandles('UP')), self.strategy.minimum_period)
+
+    def test_outside_tick(self):
+        """ without a tick every check gets fresh data """
+        self.bot.checkEntryStrategy('UP')
+        self.bot.checkExitStrategy('UP')
+        self.assertEqual((self.exchange.n_requests, self.strategy.n_setups), (2, 2))
+
+
 if __name__ == '__main__':
     unittest.main()
\ No newline at end of file
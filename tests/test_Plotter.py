@@ -0,0 +1,80 @@
+import os
+import sys
+curr_path = os.path.abspath(__file__)
+root_path = os.path.abspath(
+    os.path.join(curr_path, os.path.pardir, os.path.pardir))
+sys.path.insert(1, root_path)
+
+from pyjuque.Utils.Plotter import GetPlotData
+from pyjuque.Utils.Downsample import downsample_ohlc, lttb
+import unittest
+import numpy as np
+import pandas
+
+
+class TestDownsample(unittest.TestCase):
+
+    def setUp(self):
+        self.df = pandas.read_csv('tests/data/BTCUSD_1m_10k.csv')
+
+    def test_ohlc(self):
+        """ aggregated candles cover the same price range and volume """
+        ohlc = downsample_ohlc(self.df, 1_000)
+        self.assertLessEqual(len(ohlc), 1_000)
+        self.assertEqual(ohlc['high'].max(), self.df['high'].max())
+        self.assertEqual(ohlc['low'].min(), self.df['low'].min())
+        self.assertAlmostEqual(ohlc['volume'].sum(), self.df['volume'].sum())
+        self.assertEqual(ohlc['open'].iloc[0], self.df['open'].iloc[0])
+        self.assertEqual(ohlc['close'].iloc[-1], self.df['close'].iloc[-1])
+        self.assertIs(downsample_ohlc(self.df, len(self.df)), self.df)
+
+    def test_lttb(self):
+        """ lttb keeps the ends and the extremes of a line """
+        y = np.sin(np.linspace(0, 20, 10_000))
+        y[5_000] = 5
+        y[:100] = np.nan
+        kept = lttb(np.arange(len(y)), y, 500)
+        self.assertEqual(len(kept), 500)
+        self.assertEqual(kept[0], 0)
+        self.assertEqual(kept[-1], len(y) - 1)
+        self.assertTrue((np.diff(kept) > 0).all())
+        self.assertIn(5_000, kept)
+        self.assertAlmostEqual(np.nanmin(y[kept]), np.nanmin(y), places=3)
+
+    def test_plot_data(self):
+        """ long charts get downsampled, markers don't """
+        self.df['ma'] = self.df['close'].rolling(20).mean()
+        points = (self.df['time'].to_numpy()[::7], self.df['close'].to_numpy()[::7])
+        traces = GetPlotData(self.df, add_volume=True, plot_width=800,
+            plot_indicators=[dict(name='ma', title='ma')],
+            signals=[dict(name='entries', points=points)])
+        traces = {trace.name: trace for trace in traces}
+        self.assertLessEqual(len(traces['Candlesticks'].x), 800)
+        self.assertLessEqual(len(traces['Volume'].x), 800)
+        self.assertEqual(len(traces['ma'].x), 1_600)
+        np.testing.assert_array_equal(traces['entries'].x, points[0])
+        full = GetPlotData(self.df, plot_width=None)
+        self.assertEqual(len(full[0].x), len(self.df))
+
+    def test_category_dates(self):
+        """ dates are categories: every marker and line point of a
+        downsampled chart falls on the date of a candle kept """
+        self.df['ma'] = self.df['close'].rolling(20).mean()
+        points = (self.df['time'].to_numpy()[::7], self.df['close'].to_numpy()[::7])
+        traces = GetPlotData(self.df, plot_width=800, convert_to_date=True,
+            plot_indicators=[dict(name='ma', title='ma')],
+            signals=[dict(name='entries', points=points)])
+        traces = {trace.name: trace for trace in traces}
+        self.assertLessEqual(len(traces['Candlesticks'].x), 800)
+        self.assertEqual(len(traces['ma'].x), 1_600)
+        categories = set(traces['Candlesticks'].x)
+        self.assertTrue(set(traces['entries'].x) <= categories)
+        self.assertTrue(set(traces['ma'].x) <= categories)
+        # markers are drawn on the candle they fall in
+        ohlc = downsample_ohlc(self.df, 800)
+        candle = np.searchsorted(ohlc['time'], points[0], side='right') - 1
+        np.testing.assert_array_equal(traces['entries'].x,
+            ohlc['date'].to_numpy()[candle])
+
+if __name__ == '__main__':
+    unittest.main()
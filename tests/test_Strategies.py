@@ -0,0 +1,511 @@
+import os
+import sys
+curr_path = os.path.abspath(__file__)
+root_path = os.path.abspath(
+    os.path.join(curr_path, os.path.pardir, os.path.pardir))
+sys.path.insert(1, root_path)
+
+from pyjuque.Backtester import Backtester
+from pyjuque.Strategies import StrategyTemplate, IndicatorCache, VectorStrategy, \
+    strategy_signals, latest_signal, default_cache
+from pyjuque.Strategies.IndicatorCache import cache_from_config
+from pyjuque.Strategies.StreamingIndicators import StreamingIndicator, \
+    EMA, SMA, RSI, BollingerBands, ATR, MACD
+from pyjuque.Strategies.StreamingStrategy import StreamingStrategy
+from pyjuque.Strategies import Indicators
+from pyjuque.Strategies.EMACrossStrategy import EMACrossStrategy
+from pyjuque.Strategies.BBRSIStrategy import BBRSIStrategy
+from pyjuque.Strategies.MomentumStrategy import MomentumStrategy
+from examples.Benchmark_Indicators import LoopMomentum, LoopEMACross, \
+    LoopBBRSI, random_walk
+from pyjuque.Strategies.IndicatorGraph import Node, Column, IndicatorGraph, \
+    GraphStrategy, topological_order
+from pyjuque.Engine.BacktesterSundayTheQuant import Backtester as SundayBacktester
+import unittest
+import functools
+import numpy as np
+import pandas
+
+
+def sma(close, period):
+    return close.rolling(period).mean().values
+
+
+class CachedCrossStrategy(StrategyTemplate):
+    """ Goes long when close crosses above its moving average """
+    def __init__(self, period=20):
+        self.period = period
+
+    def setUp(self, df):
+        ma = self.computeIndicator('sma', sma, df['close'], period=self.period)
+        above = (df['close'].values > ma).astype(int)
+        self.long_signals = (np.diff(above, prepend=0) == 1).astype(int)
+        self.short_signals = (np.diff(above, prepend=0) == -1).astype(int)
+        self.dataframe = df
+
+    def checkLongSignal(self, i):
+        return self.long_signals[i]
+
+    def checkShortSignal(self, i):
+        return self.short_signals[i]
+
+
+class TestIndicatorCache(unittest.TestCase):
+
+    def setUp(self):
+        self.df = pandas.read_csv('tests/data/BTCUSD_1m_1k.csv')
+
+    def test_lookup(self):
+        """ identical data and params are only computed once """
+        cache = IndicatorCache()
+        calls = []
+        def counted_sma(close, period):
+            calls.append(period)
+            return sma(close, period)
+        first = cache.compute('sma', counted_sma, self.df['close'], period=10)
+        second = cache.compute('sma', counted_sma, self.df['close'].copy(), period=10)
+        self.assertIs(first, second)
+        self.assertFalse(first.flags.writeable)
+        cache.compute('sma', counted_sma, self.df['close'], period=20)
+        cache.compute('sma', counted_sma, self.df['close'] * 2, period=10)
+        self.assertEqual(calls, [10, 20, 10])
+        self.assertEqual((cache.hits, cache.misses), (1, 3))
+
+    def test_memory_budget(self):
+        """ least recently used values are dropped past the budget """
+        cache = IndicatorCache(max_bytes=3 * 8 * len(self.df))
+        for period in (10, 20, 30):
+            cache.compute('sma', sma, self.df['close'], period=period)
+        # touch period 10 so that period 20 is the least recently used
+        cache.compute('sma', sma, self.df['close'], period=10)
+        cache.compute('sma', sma, self.df['close'], period=40)
+        self.assertEqual(len(cache), 3)
+        self.assertLessEqual(cache.n_bytes, cache.max_bytes)
+        self.assertNotIn(cache.key('sma', self.df['close'], period=20), cache)
+        self.assertIn(cache.key('sma', self.df['close'], period=10), cache)
+
+    def test_backtester_opt_in(self):
+        """ backtests sharing a cache reuse the strategy's indicators """
+        cache = IndicatorCache()
+        bot_config = {
+            'strategy': {'class': CachedCrossStrategy, 'params': {'period': 20}},
+            'entry_settings' : {'trade_amount': 1_000, 'fee': 0.1},
+            'exit_settings' : {},
+            'indicator_cache': cache,
+        }
+        results = []
+        for stop_loss in (0.1, 0.2, 0.5):
+            bot_config['exit_settings']['stop_loss_value'] = stop_loss
+            bt = Backtester(bot_config)
+            bt.backtest(self.df)
+            results.append(bt.return_results())
+        self.assertEqual((cache.hits, cache.misses), (2, 1))
+        del bot_config['indicator_cache']
+        bt = Backtester(bot_config)
+        bt.backtest(self.df)
+        self.assertIsNone(bt.strategy.indicator_cache)
+        self.assertEqual(bt.return_results()['pnl_ratio'], results[-1]['pnl_ratio'])
+        self.assertIs(cache_from_config({'indicator_cache': True}), default_cache)
+        self.assertIsNone(cache_from_config({'indicator_cache': False}))
+
+    def test_strategies_sharing_names(self):
+        """ indicators of the same name computed by different functions
+        don't collide """
+        cache = IndicatorCache()
+        strategy = CachedCrossStrategy(20)
+        strategy.indicator_cache = cache
+        ema = lambda close, period: close.ewm(span=period).mean().values
+        ma = strategy.computeIndicator('ma', sma, self.df['close'], period=20)
+        other = strategy.computeIndicator('ma', ema, self.df['close'], period=20)
+        self.assertFalse(np.allclose(ma, other, equal_nan=True))
+        self.assertIs(strategy.computeIndicator('ma', sma, self.df['close'],
+            period=20), ma)
+        # array params are keyed by their values, not their truncated repr
+        weights = np.ones(2_000)
+        weighted = lambda close, weights: close.values * weights[:len(close)]
+        first = cache.compute('w', weighted, self.df['close'], weights=weights)
+        weights = weights.copy()
+        weights[1_500] = 2.
+        second = cache.compute('w', weighted, self.df['close'], weights=weights)
+        self.assertIsNot(first, second)
+        # lambdas sharing a name aren't cached
+        double = lambda close: close.values * 2
+        half = lambda close: close.values / 2
+        doubled = strategy.computeIndicator('scaled', double, self.df['close'])
+        halved = strategy.computeIndicator('scaled', half, self.df['close'])
+        np.testing.assert_array_equal(halved, self.df['close'].values / 2)
+        self.assertTrue(doubled.flags.writeable)
+
+    def test_cached_series(self):
+        """ Series and DataFrames handed out can't change the cached ones """
+        cache = IndicatorCache()
+        rolling = lambda close, period: close.rolling(period).mean()
+        first = cache.compute('ma', rolling, self.df['close'], period=10)
+        first.iloc[-1] = 0.
+        second = cache.compute('ma', rolling, self.df['close'], period=10)
+        second.iloc[-2] = 0.
+        third = cache.compute('ma', rolling, self.df['close'], period=10)
+        np.testing.assert_array_equal(third, sma(self.df['close'], 10))
+        self.assertEqual(cache.hits, 2)
+
+
+class VectorCrossStrategy(VectorStrategy):
+    """ CachedCrossStrategy on the vectorized API """
+    def __init__(self, period=20):
+        self.period = period
+
+    def setUp(self, df):
+        above = (df['close'].values > sma(df['close'], self.period)).astype(int)
+        self.long_signals = np.diff(above, prepend=0) == 1
+        self.short_signals = np.diff(above, prepend=0) == -1
+        self.dataframe = df
+
+
+class IndexCrossStrategy(StrategyTemplate):
+    """ The same strategy, only answering per index, as (signal, None) """
+    def __init__(self, period=20):
+        self.period = period
+
+    def setUp(self, df):
+        self.close = df['close'].values
+        self.ma = sma(df['close'], self.period)
+        self.dataframe = df
+
+    def _above(self, i):
+        return i >= 0 and self.close[i] > self.ma[i]
+
+    def checkLongSignal(self, i):
+        return self._above(i) and not self._above(i - 1), None
+
+    def checkShortSignal(self, i):
+        return self._above(i - 1) and not self._above(i), None
+
+
+class TestVectorStrategy(unittest.TestCase):
+
+    def setUp(self):
+        self.df = pandas.read_csv('tests/data/BTCUSD_1m_1k.csv')
+
+    def test_adapter(self):
+        """ per index strategies get the signals of vectorized ones """
+        vector, index = VectorCrossStrategy(), IndexCrossStrategy()
+        vector.setUp(self.df)
+        index.setUp(self.df)
+        long_signals, short_signals = strategy_signals(index, len(self.df))
+        np.testing.assert_array_equal(long_signals, vector.long_signals)
+        np.testing.assert_array_equal(short_signals, vector.short_signals)
+        self.assertGreater(long_signals.sum(), 0)
+        i = int(np.flatnonzero(long_signals)[-1])
+        self.assertIs(vector.checkLongSignal(i), True)
+        for n_candles in (i + 1, i + 2):
+            for short in (False, True):
+                self.assertEqual(latest_signal(index, n_candles, short),
+                    latest_signal(vector, n_candles, short))
+
+    def test_backtesters(self):
+        """ both APIs backtest the same """
+        for backtester in (Backtester, SundayBacktester):
+            results = []
+            for strategy in (VectorCrossStrategy, IndexCrossStrategy):
+                bt = backtester({
+                    'strategy': {'class': strategy, 'params': {'period': 20}},
+                    'starting_balance': 1000,
+                    'entry_settings' : {'trade_amount': 1_000, 'fee': 0.1},
+                    'exit_settings' : {'exit_on_signal': True, 'sell_on_end': True},
+                })
+                bt.backtest(self.df)
+                if backtester is Backtester:
+                    result = bt.return_results()
+                    result.pop('strategy_name')
+                    results.append(result)
+                else:
+                    results.append((bt.entries, bt.exits))
+            self.assertEqual(str(results[0]), str(results[1]))
+
+
+class StreamingCrossStrategy(StreamingStrategy):
+    """ Goes long when the close crosses above its EMA, while the RSI is
+    not overbought """
+    minimum_period = 50
+
+    def createIndicators(self):
+        return dict(ema=EMA(20), rsi=RSI(14))
+
+    def computeSignals(self, current, previous):
+        if previous is None:
+            return False, False
+        above = current['close'] > current['ema']
+        was_above = previous['close'] > previous['ema']
+        return above and not was_above and current['rsi'] < 70, \
+            was_above and not above
+
+
+class TestStreamingIndicators(unittest.TestCase):
+
+    def setUp(self):
+        self.df = pandas.read_csv('tests/data/BTCUSD_1m_1k.csv')
+
+    def stream(self, indicator):
+        candles = self.df.to_dict('records')
+        # peeking gives the value of updating, without changing the state
+        values = []
+        for candle in candles:
+            peeked = indicator.peek(candle)
+            values.append(indicator.update(candle))
+            if values[-1] is not None:
+                np.testing.assert_allclose(peeked, values[-1])
+        return np.array(values[1:] if values[0] is None else values,
+            dtype=np.float64)
+
+    def test_moving_averages(self):
+        close = self.df['close']
+        np.testing.assert_allclose(self.stream(EMA(20)),
+            close.ewm(span=20, adjust=False).mean())
+        np.testing.assert_allclose(self.stream(SMA(20))[19:],
+            close.rolling(20).mean()[19:])
+        bands = self.stream(BollingerBands(20, 2.))
+        middle, std = close.rolling(20).mean(), close.rolling(20).std(ddof=0)
+        np.testing.assert_allclose(bands[19:, 1], middle[19:])
+        np.testing.assert_allclose(bands[19:, 2], (middle + 2 * std)[19:])
+        macd = self.stream(MACD(12, 26, 9))
+        line = close.ewm(span=12, adjust=False).mean() \
+            - close.ewm(span=26, adjust=False).mean()
+        np.testing.assert_allclose(macd[:, 0], line, atol=1e-9)
+        np.testing.assert_allclose(macd[:, 1],
+            line.ewm(span=9, adjust=False).mean(), atol=1e-9)
+
+    def test_wilder(self):
+        change = self.df['close'].diff()
+        gain = change.clip(lower=0).iloc[1:].ewm(alpha=1/14, adjust=False).mean()
+        loss = (-change).clip(lower=0).iloc[1:].ewm(alpha=1/14, adjust=False).mean()
+        np.testing.assert_allclose(self.stream(RSI(14)),
+            100 - 100 / (1 + gain / loss))
+        previous = self.df['close'].shift(1)
+        true_range = pandas.concat([self.df['high'] - self.df['low'],
+            (self.df['high'] - previous).abs(),
+            (self.df['low'] - previous).abs()], axis=1).max(axis=1)
+        np.testing.assert_allclose(self.stream(ATR(14)),
+            true_range.ewm(alpha=1/14, adjust=False).mean())
+
+    def test_abstract(self):
+        """ indicators missing update or peek can't be created """
+        class Incomplete(StreamingIndicator):
+            def update(self, candle):
+                return candle
+        with self.assertRaises(TypeError):
+            Incomplete()
+
+    def test_strategy_ticks(self):
+        """ setting a strategy up on every tick's window gives the signals
+        of setting it up once on all candles """
+        full = StreamingCrossStrategy()
+        full.setUp(self.df)
+        live = StreamingCrossStrategy()
+        n_window = live.minimum_period
+        for end in range(n_window, len(self.df) + 1):
+            window = self.df.iloc[end - n_window:end].reset_index(drop=True)
+            live.setUp(window)
+            # entry and exit checks set up on the same frame again
+            live.setUp(window)
+            for short in (False, True):
+                self.assertEqual(latest_signal(live, n_window, short),
+                    full.checkShortSignal(end - 1) if short
+                    else full.checkLongSignal(end - 1))
+        self.assertGreater(strategy_signals(full, len(self.df))[0].sum(), 0)
+
+    def test_strategy_symbols(self):
+        """ a strategy set up on the candles of two symbols in turn keeps
+        their indicators apart """
+        flat = self.df.copy()
+        flat[['open', 'high', 'low', 'close']] = 1.
+        live = StreamingCrossStrategy()
+        live.setUp(self.df.assign(close=100.))
+        live.setUp(flat)
+        self.assertEqual(live.current['ema'], 1.)
+        frames = [self.df, self.df.iloc[::-1].assign(time=self.df['time'].to_numpy())]
+        fulls = []
+        for df in frames:
+            fulls.append(StreamingCrossStrategy())
+            fulls[-1].setUp(df.reset_index(drop=True))
+        live = StreamingCrossStrategy()
+        n_window = live.minimum_period
+        emas = [df['close'].ewm(span=20, adjust=False).mean().to_numpy()
+            for df in frames]
+        for end in range(n_window, len(self.df) + 1):
+            for df, full, ema in zip(frames, fulls, emas):
+                window = df.iloc[end - n_window:end].reset_index(drop=True)
+                live.setUp(window)
+                self.assertEqual(latest_signal(live, n_window),
+                    full.checkLongSignal(end - 1))
+                self.assertAlmostEqual(live.current['ema'], ema[end - 1])
+        self.assertEqual(len(live.streams), 2)
+
+
+class TestIndicators(unittest.TestCase):
+
+    def setUp(self):
+        self.df = pandas.read_csv('tests/data/BTCUSD_1m_1k.csv')
+
+    def test_match_streaming(self):
+        """ vectorized indicators take the values streaming ones update to """
+        candles = self.df.to_dict('records')
+        close, high, low = self.df['close'], self.df['high'], self.df['low']
+        pairs = [
+            (Indicators.ema(close, 20), EMA(20)),
+            (Indicators.sma(close, 20), SMA(20)),
+            (Indicators.rsi(close, 14), RSI(14)),
+            (np.column_stack(Indicators.bollinger_bands(close, 20)),
+                BollingerBands(20)),
+            (Indicators.atr(high, low, close, 14), ATR(14)),
+            (np.column_stack(Indicators.macd(close)), MACD()),
+        ]
+        for vector, streaming in pairs:
+            values = [streaming.update(candle) for candle in candles]
+            ready = ~np.isnan(vector)
+            values = np.array([np.nan if value is None else value
+                for value in values], dtype=np.float64)
+            np.testing.assert_allclose(vector[ready], values[ready], rtol=1e-7)
+            self.assertLessEqual(np.isnan(vector.reshape(len(vector), -1))
+                .any(axis=1).sum(), streaming.period)
+
+    def test_momentum(self):
+        close = self.df['close'].to_numpy()
+        rising, falling = Indicators.momentum(close, 3)
+        for i in range(len(close)):
+            changes = np.diff(close[max(i - 3, 0):i + 1])
+            self.assertEqual(rising[i], i >= 3 and bool((changes > 0).all()))
+            self.assertEqual(falling[i], i >= 3 and bool((changes < 0).all()))
+
+    def test_ported_strategies(self):
+        """ ports of the example strategies load by name and backtest """
+        for name, params in [('BBRSIStrategy', {'bb_len': 20}),
+            ('MomentumStrategy', {'momentum_period': 3}),
+            ('EMACrossStrategy', {})]:
+            bt = Backtester({
+                'strategy': {'class': name, 'params': params},
+                'entry_settings' : {'trade_amount': 1_000, 'fee': 0.1},
+                'exit_settings' : {'take_profit': 1, 'stop_loss_value': 1,
+                    'exit_on_signal': True},
+            })
+            bt.backtest(self.df)
+            self.assertIsInstance(bt.strategy, VectorStrategy)
+            self.assertGreater(len(bt.trades), 0, name)
+
+    def test_ported_signals(self):
+        """ ports give the signals of the example strategies they come from,
+        checked candle by candle """
+        for df in (self.df, random_walk(5_000)):
+            for loop, vector in [(LoopMomentum(3), MomentumStrategy(3)),
+                (LoopEMACross(), EMACrossStrategy()),
+                (LoopBBRSI(bb_len=20), BBRSIStrategy(bb_len=20))]:
+                loop.setUp(df.copy())
+                vector.setUp(df.copy())
+                expected = strategy_signals(loop, len(df))
+                self.assertGreater(np.count_nonzero(expected[0]), 0)
+                np.testing.assert_array_equal(vector.long_signals,
+                    expected[0].astype(bool))
+                np.testing.assert_array_equal(vector.short_signals,
+                    expected[1].astype(bool))
+
+
+calls = []
+
+def counted_ema(close, period):
+    calls.append(period)
+    return Indicators.ema(close, period)
+
+
+class GraphEMACross(GraphStrategy):
+    """ EMACrossStrategy with its indicators declared as a graph """
+    def __init__(self, fast_ma_len=10, slow_ma_len=50):
+        self.fast_ma_len = fast_ma_len
+        self.slow_ma_len = slow_ma_len
+
+    def declareIndicators(self):
+        close = Column('close')
+        return dict(
+            slow_ma = Node(counted_ema, close, period=self.slow_ma_len),
+            fast_ma = Node(counted_ema, close, period=self.fast_ma_len),
+            # declared again by the exit rule
+            exit_ma = Node(counted_ema, 'close', period=self.slow_ma_len))
+
+    def computeSignals(self, values, df):
+        low, close = df['low'].to_numpy(), df['close'].to_numpy()
+        slow, fast = values['slow_ma'], values['fast_ma']
+        slow_1, fast_1 = Indicators.shift(slow), Indicators.shift(fast)
+        long_signals = (Indicators.shift(low) < slow_1) & (low > slow) \
+            & (low > fast) & (fast > slow)
+        exit_ma = values['exit_ma']
+        short_signals = ((Indicators.shift(low) > Indicators.shift(exit_ma))
+            | (fast_1 > Indicators.shift(exit_ma))) & (close < exit_ma) \
+            & (close < fast) & (fast < exit_ma)
+        return long_signals, short_signals
+
+
+class TestIndicatorGraph(unittest.TestCase):
+
+    def setUp(self):
+        self.df = pandas.read_csv('tests/data/BTCUSD_1m_1k.csv')
+        calls.clear()
+
+    def test_shared_nodes(self):
+        """ nodes are computed once across rules and strategies """
+        graph = IndicatorGraph(IndicatorCache())
+        strategies = [GraphEMACross(10, 50), GraphEMACross(20, 50)]
+        for strategy in strategies:
+            strategy.graph = graph
+            strategy.setUp(self.df)
+        self.assertEqual(sorted(calls), [10, 20, 50])
+        self.assertIs(strategies[0].values['slow_ma'], strategies[1].values['exit_ma'])
+        # other candles get their own values
+        strategies[0].setUp(self.df.iloc[:500])
+        self.assertEqual(sorted(calls), [10, 10, 20, 50, 50])
+        reference = EMACrossStrategy(20, 50)
+        reference.setUp(self.df)
+        np.testing.assert_array_equal(strategies[1].long_signals, reference.long_signals)
+        np.testing.assert_array_equal(strategies[1].short_signals, reference.short_signals)
+
+    def test_topological_order(self):
+        close = Column('close')
+        lower, middle, upper = Node(Indicators.bollinger_bands, close,
+            period=20).outputs(3)
+        width = Node(np.subtract, upper, lower)
+        signal = Node(np.greater, close, Node(Indicators.ema, width, period=5))
+        order = [node.key for node in topological_order([signal, width, middle])]
+        self.assertEqual(len(order), len(set(order)))
+        for node in topological_order([signal]):
+            for i in node.inputs:
+                self.assertLess(order.index(i.key), order.index(node.key))
+        values = IndicatorGraph(IndicatorCache()).evaluate(
+            dict(width=width, middle=middle), self.df)
+        bands = Indicators.bollinger_bands(self.df['close'], 20)
+        np.testing.assert_array_equal(values['width'], bands[2] - bands[0])
+        np.testing.assert_array_equal(values['middle'], bands[1])
+
+    def test_node_keys(self):
+        """ lambdas aren't cached, partials and array params are told
+        apart by their values """
+        graph = IndicatorGraph(IndicatorCache())
+        close = Column('close')
+        for offset in (1., 2.):
+            shifted = Node(lambda x: x + offset, close)
+            smooth = Node(Indicators.ema, shifted, period=5)
+            self.assertFalse(shifted.cached or smooth.cached)
+            values = graph.evaluate(dict(smooth=smooth), self.df)
+            np.testing.assert_allclose(values['smooth'],
+                Indicators.ema(self.df['close'] + offset, 5))
+        weights = [np.zeros(2_000), np.zeros(2_000)]
+        weights[1][1_000] = 1
+        keys = {Node(np.dot, close, b=w).key for w in weights}
+        self.assertEqual(len(keys), 2)
+        partials = [Node(functools.partial(Indicators.ema, period=p), close)
+            for p in (5, 10, 5)]
+        self.assertTrue(all(node.cached for node in partials))
+        self.assertEqual(len({node.key for node in partials}), 2)
+        values = graph.evaluate(dict(fast=partials[0], slow=partials[1]), self.df)
+        np.testing.assert_array_equal(values['slow'],
+            Indicators.ema(self.df['close'], 10))
+
+
+if __name__ == '__main__':
+    unittest.main()